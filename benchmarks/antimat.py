@@ -0,0 +1,85 @@
+# coding=UTF-8
+"""
+Бенчмарк антимата: одна регулярка bad_words_re против нее же с ObscenePrefilter.
+
+По умолчанию гоняется сгенерированный корпус, похожий на сообщения в чате (в небольшой части
+сообщений есть мат). Можно подсунуть свой файл -- одно сообщение на строку.
+Заодно проверяется, что оба варианта находят одни и те же слова.
+
+    python -m benchmarks.antimat
+    python -m benchmarks.antimat --corpus messages.txt
+"""
+
+import argparse
+import random
+import time
+from typing import List
+
+from src.modules.antimat.antimat import ObsceneConf, ObsceneWordsFilter, get_default_filter
+
+WORDS = (
+    'я ты он она мы вы они это что как так вот там тут где когда если только уже еще ну да нет '
+    'не ни и а но или же ли бы то все всё всех себя себе тебя тебе меня мне нас вас их его ее '
+    'привет пока спасибо пожалуйста сегодня завтра вчера утром вечером ночью сейчас потом '
+    'работа работе дома домой город машина метро погода дождь снег солнце холодно жарко '
+    'чат бот сообщение ссылка картинка фотка видос стикер мем кек лол ахах хаха ору '
+    'хлеб команда ребята себя учебу стеб мебель рубля требует употреблять психую небо '
+    'думаю знаю хочу могу буду надо нужно можно нельзя давай пойдем смотри слушай '
+    'хороший плохой новый старый большой маленький странный нормально отлично '
+    'python код баг фича релиз сервер база редис деплой тест тесты '
+    'https://example.com/page?id=1 #хештег @username 42 100500 2019'
+).split()
+BAD_WORDS = 'блять хуй пиздец нахуя охуеть заебали ебать бля хуйня ёбаный долбоёб'.split()
+
+
+def generate_corpus(size: int, obscene_share: float) -> List[str]:
+    corpus = []
+    for _ in range(size):
+        words = random.choices(WORDS, k=random.randint(1, 25))
+        if random.random() < obscene_share:
+            words.insert(random.randrange(len(words) + 1), random.choice(BAD_WORDS))
+        text = ' '.join(words)
+        corpus.append(text.capitalize() if random.random() < 0.5 else text)
+    return corpus
+
+
+def run(words_filter: ObsceneWordsFilter, corpus: List[str]) -> float:
+    start = time.perf_counter()
+    for text in corpus:
+        sum(1 for _ in words_filter.find_bad_word_matches_without_good_words(text))
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', help='файл с сообщениями, по одному на строку')
+    parser.add_argument('--size', type=int, default=20000)
+    parser.add_argument('--obscene-share', type=float, default=0.05)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(42)
+    if args.corpus:
+        with open(args.corpus, 'r', encoding='utf-8') as f:
+            corpus = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        corpus = generate_corpus(args.size, args.obscene_share)
+
+    regexp = ObsceneWordsFilter(ObsceneConf.bad_words_re, ObsceneConf.good_words_re)
+    prefiltered = get_default_filter()
+
+    for text in corpus:
+        expected = [m.group(0) for m in regexp.find_bad_word_matches_without_good_words(text)]
+        actual = [m.group(0) for m in prefiltered.find_bad_word_matches_without_good_words(text)]
+        assert expected == actual, f'{text}: {expected} != {actual}'
+
+    chars = sum(len(text) for text in corpus)
+    print(f'{len(corpus)} messages, {chars / len(corpus):.0f} chars avg')
+    for name, words_filter in (('regexp', regexp), ('prefilter', prefiltered)):
+        elapsed = min(run(words_filter, corpus) for _ in range(args.repeat))
+        print(f'{name:>10}: {elapsed * 1000:8.1f} ms, {len(corpus) / elapsed:10.0f} msg/s, '
+              f'{elapsed / len(corpus) * 1e6:6.1f} us/msg')
+
+
+if __name__ == '__main__':
+    main()
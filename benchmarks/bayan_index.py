@@ -0,0 +1,92 @@
+# coding=UTF-8
+"""
+Бенчмарк поиска похожих фоток баянометра: перебор всех phash чата против HammingIndex.
+
+История чата -- случайные 64-битные хеши. Часть запросов -- чуть измененные хеши из истории
+(пережатые и обрезанные фотки), остальные -- новые фотки. Редис имитируется словарем
+с задержкой на каждый запрос, поэтому время HammingIndex -- это один запрос плюс проверка
+кандидатов. Заодно проверяется, что оба способа находят одно и то же.
+
+    python -m benchmarks.bayan_index
+    python -m benchmarks.bayan_index --photos 100000 --max-distance 7
+"""
+
+import argparse
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from src.utils.hamming_index import HammingIndex, hamming_distance
+
+
+class FakeRedis:
+    def __init__(self, rtt: float) -> None:
+        self.rtt = rtt
+        self.sorted_sets: Dict[str, Dict[str, int]] = {}
+        self.requests = 0
+        self.keys_read = 0
+
+    @contextmanager
+    def batch(self):
+        yield self
+
+    def add_to_sorted_set(self, key: str, scores: Dict[str, int], time=None,
+                          min_score=None) -> None:
+        self.sorted_sets.setdefault(key, {}).update(scores)
+
+    def get_sorted_sets(self, keys: List[str]) -> List[List[Tuple[str, int]]]:
+        self.requests += 1
+        self.keys_read += len(keys)
+        time.sleep(self.rtt)
+        return [list(self.sorted_sets.get(key, {}).items()) for key in keys]
+
+
+def flip_bits(value: int, count: int) -> int:
+    for position in random.sample(range(64), count):
+        value ^= 1 << position
+    return value
+
+
+def brute_force(history: List[int], value: str, max_distance: int) -> List[Tuple[str, int]]:
+    number = int(value, 16)
+    found = [(f'{other:016x}', hamming_distance(number, other)) for other in history]
+    return sorted((item for item in found if item[1] <= max_distance),
+                  key=lambda item: (item[1], item[0]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--photos', type=int, default=50000, help='фоток в истории чата')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--max-distance', type=int, default=4)
+    parser.add_argument('--rtt-ms', type=float, default=0.2, help='задержка одного запроса, мс')
+    args = parser.parse_args()
+
+    random.seed(42)
+    history = [random.getrandbits(64) for _ in range(args.photos)]
+    redis = FakeRedis(args.rtt_ms / 1000)
+    index = HammingIndex(redis, 'bayanometer:phash_index', ttl=10 ** 9)
+    for value in history:
+        index.add(-1001234567890, f'{value:016x}', 1)
+    queries = [f'{flip_bits(random.choice(history), random.randint(0, args.max_distance + 2)):016x}'
+               if random.random() < 0.5 else f'{random.getrandbits(64):016x}'
+               for _ in range(args.queries)]
+    redis.requests = redis.keys_read = 0
+
+    print(f'{args.photos} photos, {args.queries} queries, max distance {args.max_distance}')
+    results = []
+    for name, find in (('brute', lambda q: brute_force(history, q, args.max_distance)),
+                       ('index', lambda q: index.find(-1001234567890, q, args.max_distance))):
+        start = time.perf_counter()
+        results.append([find(query) for query in queries])
+        elapsed = time.perf_counter() - start
+        print(f'{name:>8}: {elapsed / len(queries) * 1000:8.3f} ms/query')
+    print(f'index reads {redis.keys_read / redis.requests:.0f} keys per query')
+    found = sum(1 for result in results[1] if result)
+    print(f'{found} queries found similar photos')
+    assert results[0] == results[1], 'results differ'
+
+
+if __name__ == '__main__':
+    main()
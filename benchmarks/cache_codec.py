@@ -0,0 +1,96 @@
+# coding=UTF-8
+"""
+Бенчмарк сериализации кэша: pickle (как было до CacheCodec) против CacheCodec.
+
+Для каждого семейства ключей берется типичное значение и замеряется время encode/decode
+и размер того, что ляжет в редис.
+
+    python -m benchmarks.cache_codec
+"""
+
+import argparse
+import copyreg
+import datetime
+import pickle
+import random
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Callable, Iterator, List, Tuple
+
+from src.models.chat_user import ChatUser
+from src.models.user import User
+from src.modules.bayanometer import Photo
+from src.utils.codec import codec
+
+LEGACY_PROTOCOL = 3  # протокол pickle по умолчанию на python 3.6
+
+
+def get_families() -> List[Tuple[str, Any]]:
+    random.seed(42)
+    uids = [random.randrange(10 ** 8, 10 ** 9) for _ in range(60)]
+    now = datetime.datetime.now().replace(microsecond=0)
+    reply_top = {uid: {to_uid: random.randrange(1, 300) for to_uid in random.sample(uids, 20)}
+                 for uid in uids}
+    return [
+        ('user:{uid}', User(1, uids[0], 'username', 'Имя Фамилия', False, True)),
+        ('chat_user:{uid}:{cid}', ChatUser(1, uids[0], -1001234567890, False)),
+        ('bayanometer:photo:*', Photo(123456, now, uids[0])),
+        ('reply_top:*', {'to': reply_top, 'from': reply_top, 'pair': {}}),
+        ('user_domains:*', {'youtube.com': 12, 'twitter.com': 5, 'habr.com': 3, 'vk.com': 1}),
+        ('weekgoal:*:uids', uids[0:3]),
+        ('pipinder:monday_stickersets:*', {f'stickerset_{i}' for i in range(40)}),
+        ('bot_startup_time', now),
+        # как telegram.StickerSet: обычный объект, который codec пишет через pickle
+        ('stickerset:*', SimpleNamespace(name='kekopack', title='Kekopack', stickers=[
+            {'file_id': f'CAADAgAD{i:04}AAsBnlArDbqe-dxMlpgI', 'emoji': '😂', 'width': 512,
+             'height': 512}
+            for i in range(50)
+        ])),
+    ]
+
+
+@contextmanager
+def without_schemas() -> Iterator[None]:
+    """
+    Так Cache писал значения раньше: обычный pickle без схем из codec.register
+    (они регистрируются в copyreg глобально)
+    """
+    registered = {cls: copyreg.dispatch_table.pop(cls) for cls in (User, ChatUser, Photo)}
+    try:
+        yield
+    finally:
+        copyreg.dispatch_table.update(registered)
+
+
+def measure(func: Callable[[], Any], number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f'{"key family":<32}{"pickle B":>10}{"codec B":>10}'
+          f'{"pickle enc/dec us":>20}{"codec enc/dec us":>20}')
+    for name, value in get_families():
+        with without_schemas():
+            pickled = pickle.dumps(value, LEGACY_PROTOCOL)
+            pickle_enc = measure(lambda: pickle.dumps(value, LEGACY_PROTOCOL), args.number)
+            pickle_dec = measure(lambda: pickle.loads(pickled), args.number)
+        encoded = codec.dumps(value)
+        assert type(codec.loads(encoded)) is type(value), name
+        assert type(codec.loads(pickled)) is type(value), name  # старые значения читаются
+
+        codec_enc = measure(lambda: codec.dumps(value), args.number)
+        codec_dec = measure(lambda: codec.loads(encoded), args.number)
+        print(f'{name:<32}{len(pickled):>10}{len(encoded):>10}'
+              f'{pickle_enc:>10.1f}/{pickle_dec:<9.1f}{codec_enc:>10.1f}/{codec_dec:<9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# coding=UTF-8
+"""
+Бенчмарк подсчета эмодзи в UserStat.parse_message_stat: проверка каждого символа по таблице
+emoji.UNICODE_EMOJI против EmojiScanner.
+
+Корпус -- сообщения разной длины (есть и длинные простыни), в части из них есть эмодзи,
+в том числе из нескольких символов. Старый способ считает такие эмодзи по кусочкам,
+поэтому количество не сравнивается, только время.
+
+    python -m benchmarks.emoji_scanner
+    python -m benchmarks.emoji_scanner --corpus messages.txt
+"""
+
+import argparse
+import random
+import time
+from typing import Callable, List
+
+import emoji_fixed as emoji
+from src.utils.emoji_scanner import emoji_scanner
+
+WORDS = (
+    'я ты он она мы вы они это что как так вот там тут где когда если только уже еще ну да нет '
+    'привет пока спасибо пожалуйста сегодня завтра вчера утром вечером ночью сейчас потом '
+    'работа дома город машина метро погода дождь снег солнце холодно жарко '
+    'чат бот сообщение ссылка картинка фотка видос стикер мем кек лол ахах хаха ору '
+    'python код баг фича релиз сервер база редис деплой тест '
+    'https://example.com/page?id=1 #хештег @username 42 100500 2019 (c) -> ...'
+).split()
+EMOJI = ['😂', '👍', '❤️', '🔥', '🤔', '😭', '👍🏽', '🇷🇺', '👨‍👩‍👧', '🤷‍♂️', '1️⃣', '☺️']
+
+
+def generate_corpus(size: int, emoji_share: float) -> List[str]:
+    corpus = []
+    for _ in range(size):
+        length = random.randint(200, 400) if random.random() < 0.05 else random.randint(1, 25)
+        words = random.choices(WORDS, k=length)
+        if random.random() < emoji_share:
+            for _ in range(random.randint(1, 5)):
+                words.insert(random.randrange(len(words) + 1), random.choice(EMOJI))
+        corpus.append(' '.join(words))
+    return corpus
+
+
+def legacy_count(text: str) -> int:
+    return len([e for e in text if e in emoji.UNICODE_EMOJI])
+
+
+def run(count: Callable[[str], int], corpus: List[str]) -> float:
+    start = time.perf_counter()
+    for text in corpus:
+        count(text)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', help='файл с сообщениями, по одному на строку')
+    parser.add_argument('--size', type=int, default=20000)
+    parser.add_argument('--emoji-share', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(42)
+    if args.corpus:
+        with open(args.corpus, 'r', encoding='utf-8') as f:
+            corpus = [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        corpus = generate_corpus(args.size, args.emoji_share)
+
+    chars = sum(len(text) for text in corpus)
+    print(f'{len(corpus)} messages, {chars / len(corpus):.0f} chars avg, '
+          f'{max(len(text) for text in corpus)} chars max')
+    for name, count in (('legacy', legacy_count), ('scanner', emoji_scanner.count)):
+        elapsed = min(run(count, corpus) for _ in range(args.repeat))
+        print(f'{name:>10}: {elapsed * 1000:8.1f} ms, {len(corpus) / elapsed:10.0f} msg/s, '
+              f'{elapsed / len(corpus) * 1e6:6.1f} us/msg')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+# coding=UTF-8
+"""
+Прогон записанных апдейтов через все обработчики бота: add_chat_handlers, add_private_handlers
+и add_other_handlers, как в start_bot. Ловит регрессии в горячем пути (message, collect_stats,
+UserStat.add, баянометр и т.д.), которые не видны в тестах отдельных функций.
+
+Корпус -- JSONL, по апдейту в строке, в том виде, в каком их отдает getUpdates (обезличенные).
+Телеграм не трогается: запросы бота принимает FakeRequest и отвечает заглушками, а фотки
+баянометра "качаются" через FakePhotoSession, которая рисует картинку по file_id. Остальные
+внешние апи (погода, google vision) не подменяются -- их не должно быть в конфиге прогона.
+Редис и база -- настоящие, из config.json, поэтому запускать нужно с отдельным конфигом
+на локальный редис (лучше отдельная db) и sqlite/локальный mysql:
+
+    "cache": {"redis": {"host": "127.0.0.1", "port": 6379, "db": 15}},
+    "database": "sqlite:///replay.db",
+    "chats": {"-1001234567890": {...}}
+
+Чаты из корпуса должны быть в "chats", иначе chat_guard их отбросит: --chat-id подменяет чат
+всех апдейтов на один из конфига. @run_async, фоновые задачи и хеширование фоток выполняются
+сразу в потоке прогона, поэтому время апдейта -- это вся работа, которую он порождает.
+
+    python -m benchmarks.replay updates.jsonl
+    python -m benchmarks.replay updates.jsonl --chat-id -1001234567890 --repeat 3 --warmup 100
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from io import BytesIO
+from queue import Queue
+from typing import Dict, List, Optional
+
+import telegram
+from PIL import Image
+from telegram.ext import Dispatcher
+
+import src.utils.cache as cache_file
+from src.bot_start.add_handlers import add_chat_handlers, add_private_handlers, add_other_handlers
+from src.bot_start.start import instrument_dispatcher
+from src.config import CONFIG
+from src.modules.bayanometer import Photo
+from src.utils.command_index import CommandIndex
+from src.utils.db import Base, engine
+from src.utils.metrics import metrics
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Replay', 'username': 'replay_bot'}
+
+
+class FakeRequest:
+    """
+    Вместо telegram.utils.request.Request: ничего не отправляет, считает вызовы методов API
+    и возвращает минимальные ответы, из которых telegram.Bot соберет свои объекты.
+    """
+
+    def __init__(self) -> None:
+        self.calls: Counter = Counter()
+        self.message_ids = itertools.count(1)
+        self.con_pool_size = 1
+
+    def post(self, url: str, data: dict, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        self.calls[method] += 1
+        if method == 'getMe':
+            return BOT_USER
+        if method.startswith(('send', 'forward', 'edit')):
+            return {'message_id': next(self.message_ids), 'date': int(time.time()),
+                    'chat': {'id': data.get('chat_id', 0), 'type': 'supergroup'},
+                    'from': BOT_USER}
+        if method == 'getChat':
+            return {'id': data.get('chat_id', 0), 'type': 'supergroup'}
+        if method == 'getChatMember':
+            return {'user': {'id': data.get('user_id', 0), 'is_bot': False, 'first_name': 'User'},
+                    'status': 'member'}
+        if method == 'getChatAdministrators':
+            return []
+        if method == 'getChatMembersCount':
+            return 100
+        if method == 'getFile':
+            file_id = data.get('file_id')
+            return {'file_id': file_id, 'file_path': f'photos/{file_id}.jpg'}
+        return True
+
+    def get(self, url: str, timeout=None):
+        return self.post(url, {}, timeout)
+
+    def retrieve(self, url: str, timeout=None) -> bytes:
+        self.calls['retrieve'] += 1
+        return b''
+
+    def download(self, url: str, filename: str, timeout=None) -> None:
+        self.calls['download'] += 1
+
+    def stop(self) -> None:
+        pass
+
+
+class FakePhotoResponse:
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+class FakePhotoSession:
+    """
+    Вместо requests.Session баянометра: по урлу фотки рисует JPEG 640x480 из случайных блоков
+    (одинаковый для одного урла), чтобы разжатие и хеши считались как по настоящей фотке.
+    """
+
+    def __init__(self) -> None:
+        self.downloads = 0
+        self.__photos: Dict[str, bytes] = {}
+
+    def get(self, url: str, timeout=None) -> FakePhotoResponse:
+        self.downloads += 1
+        content = self.__photos.get(url)
+        if content is None:
+            rnd = random.Random(hashlib.md5(url.encode()).hexdigest())
+            image = Image.new('RGB', (640, 480))
+            for x in range(0, 640, 80):
+                for y in range(0, 480, 80):
+                    color = tuple(rnd.randrange(256) for _ in range(3))
+                    image.paste(color, (x, y, x + 80, y + 80))
+            buffer = BytesIO()
+            image.save(buffer, 'JPEG', quality=85)
+            content = self.__photos[url] = buffer.getvalue()
+        return FakePhotoResponse(content)
+
+
+def load_updates(path: str, chat_id: Optional[int] = None) -> List[dict]:
+    updates = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if chat_id is not None:
+                for key in ('message', 'edited_message'):
+                    if key in data:
+                        data[key]['chat']['id'] = chat_id
+            updates.append(data)
+    return updates
+
+
+def create_dispatcher(bot: telegram.Bot) -> Dispatcher:
+    dp = Dispatcher(bot, Queue(), workers=1)
+    # @run_async и так выполняется синхронно: время апдейта включает всю его работу
+    dp.run_async = lambda func, *args, **kwargs: func(*args, **kwargs)
+    add_chat_handlers(dp)
+    add_private_handlers(dp)
+    add_other_handlers(dp)
+    instrument_dispatcher(dp)
+    return dp
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('corpus', help='JSONL с апдейтами')
+    parser.add_argument('--chat-id', type=int, help='подменить чат всех апдейтов')
+    parser.add_argument('--repeat', type=int, default=1, help='сколько раз прогнать корпус')
+    parser.add_argument('--warmup', type=int, default=0, help='сколько апдейтов не учитывать')
+    parser.add_argument('--top', type=int, default=15, help='сколько обработчиков показать')
+    args = parser.parse_args()
+    if 'cache' not in CONFIG or 'database' not in CONFIG:
+        parser.error('config.json must contain "cache" and "database" (local redis and db)')
+
+    # db.py создает таблицы до импорта моделей: в пустой базе (sqlite) их создаем здесь
+    Base.metadata.create_all(engine)
+    request = FakeRequest()
+    bot = telegram.Bot('123456:replay', request=request)
+    photo_session = FakePhotoSession()
+    Photo.PhotoHasher.run_inline(photo_session)
+    cache_file._bot_id = bot.id
+    CommandIndex.rebuild()
+    dp = create_dispatcher(bot)
+
+    updates = load_updates(args.corpus, args.chat_id) * args.repeat
+    for data in updates[:args.warmup]:
+        dp.process_update(telegram.Update.de_json(data, bot))
+    updates = updates[args.warmup:]
+    if not updates:
+        parser.error('no updates left after warmup')
+    metrics.reset()
+    request.calls.clear()
+    photo_session.downloads = 0
+
+    latencies = []
+    start = time.perf_counter()
+    for data in updates:
+        update = telegram.Update.de_json(data, bot)
+        update_start = time.perf_counter()
+        dp.process_update(update)
+        latencies.append(time.perf_counter() - update_start)
+    elapsed = time.perf_counter() - start
+
+    count = len(updates)
+    latencies.sort()
+    print(f'{count} updates in {elapsed:.2f}s: {count / elapsed:.1f} updates/s')
+    print(f'update latency: p50={percentile(latencies, 0.5) * 1000:.2f}ms '
+          f'p99={percentile(latencies, 0.99) * 1000:.2f}ms max={latencies[-1] * 1000:.2f}ms')
+    for family in ('redis', 'sql'):
+        series = metrics.series(family)
+        total = sum(histogram.count for histogram in series.values())
+        top = sorted(series.items(), key=lambda item: -item[1].count)[:5]
+        details = ', '.join(f'{name} {histogram.count / count:.2f}' for name, histogram in top)
+        print(f'{family} calls per update: {total / count:.2f} ({details})')
+    print(f'bot api calls per update: {sum(request.calls.values()) / count:.2f} '
+          f'({", ".join(f"{name} {calls}" for name, calls in request.calls.most_common(5))})')
+    print(f'photo downloads per update: {photo_session.downloads / count:.2f}')
+
+    handlers = metrics.series('handler')
+    errors = metrics.errors('handler')
+    print(f'\n{"handler":<50} {"calls":>7} {"p50<=ms":>8} {"p99<=ms":>8} {"max ms":>8} '
+          f'{"errors":>6}')
+    for name, histogram in sorted(handlers.items(), key=lambda item: -item[1].sum)[:args.top]:
+        print(f'{name[:50]:<50} {histogram.count:>7} {histogram.percentile(0.5) * 1000:>8g} '
+              f'{histogram.percentile(0.99) * 1000:>8g} {histogram.max * 1000:>8.2f} '
+              f'{errors.get(name, 0):>6}')
+
+
+if __name__ == '__main__':
+    main()
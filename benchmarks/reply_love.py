@@ -0,0 +1,120 @@
+# coding=UTF-8
+"""
+Бенчмарк "Всей страсти" для большого чата: поиск топа каждого юзера отдельно против ReplyGraph.
+
+Раньше ReplyLove.get_all_love для каждого юзера и для каждого его партнера вызывал
+ReplyTop.get_user_top_strast. Тот каждый раз доставал из редиса (и распаковывал) всю недельную
+статистику чата, сортировал ее и делал User.get. Теперь статистика грузится один раз, топы
+считаются за один проход, юзеры грузятся пачкой.
+
+Редис имитируется pickle + задержкой на каждый запрос.
+
+    python -m benchmarks.reply_love
+"""
+
+import argparse
+import pickle
+import random
+import time
+from typing import Dict, List, Optional
+
+from src.utils.misc import get_int, sort_dict
+from src.utils.reply_graph import ReplyGraph
+
+
+def make_db(users: int, replies: int) -> dict:
+    random.seed(42)
+    uids = [random.randrange(10 ** 8, 10 ** 9) for _ in range(users)]
+    # у каждого несколько любимых собеседников и немного случайных
+    favorites = {uid: random.sample(uids, 5) for uid in uids}
+    db: dict = {'to': {}, 'from': {}, 'pair': {}, 'outbound': {}, 'inbound': {}}
+    for _ in range(replies):
+        from_uid = random.choice(uids)
+        favorite = random.random() < 0.7
+        to_uid = random.choice(favorites[from_uid] if favorite else uids)
+        db['to'][to_uid] = db['to'].get(to_uid, 0) + 1
+        db['from'][from_uid] = db['from'].get(from_uid, 0) + 1
+        pair_key = ','.join(sorted([str(from_uid), str(to_uid)]))
+        db['pair'][pair_key] = db['pair'].get(pair_key, 0) + 1
+        outbound = db['outbound'].setdefault(from_uid, {})
+        outbound[to_uid] = outbound.get(to_uid, 0) + 1
+        inbound = db['inbound'].setdefault(to_uid, {})
+        inbound[from_uid] = inbound.get(from_uid, 0) + 1
+    return db
+
+
+class FakeRedis:
+    def __init__(self, db: dict, rtt: float) -> None:
+        self.value = pickle.dumps(db)
+        self.rtt = rtt
+        self.requests = 0
+
+    def get_db(self) -> dict:
+        self.requests += 1
+        time.sleep(self.rtt)
+        return pickle.loads(self.value)
+
+    def get_user(self, uid: int) -> int:
+        self.requests += 1
+        time.sleep(self.rtt)
+        return uid
+
+    def get_users(self, uids: List[int]) -> Dict[int, int]:
+        self.requests += 1
+        time.sleep(self.rtt)
+        return {uid: uid for uid in uids}
+
+
+def legacy_top_pair(redis: FakeRedis, uid: int) -> Optional[int]:
+    """
+    Парная страсть, как ее считал ReplyTop.get_user_top_strast
+    """
+    db = redis.get_db()
+    for pair, count in sort_dict(db['pair']):
+        a_uid, b_uid = [get_int(x) for x in pair.split(',')]
+        if count < 5 or uid == a_uid == b_uid:
+            continue
+        if uid == a_uid:
+            return redis.get_user(b_uid)
+        if uid == b_uid:
+            return redis.get_user(a_uid)
+    return None
+
+
+def legacy(redis: FakeRedis, uids: List[int]) -> list:
+    all_love = [(uid, legacy_top_pair(redis, uid)) for uid in uids]
+    return [(a, b, legacy_top_pair(redis, b)) for a, b in all_love if b]
+
+
+def graph(redis: FakeRedis, uids: List[int]) -> list:
+    reply_graph = ReplyGraph(redis.get_db())
+    candidates = {uid: reply_graph.get_pair_candidates(uid)[:1] for uid in uids}
+    users = redis.get_users([c[0] for c in candidates.values() if c])
+    all_love = [(uid, users.get(candidates[uid][0]) if candidates[uid] else None) for uid in uids]
+    pairs = {b: reply_graph.get_pair_candidates(b)[:1] for _, b in all_love if b}
+    return [(a, b, pairs[b][0] if pairs[b] else None) for a, b in all_love if b]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--replies', type=int, default=50000, help='реплаев за неделю')
+    parser.add_argument('--rtt-ms', type=float, default=0.3, help='задержка одного запроса, мс')
+    args = parser.parse_args()
+
+    db = make_db(args.users, args.replies)
+    uids = list(db['from'].keys())
+    print(f'{len(uids)} users, {len(db["pair"])} pairs, {args.replies} replies')
+    print(f'{"":>8} {"time, ms":>10} {"redis requests":>15}')
+    results = []
+    for name, func in (('legacy', legacy), ('graph', graph)):
+        redis = FakeRedis(db, args.rtt_ms / 1000)
+        start = time.perf_counter()
+        results.append(func(redis, uids))
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f'{name:>8} {elapsed:>10.1f} {redis.requests:>15}')
+    assert results[0] == results[1], 'results differ'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# coding=UTF-8
+"""
+Бенчмарк блокировок в UserStat.add: один глобальный лок против StripedLock.
+
+Критическая секция повторяет UserStat.add: чтение статы из редиса, мерж, запись в редис и
+апдейт строки в mysql. Сетевые запросы имитируются задержкой. Сообщения идут из 32 потоков
+(как у диспетчера) и равномерно раскиданы по активным чатам.
+
+    python -m benchmarks.user_stat_locks
+"""
+
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from src.utils.locks import StripedLock
+
+WORKERS = 32
+
+
+class GlobalLock:
+    def __init__(self) -> None:
+        self.lock = Lock()
+
+    def get(self, *_) -> Lock:
+        return self.lock
+
+
+def add(lock, cid: int, uid: int, rtt: float) -> None:
+    with lock.get(cid, uid):
+        time.sleep(rtt)  # cache.get
+        time.sleep(rtt)  # cache.set
+        time.sleep(rtt)  # UserStatDB.update_db
+
+
+def run(lock, chats: int, messages: int, rtt: float) -> float:
+    users_per_chat = 30
+    jobs = [(random.randrange(chats), random.randrange(users_per_chat)) for _ in range(messages)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        for cid, uid in jobs:
+            executor.submit(add, lock, -cid, uid, rtt)
+    return messages / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--rtt-ms', type=float, default=0.3, help='задержка одного запроса, мс')
+    args = parser.parse_args()
+    rtt = args.rtt_ms / 1000
+
+    print(f'{"chats":>6} {"global lock, msg/s":>20} {"striped lock, msg/s":>20}')
+    for chats in (1, 2, 4, 8, 16, 32):
+        global_rate = run(GlobalLock(), chats, args.messages, rtt)
+        striped_rate = run(StripedLock(), chats, args.messages, rtt)
+        print(f'{chats:>6} {global_rate:>20.0f} {striped_rate:>20.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -147,6 +147,8 @@ def add_private_handlers(dp):
                                   filters=Filters.private & Filters.command))
     dp.add_handler(CommandHandler('weekly_stats', private.run_weekly_stats,
                                   filters=Filters.private & Filters.command))
+    dp.add_handler(CommandHandler('profile', private.profile,
+                                  filters=Filters.private & Filters.command))
     dp.add_handler(
         CommandHandler('khaleesi', khaleesi_handler.private, filters=Filters.private & Filters.command,
                        allow_edited=True))
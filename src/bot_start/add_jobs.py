@@ -1,7 +1,9 @@
 from datetime import time
 
 from src.modules.weeklystat import weekly_stats
-from src.modules.jobs import daily_midnight, daily_afternoon, health_log, every_hour
+from src.config import CONFIG
+from src.modules.jobs import daily_midnight, daily_afternoon, health_log, every_hour, \
+    flush_user_stats
 
 
 def add_jobs(updater):
@@ -32,3 +34,8 @@ def add_jobs(updater):
         health_log, first=1,
         interval=5 * 60
     )
+
+    updater.job_queue.run_repeating(
+        flush_user_stats, first=10,
+        interval=CONFIG.get('performance', {}).get('user_stats_flush_interval', 10)
+    )
@@ -4,7 +4,7 @@ from time import sleep
 
 import telegram
 from telegram.ext import Updater
-from telegram.ext.messagequeue import DelayQueueError
+from telegram.utils.request import Request
 
 import src.config as config
 import src.utils.cache as cache_file
@@ -12,8 +12,16 @@ from src.bot_start.add_handlers import add_chat_handlers, add_private_handlers,
 from src.bot_start.add_jobs import add_jobs
 from src.bot_start.google_cloud import auth_google_vision
 from src.config import CONFIG
-from src.utils.cache import cache, YEAR
+from src.models.user_stat import UserStatFlusher
+from src.modules.bayanometer import Photo
+from src.utils.background import background_executor
+from src.utils.cache import cache, tiered_cache, YEAR
+from src.utils.command_index import CommandIndex
+from src.utils.metrics import metrics
+from src.utils.profiler import profiler
 from src.utils.repair import repair_bot
+from src.utils.send_queue import send_queue
+from src.utils.telegram_helpers import QueuedBot
 from src.web.server import start_server
 
 logger = logging.getLogger(__name__)
@@ -58,6 +66,8 @@ def prepare():
     set_default_logging_format()
     if 'google_vision_client_json_file' in CONFIG:
         config.google_vision_client = auth_google_vision(CONFIG['google_vision_client_json_file'])
+    CommandIndex.rebuild()
+    tiered_cache.listen()
     cache.set('pipinder:fav_stickersets_names',
               set(CONFIG.get("sasha_rebinder_stickersets_names", [])), time=YEAR)
 
@@ -66,14 +76,27 @@ def start_bot():
     """
     Инициализация бота
     """
-    updater = Updater(token=CONFIG['bot_token'], workers=32, request_kwargs=get_request_data())
-    bot = updater.bot
+    workers = 32
+    # все исходящие сообщения идут через общую очередь с лимитами телеграма
+    send_queue.start()
+    # фоновая обработка сообщений -- в своем пуле, чтобы не мешать ответам на команды
+    background_executor.start()
+    # разовое заполнение индекса похожих фоток старыми фотками (если еще не было)
+    background_executor.submit(Photo.backfill_phash_index, name='Photo.backfill_phash_index')
+    # соединений нужно на всех: воркеры, потоки очереди, фоновые потоки и получение апдейтов
+    request = Request(con_pool_size=workers + send_queue.workers + background_executor.workers + 4,
+                      **get_request_data())
+    bot = QueuedBot(CONFIG['bot_token'], request=request)
+    updater = Updater(bot=bot, workers=workers)
     dp = updater.dispatcher
     dp.logger.addHandler(CriticalHandler())  # в логгер библиотеки добавляем свой обработчик
     add_chat_handlers(dp)
     add_private_handlers(dp)
     add_other_handlers(dp)
     dp.add_error_handler(error)
+    instrument_dispatcher(dp)
+    if CONFIG.get('performance', {}).get('profiler_enabled', False):
+        profiler.start(duration=CONFIG.get('performance', {}).get('profiler_duration', 3600))
 
     logger.info('Bot started')
     cache.set('bot_startup_time', datetime.now(), time=YEAR)
@@ -97,6 +120,28 @@ def start_bot():
     return updater
 
 
+def instrument_dispatcher(dp) -> None:
+    """
+    Время и ошибки каждого обработчика в metrics: колбэки оборачиваются в потоке диспетчера
+    (семейство handler), а тела @run_async -- в пуле диспетчера (семейство run_async).
+    """
+    for handlers in dp.handlers.values():
+        for handler in handlers:
+            handler.callback = metrics.timer('handler')(handler.callback)
+
+    run_async = dp.run_async
+    timed_funcs = {}
+
+    def timed_run_async(func, *args, **kwargs):
+        timed_func = timed_funcs.get(func)
+        if timed_func is None:
+            timed_func = timed_funcs.setdefault(func, metrics.timer('run_async')(func))
+        return run_async(timed_func, *args, **kwargs)
+
+    # декоратор run_async берет диспетчер через Dispatcher.get_instance() и зовет его run_async
+    dp.run_async = timed_run_async
+
+
 def get_request_data():
     read_timeout = 10.
     connect_timeout = 10.
@@ -121,12 +166,11 @@ def start():
         updater = start_bot()
         start_server(updater.bot, '5010')
         updater.idle()
-    except DelayQueueError as e:
-        if str(e) == 'Could not process callback in stopped thread':
-            logger.critical(f'[start] {str(e)}')
-            repair_bot(logger=logger)
-            return
-        raise e
+        profiler.stop()
+        background_executor.stop(timeout=30)
+        send_queue.stop(timeout=30)
+        # дописываем в бд то, что не успел записать flush_user_stats
+        UserStatFlusher.flush()
     except Exception as e:
         if isinstance(e, telegram.error.RetryAfter):
             logger.critical(f'[start] Flood limit, wait 5 sec')
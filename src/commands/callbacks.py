@@ -8,7 +8,7 @@ from src.dayof.day_manager import DayOfManager
 from src.modules.antimat.matshowtime import MatshowtimeHandlers
 from src.commands.spoiler import SpoilerHandlers
 from src.commands.i_stat.command_handlers import callback_handler as istat_callback_handler
-from src.utils.cache import cache
+from src.utils.callback_helpers import callback_registry
 from src.utils.logger_helpers import get_logger
 
 logger = get_logger(__name__)
@@ -17,7 +17,7 @@ logger = get_logger(__name__)
 @run_async
 def callback_handler(bot: telegram.Bot, update: telegram.Update) -> None:
     query = update.callback_query
-    data = cache.get(f'callback:{query.data}')
+    data = callback_registry.get(query.data)
     if not data:
         return
     if data['name'] == '/off':
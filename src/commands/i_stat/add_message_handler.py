@@ -1,33 +1,30 @@
-from threading import Lock
-
 import telegram
 
 from src.commands.i_stat.anticheat import cheats_found
 from src.commands.i_stat.banhammer import is_banned, ban
 from src.commands.i_stat.db import RedisChatStatistician
+from src.commands.i_stat.i_stat import ChatStatistician, sum_count
 from src.utils.logger_helpers import get_logger
 
 logger = get_logger(__name__)
 
 
 class IStatAddMessage(object):
-    lock = Lock()
-
     @classmethod
     def add_message(cls, message: telegram.Message) -> None:
+        # в большинстве сообщений местоимений нет, и тогда в редис ходить незачем
+        counts = ChatStatistician.count_message(message)
+        if not counts:
+            return
+
         user_id = message.from_user.id
         chat_id = message.chat_id
         if is_banned(chat_id, user_id):
             return
 
-        with cls.lock:
-            rs = RedisChatStatistician(chat_id)
-            rs.load()
-
-            sums = rs.chat_statistician.add_message(message)
-            if cheats_found(chat_id, user_id, sums):
-                ban(chat_id, user_id, False, 6 * 60 * 60)  # 6h
-                logger.info(f'[anticheat] i-banned: {chat_id}:{user_id}')
-                return
+        if cheats_found(chat_id, user_id, sum_count(counts)):
+            ban(chat_id, user_id, False, 6 * 60 * 60)  # 6h
+            logger.info(f'[anticheat] i-banned: {chat_id}:{user_id}')
+            return
 
-            rs.save()
+        RedisChatStatistician(chat_id).add(user_id, counts)
@@ -1,4 +1,4 @@
-from src.utils.cache import cache
+from src.utils.cache import pure_cache
 
 
 def cheats_key(chat_id: int, user_id: int) -> str:
@@ -6,11 +6,5 @@ def cheats_key(chat_id: int, user_id: int) -> str:
 
 
 def cheats_found(chat_id: int, user_id: int, sum_count: int) -> bool:
-    key = cheats_key(chat_id, user_id)
-    sums = cache.get(key, 0)
-    sums += sum_count
-    if sums > 50:
-        return True
-
-    cache.set(key, sums, time=10 * 60)  # 10m
-    return False
+    sums = pure_cache.incr(cheats_key(chat_id, user_id), sum_count, time=10 * 60)  # 10m
+    return sums is not None and sums > 50
@@ -30,10 +30,7 @@ def banhammer(chat_id: int, user_id: int) -> BanStatus:
 def ban(chat_id: int, user_id: int, reset: bool = True, time=SIX_MONTHS) -> None:
     cache.set(get_key(chat_id, user_id), True, time=time)
     if reset:
-        rs = RedisChatStatistician(chat_id)
-        rs.load()
-        rs.chat_statistician.reset(user_id)
-        rs.save()
+        RedisChatStatistician(chat_id).reset(user_id)
 
 
 def unban(chat_id: int, user_id: int) -> None:
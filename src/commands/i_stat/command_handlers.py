@@ -8,7 +8,7 @@ from src.commands.i_stat.banhammer import banhammer, BanStatus
 from src.commands.i_stat.db import RedisChatStatistician
 from src.models.user import User
 from src.models.user_stat import UserStat
-from src.utils.callback_helpers import get_callback_data
+from src.utils.callback_helpers import get_inline_keyboard
 from src.utils.handlers_decorators import chat_guard, collect_stats, command_guard
 from src.utils.handlers_helpers import check_admin
 
@@ -47,7 +47,7 @@ def send_all_stat_handler(bot: telegram.Bot, update: telegram.Update) -> None:
     chat_stats = UserStat.get_chat_stats(chat_id)
 
     rs = RedisChatStatistician(chat_id)
-    rs.load()
+    rs.load_chat()
     text = rs.chat_statistician.show_chat_stat(chat_stats)
     bot.send_message(chat_id, text, parse_mode=ParseMode.HTML)
 
@@ -115,7 +115,7 @@ def send_personal_stat(bot: telegram.Bot, chat_id: int, user_id: int,
     reply_markup = get_reply_markup(buttons)
 
     rs = RedisChatStatistician(chat_id)
-    rs.load()
+    rs.load_user(user_id)
     text = rs.chat_statistician.show_personal_stat(user_id)
 
     bot.send_message(chat_id, text,
@@ -136,12 +136,4 @@ def get_reply_markup(buttons) -> Optional[telegram.InlineKeyboardMarkup]:
     """
     if not buttons:
         return None
-    keyboard = []
-    for line in buttons:
-        keyboard.append([
-            telegram.InlineKeyboardButton(
-                button_title,
-                callback_data=(get_callback_data(button_data)))
-            for button_title, button_data in line
-        ])
-    return telegram.InlineKeyboardMarkup(keyboard)
+    return get_inline_keyboard(buttons)
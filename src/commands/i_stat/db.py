@@ -1,22 +1,106 @@
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
-from src.commands.i_stat.i_stat import ChatStatistician, ChatStat
-from src.utils.cache import cache, USER_CACHE_EXPIRE
+from src.commands.i_stat.i_stat import ChatStatistician, ChatStat, UserStat
+from src.utils.cache import cache, pure_cache, USER_CACHE_EXPIRE
 from src.utils.time_helpers import get_current_monday, get_date_monday
 
 
 class RedisChatStatistician(object):
-    def __init__(self, chat_id: int):
+    """
+    Недельная стата /i чата в хешах редиса:
+
+    * words -- слово -> сколько раз его сказали в чате;
+    * user:{uid} -- слово -> сколько раз его сказал юзер;
+    * users_words, users_messages -- uid -> сколько слов и в скольких сообщениях сказал юзер.
+
+    Новое сообщение только увеличивает счетчики (HINCRBY одним пайплайном), поэтому блокировки
+    не нужны. Для показа статы читаются только нужные хеши и собираются в ChatStat:
+    для личной -- хеш юзера, для чата -- все, кроме хешей юзеров.
+    """
+
+    def __init__(self, chat_id: int, date: Optional[datetime] = None):
         self.chat_id = chat_id
+        self.monday = get_current_monday() if date is None else get_date_monday(date)
         self.chat_statistician = ChatStatistician()
 
-    def load(self):
-        self.chat_statistician.db = cache.get(self.__get_cache_key(), ChatStat())
+    def add(self, user_id: int, counts: List[Tuple[str, int]]) -> None:
+        if not counts:
+            return
+        self.__migrate_legacy()
+        self.__add(user_id, dict(counts), messages_count=1)
+
+    def reset(self, user_id: int) -> None:
+        self.__migrate_legacy()
+        user_key = self.__get_key(f'user:{user_id}')
+        counts = pure_cache.get_hash(user_key)
+        with pure_cache.batch() as batch:
+            if counts:
+                batch.incr_hash(self.__get_key('words'),
+                                {word: -int(count) for word, count in counts.items()})
+            batch.delete(user_key)
+            batch.delete_hash_fields(self.__get_key('users_words'), [str(user_id)])
+            batch.delete_hash_fields(self.__get_key('users_messages'), [str(user_id)])
+
+    def load_user(self, user_id: int) -> None:
+        """
+        Загружает в chat_statistician.db стату одного юзера (для show_personal_stat).
+        """
+        self.__migrate_legacy()
+        user_key = self.__get_key(f'user:{user_id}')
+        counts, messages_count = pure_cache.get_hashes([user_key, self.__get_key('users_messages')])
+        stat = UserStat()
+        for word, count in counts.items():
+            stat.add_word(word, int(count))
+        stat.messages_count = int(messages_count.get(str(user_id), 0))
+        db = ChatStat()
+        db.users[user_id] = stat
+        self.chat_statistician.db = db
+
+    def load_chat(self) -> None:
+        """
+        Загружает в chat_statistician.db стату чата (для show_chat_stat): все слова чата
+        и количество слов и сообщений каждого юзера, но без слов каждого юзера.
+        """
+        self.__migrate_legacy()
+        words, users_words, users_messages = pure_cache.get_hashes(
+            [self.__get_key(kind) for kind in ('words', 'users_words', 'users_messages')])
+        db = ChatStat()
+        for word, count in words.items():
+            db.all.add_word(word, int(count))
+        for uid, count in users_words.items():
+            stat = db.users.setdefault(int(uid), UserStat())
+            stat.all_count = int(count)
+        for uid, count in users_messages.items():
+            stat = db.users.setdefault(int(uid), UserStat())
+            stat.messages_count = int(count)
+        self.chat_statistician.db = db
+
+    def __add(self, user_id: int, counts: Dict[str, int], messages_count: int) -> None:
+        uid = str(user_id)
+        with pure_cache.batch() as batch:
+            batch.incr_hash(self.__get_key('words'), counts, time=USER_CACHE_EXPIRE)
+            batch.incr_hash(self.__get_key(f'user:{user_id}'), counts, time=USER_CACHE_EXPIRE)
+            batch.incr_hash(self.__get_key('users_words'), {uid: sum(counts.values())},
+                            time=USER_CACHE_EXPIRE)
+            if messages_count:
+                batch.incr_hash(self.__get_key('users_messages'), {uid: messages_count},
+                                time=USER_CACHE_EXPIRE)
 
-    def save(self):
-        cache.set(self.__get_cache_key(), self.chat_statistician.db, time=USER_CACHE_EXPIRE)
+    def __migrate_legacy(self) -> None:
+        """
+        Раньше стата чата лежала одним ChatStat в cache. Переносим ее в хеши при первом обращении.
+        Перенесет тот, кто удалит старый ключ, поэтому дважды она не посчитается.
+        Можно убрать, когда старые ключи протухнут (через 15 дней).
+        """
+        legacy_key = f'i_stat:{self.monday.strftime("%Y%m%d")}:{self.chat_id}'
+        legacy: Optional[ChatStat] = cache.get(legacy_key)
+        if not legacy or not cache.delete(legacy_key):
+            return
+        for user_id, stat in legacy.users.items():
+            counts = {word: count for word, count in stat.counts.items() if count}
+            if counts:
+                self.__add(user_id, counts, getattr(stat, 'messages_count', 0))
 
-    def __get_cache_key(self, date: Optional[datetime] = None) -> str:
-        date = get_current_monday() if date is None else get_date_monday(date)
-        return f'i_stat:{date.strftime("%Y%m%d")}:{self.chat_id}'
+    def __get_key(self, kind: str) -> str:
+        return f'i_stat:{self.monday.strftime("%Y%m%d")}:{self.chat_id}:{kind}'
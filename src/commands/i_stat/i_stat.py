@@ -1,4 +1,3 @@
-import re
 from collections import Counter
 from typing import Dict, Optional, List, Tuple
 
@@ -7,8 +6,7 @@ import telegram
 
 from src.models.user import User
 from src.models.user_stat import UserStat as ModelUserStat
-
-re_personal_pronouns = re.compile(r"\b(я|меня|мне|мной|мною)\b", re.IGNORECASE)
+from src.utils.message_analysis import MessageAnalysis, re_personal_pronouns
 
 
 def sum_count(common: List[Tuple[str, int]]) -> int:
@@ -16,7 +14,10 @@ def sum_count(common: List[Tuple[str, int]]) -> int:
 
 
 def parse_pronouns(text: str, anticheat: bool = False) -> List[Tuple[str, int]]:
-    words = re_personal_pronouns.findall(text.lower())
+    return count_pronouns(re_personal_pronouns.findall(text.lower()), anticheat)
+
+
+def count_pronouns(words: List[str], anticheat: bool = False) -> List[Tuple[str, int]]:
     if not words:
         return []
     c = Counter(words)
@@ -63,16 +64,22 @@ class ChatStatistician(object):
     def __init__(self):
         self.db = ChatStat()
 
-    def add_message(self, message: telegram.Message) -> int:
+    @staticmethod
+    def count_message(message: telegram.Message) -> List[Tuple[str, int]]:
+        """
+        Местоимения в сообщении, которые идут в стату.
+        """
         if is_foreign_forward(message):
-            return 0
+            return []
 
-        text = message.text if message.text else message.caption
-        if text is None:
-            return 0
+        analysis = MessageAnalysis.get(message)
+        if analysis.text_or_caption is None:
+            return []
+        return count_pronouns(analysis.pronouns, anticheat=True)
 
+    def add_message(self, message: telegram.Message) -> int:
         user_id = message.from_user.id
-        counts = parse_pronouns(text, anticheat=True)
+        counts = self.count_message(message)
         if counts:
             self.db.add_message(user_id)
         for word, count in counts:
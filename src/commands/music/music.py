@@ -15,7 +15,7 @@ from src.utils.cache import cache, YEAR
 from src.utils.handlers_helpers import check_admin
 from src.utils.logger_helpers import get_logger
 from src.utils.misc import chunks
-from src.utils.telegram_helpers import dsp
+from src.utils.send_queue import send_queue
 from src.utils.telegram_helpers import telegram_retry
 
 logger = get_logger(__name__)
@@ -240,7 +240,7 @@ def send_list_replay(bot: telegram.Bot, chat_id: int, message_id: int, uids: Ite
             first_message_id = first_msg.message_id
             continue
         # в последющих сообщениях тегаем первое
-        dsp(send_replay, bot, chat_id, first_message_id, joined)
+        send_queue.put(chat_id, send_replay, bot, chat_id, first_message_id, joined)
 
 
 @telegram_retry(logger=logger, silence=False, default=None, title='send_replay')
@@ -5,7 +5,7 @@ from telegram import ParseMode, ChatAction
 from telegram.ext import run_async
 
 from src.config import CONFIG
-from src.models.reply_top import ReplyTop, ReplyLove
+from src.models.reply_top import ReplyLove, ReplyTopUsers
 from src.models.user import User
 from src.utils.handlers_decorators import chat_guard, collect_stats, command_guard, \
     only_users_from_main_chat
@@ -29,7 +29,7 @@ def send_mylove(bot: telegram.Bot, update: telegram.Update, send_to_cid: int,
     def format_love(type: str, b: User, _: bool) -> typing.Optional[str]:
         if not b:
             return None
-        b_pair, b_inbound, b_outbound = ReplyTop.get_user_top_strast(find_in_cid, b.uid)
+        b_pair, b_inbound, b_outbound = tops.get_top_strast(b.uid)
 
         mutual_sign = ' ❤'
         if type == 'pair' and b_pair:
@@ -60,7 +60,8 @@ def send_mylove(bot: telegram.Bot, update: telegram.Update, send_to_cid: int,
                          reply_to_message_id=update.message.message_id)
         return
 
-    pair, inbound, outbound = ReplyTop.get_user_top_strast(find_in_cid, user_id)
+    tops = ReplyTopUsers(find_in_cid)
+    pair, inbound, outbound = tops.get_top_strast(user_id)
 
     formats = (format_love('pair', pair, user.female), format_love('inbound', inbound, user.female),
                format_love('outbound', outbound, user.female))
@@ -2,7 +2,7 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 from src.config import CONFIG
 from src.models.user import User
-from src.utils.cache import cache, MONTH
+from src.utils.cache import tiered_cache, MONTH
 from src.utils.callback_helpers import remove_inline_keyboard, get_callback_data
 from src.utils.handlers_decorators import chat_guard, collect_stats, command_guard
 from src.utils.handlers_helpers import get_command_name, is_valid_command, check_command_is_off, \
@@ -17,7 +17,7 @@ def off_all_cmds(bot, update):
     Отключает все команды в указанном чате.
     """
     chat_id = update.message.chat_id
-    cache.set(f'all_cmd_disabled:{chat_id}', True, time=CONFIG['off_delay'])
+    tiered_cache.set(f'all_cmd_disabled:{chat_id}', True, time=CONFIG['off_delay'])
     bot.sendMessage(chat_id, 'Все команды выключены на 5 минут.\nСтатистика собирается в школу.')
 
 
@@ -63,7 +63,7 @@ def off_cmd(bot, update):
 
 
 def _off_cmd(bot, bot_command, chat_id, cmd_name):
-    cache.set(f'cmd_disabled:{chat_id}:{cmd_name}', True, time=CONFIG['off_delay'])
+    tiered_cache.set(f'cmd_disabled:{chat_id}:{cmd_name}', True, time=CONFIG['off_delay'])
     if cmd_name == 'off':
         bot.sendMessage(chat_id, f'Команда {bot_command} выключена на 5 минут. Запретим запрещать!')
     else:
@@ -94,7 +94,7 @@ def on_cmd(bot, update):
         bot_command = text[1]
 
     if bot_command == 'all' or bot_command == '/all':
-        cache.delete(f'all_cmd_disabled:{chat_id}')
+        tiered_cache.delete(f'all_cmd_disabled:{chat_id}')
         bot.sendMessage(chat_id, 'Все команды снова работают.')
         return
     if not is_valid_command(bot_command):
@@ -106,7 +106,7 @@ def on_cmd(bot, update):
         return
 
     cmd_name = get_command_name(bot_command)
-    cache.delete(f'cmd_disabled:{chat_id}:{cmd_name}')
+    tiered_cache.delete(f'cmd_disabled:{chat_id}:{cmd_name}')
     bot.sendMessage(chat_id, f'Команда {bot_command} снова работает. На твой страх и риск.',
                     reply_to_message_id=msg_id)
 
@@ -159,13 +159,13 @@ def off_cmd_for_user(bot, update):
             return
 
     plohish_cmd_cache_key = f'plohish_cmd:{chat_id}:{plohish_id}:{valid_cmd_name}'
-    disabled = cache.get(plohish_cmd_cache_key)
+    disabled = tiered_cache.get(plohish_cmd_cache_key)
     if disabled:
         bot.sendMessage(chat_id,
                         f'Команда /{valid_cmd_name} у плохиша {plohish_name} уже не работает')
         return
 
-    cache.set(plohish_cmd_cache_key, True, time=MONTH)
+    tiered_cache.set(plohish_cmd_cache_key, True, time=MONTH)
     if reply_to_msg:
         data = {"name": '/off', "bot_command": cmd_name, "plohish_id": plohish_id,
                 "valid_cmd_name": valid_cmd_name}
@@ -225,12 +225,12 @@ def on_cmd_for_user(bot, update):
         return
 
     plohish_cmd_cache_key = f'plohish_cmd:{chat_id}:{plohish_id}:{cmd_name}'
-    disabled = cache.get(plohish_cmd_cache_key)
+    disabled = tiered_cache.get(plohish_cmd_cache_key)
     if not disabled:
         bot.sendMessage(chat_id, f'Команда {cmd_name} у плохиша {plohish_name} и так работает')
         return
 
-    cache.delete(plohish_cmd_cache_key)
+    tiered_cache.delete(plohish_cmd_cache_key)
     bot.sendMessage(chat_id, f'Команда {cmd_name} у плохиша {plohish_name} теперь работает')
 
 
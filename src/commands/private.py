@@ -19,6 +19,7 @@ from src.utils.cache import cache
 from src.utils.handlers_decorators import only_users_from_main_chat
 from src.utils.logger_helpers import get_logger
 from src.utils.misc import weighted_choice
+from src.utils.profiler import profiler
 
 logger = get_logger(__name__)
 
@@ -52,6 +53,28 @@ def run_weekly_stats(bot: telegram.Bot, update: telegram.Update) -> None:
     from src.modules.weeklystat import weekly_stats
     weekly_stats(bot, None)
 
+def profile(bot: telegram.Bot, update: telegram.Update) -> None:
+    """
+    /profile [минуты] -- запустить сэмплирующий профайлер (по умолчанию на час),
+    /profile stop -- остановить. Файл со стеками -- в profiler_directory.
+    """
+    uid = update.message.chat_id
+    logger.info(f'id {uid} /profile')
+    if uid != CONFIG.get('debug_uid', None):
+        return
+
+    args = update.message.text.split()[1:]
+    if args and args[0] == 'stop':
+        path = profiler.stop()
+        bot.send_message(uid, f'Профайлер остановлен: {path}' if path else 'Профайлер не запущен')
+        return
+    minutes = float(args[0]) if args and re.match(r'^\d+(\.\d+)?$', args[0]) else 60
+    if not profiler.start(duration=minutes * 60):
+        bot.send_message(uid, f'Профайлер уже запущен: {profiler.get_status()}')
+        return
+    bot.send_message(uid, f'Профайлер запущен на {minutes:g} мин: {profiler.path}')
+
+
 def year(bot: telegram.Bot, update: telegram.Update) -> None:
     uid = update.message.chat_id
     logger.info(f'id {uid} /year')
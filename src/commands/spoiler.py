@@ -10,7 +10,7 @@ from src.config import CONFIG
 from src.models.chat_user import ChatUser
 from src.models.user import User
 from src.utils.cache import cache
-from src.utils.callback_helpers import get_callback_data
+from src.utils.callback_helpers import get_inline_keyboard
 from src.utils.logger_helpers import get_logger
 from src.utils.mwt import MWT
 from src.utils.telegram_helpers import telegram_retry
@@ -85,15 +85,7 @@ class TelegramWrapper:
         """
         if not buttons:
             return None
-        keyboard = []
-        for line in buttons:
-            keyboard.append([
-                telegram.InlineKeyboardButton(
-                    button_title,
-                    callback_data=(get_callback_data(button_data)))
-                for button_title, button_data in line
-            ])
-        return telegram.InlineKeyboardMarkup(keyboard)
+        return get_inline_keyboard(buttons)
 
     @classmethod
     def answer_callback_query_with_bot_link(cls, bot: telegram.Bot, query_id, query_data) -> None:
@@ -121,6 +121,11 @@ def format_msg(title: str, stats: dict) -> str:
 
 
 def send_topmat(bot: telegram.Bot, send_to_cid: int, stats_from_cid: int, date=None) -> None:
+    msg = get_topmat_msg(stats_from_cid, date)
+    bot.send_message(send_to_cid, msg, parse_mode=telegram.ParseMode.HTML)
+
+
+def get_topmat_msg(stats_from_cid: int, date=None) -> str:
     monday = get_current_monday() if date is None else get_date_monday(date)
     stats = UserStat.get_chat_stats(stats_from_cid, date)
     words = get_words_from_cache(monday, stats_from_cid)
@@ -132,7 +137,7 @@ def send_topmat(bot: telegram.Bot, send_to_cid: int, stats_from_cid: int, date=N
         'words_stats': get_words_stats(words),
     })
     set_top_mater(stats_from_cid, users_msg_stats)
-    bot.send_message(send_to_cid, msg, parse_mode=telegram.ParseMode.HTML)
+    return msg
 
 
 def set_top_mater(stats_from_cid, users_msg_stats) -> None:
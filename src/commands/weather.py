@@ -13,7 +13,7 @@ from src.config import CONFIG
 from src.utils.cache import cache
 from src.utils.handlers_decorators import chat_guard, collect_stats, command_guard
 from src.utils.logger_helpers import get_logger
-from src.utils.telegram_helpers import dsp
+from src.utils.send_queue import send_queue
 
 TMP_DIR = '../../tmp/weather/'
 full_moon_lock = Lock()
@@ -84,12 +84,12 @@ def send_alert_if_full_moon(bot: telegram.Bot, chat_id: int) -> None:
             cache.set('weather:full_moon', full_moon, time=6 * 60 * 60)  # 6 hours
     if full_moon:
         # отправляется через очередь
-        dsp(_send_full_moon_alert, bot, chat_id)
+        send_queue.put(chat_id, _send_full_moon_alert, bot, chat_id)
 
 
 def _send_full_moon_alert(bot, chat_id):
     """
-    Вынес в отдельную функцию, чтобы использовать в `dsp`
+    Вынес в отдельную функцию, чтобы использовать в `send_queue`
     """
     bot.send_message(chat_id, "Сегодня:\n\nПОЛНОЛУНИЕ 🌑 БЕРЕГИСЬ ОБОРОТНЕЙ", parse_mode='HTML')
 
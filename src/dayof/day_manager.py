@@ -6,14 +6,14 @@ from src.config import get_config_chats
 from src.dayof.fsb_day import FSBDay
 from src.dayof.day_8.day_8 import midnight8
 from src.dayof.valentine_day.valentine_day import ValentineDay as ValentineDay2
-from src.utils.telegram_helpers import dsp
+from src.utils.send_queue import send_queue
 
 
 def new_year(bot: telegram.Bot):
     if datetime.today().strftime("%m-%d") != '01-01':
         return
     for chat in get_config_chats():
-        dsp(_send_new_year, bot, chat.chat_id)
+        send_queue.put(chat.chat_id, _send_new_year, bot, chat.chat_id, priority=send_queue.LOW)
 
 
 def _send_new_year(bot, chat_id):
@@ -15,8 +15,9 @@ from src.dayof.helper import set_today_special
 from src.models.chat_user import ChatUser
 from src.models.user import User
 from src.utils.cache import cache, USER_CACHE_EXPIRE
-from src.utils.callback_helpers import get_callback_data
+from src.utils.callback_helpers import get_inline_keyboard
 from src.utils.logger_helpers import get_logger
+from src.utils.telegram_helpers import wait_sent
 from src.utils.text_helpers import lstrip_every_line
 
 logger = get_logger(__name__)
@@ -91,19 +92,11 @@ class FSBDayTelegram:
             pass
 
         @staticmethod
-        def get_reply_markup(buttons):
+        def get_reply_markup(buttons, message_id=None):
             """
             Инлайн-кнопки под сообщением
             """
-            keyboard = []
-            for line in buttons:
-                keyboard.append([
-                    telegram.InlineKeyboardButton(
-                        button_title,
-                        callback_data=(get_callback_data(button_data)))
-                    for button_title, button_data in line
-                ])
-            return telegram.InlineKeyboardMarkup(keyboard)
+            return get_inline_keyboard(buttons, FSBDayTelegram.chat_id, message_id)
 
         @staticmethod
         def get_full_reply_markup(buttons):
@@ -139,7 +132,7 @@ class FSBDayTelegram:
             self.buttons = buttons
 
         def execute(self, bot):
-            reply_markup = self.get_reply_markup(self.buttons)
+            reply_markup = self.get_reply_markup(self.buttons, self.message_id)
             bot.edit_message_reply_markup(FSBDayTelegram.chat_id, self.message_id,
                                           reply_markup=reply_markup)
             cache.set(f'{CACHE_PREFIX}__message_buttons_{self.message_id}', self.buttons,
@@ -157,12 +150,13 @@ class FSBDayTelegram:
                 new_text = re.sub(r"^Подписано\s+[█ ]+$", f'Подписано {user.fullname}', old_text, 0,
                                   re.IGNORECASE | re.MULTILINE)
                 buttons = cache.get(f'{CACHE_PREFIX}__message_buttons_{self.message_id}')
-                reply_markup = self.get_reply_markup(buttons)
+                reply_markup = self.get_reply_markup(buttons, self.message_id)
                 female = 'а' if user.female else ''
-                bot.send_message(FSBDayTelegram.chat_id,
-                                 f'Какой ужас. Это был{female} {user.get_username_or_link()}',
-                                 reply_to_message_id=self.message_id,
-                                 parse_mode=telegram.ParseMode.HTML)
+                text = f'Какой ужас. Это был{female} {user.get_username_or_link()}'
+                # правка идет мимо очереди: ждем, чтобы она не обогнала сообщение
+                wait_sent(bot.send_message(FSBDayTelegram.chat_id, text,
+                                           reply_to_message_id=self.message_id,
+                                           parse_mode=telegram.ParseMode.HTML))
                 return bot.edit_message_text(new_text, FSBDayTelegram.chat_id, self.message_id,
                                              parse_mode=telegram.ParseMode.HTML,
                                              reply_markup=reply_markup)
@@ -180,8 +174,8 @@ class FSBDayTelegram:
         def execute(self, bot):
             reply_markup = self.get_full_reply_markup(self.buttons)
             try:
-                bot.send_message(self.uid, self.text, parse_mode=telegram.ParseMode.HTML,
-                                 reply_markup=reply_markup)
+                wait_sent(bot.send_message(self.uid, self.text, parse_mode=telegram.ParseMode.HTML,
+                                           reply_markup=reply_markup))
             except:
                 user = User.get(self.uid)
                 logger.warning(f"[fsb_day] can't send message to {user.get_username_or_link()}")
@@ -222,8 +216,8 @@ class FSBDayTelegram:
 
         def execute(self, bot):
             try:
-                bot.send_message(self.uid, self.text, parse_mode=telegram.ParseMode.HTML,
-                                 reply_to_message_id=self.reply_to_message_id)
+                wait_sent(bot.send_message(self.uid, self.text, parse_mode=telegram.ParseMode.HTML,
+                                           reply_to_message_id=self.reply_to_message_id))
             except:
                 user = User.get(self.uid)
                 logger.warning(f"[fsb_day] can't send message to {user.get_username_or_link()}")
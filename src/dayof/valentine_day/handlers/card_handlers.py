@@ -8,6 +8,7 @@ from src.dayof.valentine_day.handlers.stats_redis import StatsRedis
 from src.dayof.valentine_day.helpers.helpers import get_reply_markup, get_username_or_link
 from src.dayof.valentine_day.model import Card, CACHE_PREFIX
 from src.utils.cache import cache, TWO_DAYS
+from src.utils.telegram_helpers import wait_sent
 
 HTML = telegram.ParseMode.HTML
 
@@ -103,8 +104,10 @@ def mig_button_click_handler(bot: telegram.Bot, _: telegram.Update,
             with StatsRedis() as stats:
                 stats.add_mig(store.card, store.user_id)
         try:
-            bot.send_message(store.card.from_user.user_id, result.notify_text, parse_mode=HTML,
-                             reply_to_message_id=store.card.original_draft_message_id)
+            # правка статуса идет мимо очереди: ждем, чтобы она не обогнала уведомление
+            wait_sent(bot.send_message(store.card.from_user.user_id, result.notify_text,
+                                       parse_mode=HTML,
+                                       reply_to_message_id=store.card.original_draft_message_id))
         except Exception:
             pass
         sleep(0.8)
@@ -9,10 +9,11 @@ from src.models.user import User
 from src.dayof.valentine_day.model import VUnknownUser, VChatsUser, VChat, Button, CACHE_PREFIX, \
     all_hearts
 from src.utils.cache import cache, TWO_DAYS
-from src.utils.callback_helpers import get_callback_data
+from src.utils.callback_helpers import get_inline_keyboard
 from src.utils.logger_helpers import get_logger
 from src.utils.mwt import MWT
-from src.utils.telegram_helpers import dsp, telegram_retry
+from src.utils.send_queue import send_queue
+from src.utils.telegram_helpers import telegram_retry
 
 HTML = telegram.ParseMode.HTML
 logger = get_logger(__name__)
@@ -24,15 +25,8 @@ def get_reply_markup(buttons: List[List[Button]]) -> Optional[telegram.InlineKey
     """
     if not buttons:
         return None
-    keyboard = []
-    for line in buttons:
-        keyboard.append([
-            telegram.InlineKeyboardButton(
-                button.title,
-                callback_data=(get_callback_data(button.get_data())))
-            for button in line
-        ])
-    return telegram.InlineKeyboardMarkup(keyboard)
+    return get_inline_keyboard([[(button.title, button.get_data()) for button in line]
+                                for line in buttons])
 
 
 def remove_first_word(text: str) -> str:
@@ -114,7 +108,8 @@ def send_to_all_chats(bot: telegram.Bot, key_name: str,
         chat_key = f'{CACHE_PREFIX}:{key_name}:{chat_id}'
         if cache.get(chat_key, False):
             continue
-        dsp(send_html, bot, chat_id, get_text(chat_id))
+        send_queue.put(chat_id, send_html, bot, chat_id, get_text(chat_id),
+                       priority=send_queue.LOW)
         cache.set(chat_key, True, time=TWO_DAYS)
 
 
@@ -14,7 +14,7 @@ from src.dayof.valentine_day.model import MODULE_NAME, \
     RevnButton, MigButton, AboutButton, CACHE_PREFIX, StatsHumanReporter
 from src.utils.cache import cache, TWO_DAYS
 from src.utils.logger_helpers import get_logger
-from src.utils.telegram_helpers import dsp
+from src.utils.send_queue import send_queue
 
 HTML = telegram.ParseMode.HTML
 logger = get_logger(__name__)
@@ -64,7 +64,9 @@ def send_end(bot: telegram.Bot) -> None:
         admin_key = f'{CACHE_PREFIX}:end:admin'
         if not cache.get(admin_key, False):
             text = StatsHumanReporter(stats).get_text(None)
-            dsp(send_html, bot, CONFIG.get('debug_uid', None), text)
+            debug_uid = CONFIG.get('debug_uid', None)
+            if debug_uid:
+                send_queue.put(debug_uid, send_html, bot, debug_uid, text)
             cache.set(admin_key, True, time=TWO_DAYS)
 
         send_to_all_chats(bot, 'end', _get_text)
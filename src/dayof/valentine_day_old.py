@@ -16,7 +16,7 @@ from src.dayof.helper import set_today_special
 from src.models.chat_user import ChatUser
 from src.models.user import User
 from src.utils.cache import cache, USER_CACHE_EXPIRE, pure_cache
-from src.utils.callback_helpers import get_callback_data
+from src.utils.callback_helpers import get_inline_keyboard
 from src.utils.logger_helpers import get_logger
 from src.utils.misc import get_int
 from src.utils.misc import retry
@@ -165,15 +165,7 @@ class TelegramWrapper:
         """
         if not buttons:
             return None
-        keyboard = []
-        for line in buttons:
-            keyboard.append([
-                telegram.InlineKeyboardButton(
-                    button_title,
-                    callback_data=(get_callback_data(button_data)))
-                for button_title, button_data in line
-            ])
-        return telegram.InlineKeyboardMarkup(keyboard)
+        return get_inline_keyboard(buttons)
 
     @classmethod
     def answer_callback_query_with_bot_link(cls, bot: telegram.Bot, query_id, query_data) -> None:
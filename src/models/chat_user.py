@@ -5,7 +5,8 @@ from sqlalchemy import Column, Integer, BigInteger, Boolean, func
 
 from src.config import CONFIG
 from src.utils.cache import USER_CACHE_EXPIRE, bot_id
-from src.utils.cache import cache
+from src.utils.cache import tiered_cache
+from src.utils.codec import codec
 from src.utils.db import Base, add_to_db, retry, session_scope
 from src.utils.logger_helpers import get_logger
 
@@ -164,8 +165,11 @@ class ChatUser:
         old_user = cls.get(uid, cid)
 
         # эти данные в бд меняются редко, поэтому они сразу сохраняются в редис,
-        # чтобы не локать лишний раз
-        cache.set(cls.__get_key(uid, cid), new_user, time=USER_CACHE_EXPIRE)
+        # чтобы не локать лишний раз. если ничего не изменилось, то только продлеваем
+        if old_user is not None and old_user.left == left:
+            tiered_cache.refresh(cls.__get_key(uid, cid), new_user, time=USER_CACHE_EXPIRE)
+            return
+        tiered_cache.set(cls.__get_key(uid, cid), new_user, time=USER_CACHE_EXPIRE)
 
         # проверка, нужно ли обновлять бд
         # блокировка (она в методе __add) начнется только если данные изменились
@@ -195,7 +199,7 @@ class ChatUser:
 
     @classmethod
     def get(cls, uid, cid) -> typing.Optional['ChatUser']:
-        cached = cache.get(cls.__get_key(uid, cid))
+        cached = tiered_cache.get(cls.__get_key(uid, cid))
         if cached:
             return cached
 
@@ -205,7 +209,7 @@ class ChatUser:
             try:
                 chatuser = ChatUserDB.get(uid, cid)
                 if chatuser:
-                    cache.set(cls.__get_key(uid, cid), chatuser, time=USER_CACHE_EXPIRE)
+                    tiered_cache.set(cls.__get_key(uid, cid), chatuser, time=USER_CACHE_EXPIRE)
                     return chatuser
             except Exception as e:
                 logger.error(e)
@@ -241,3 +245,8 @@ class ChatUser:
     @staticmethod
     def __get_key(uid, cid):
         return f'chatuser:{cid}:{uid}'
+
+
+codec.register(ChatUser, 'chat_user:1',
+               lambda chatuser: [chatuser.id, chatuser.uid, chatuser.cid, chatuser.left],
+               lambda state: ChatUser(*state))
@@ -3,12 +3,12 @@ import re
 from datetime import datetime, timedelta
 from threading import Lock
 
-from telegram.ext import run_async
-
 from src.models.user import UserDB
 from src.models.user_stat import UserStat
+from src.utils.background import BackgroundExecutor, in_background
 from src.utils.cache import cache, USER_CACHE_EXPIRE
 from src.utils.logger_helpers import get_logger
+from src.utils.message_analysis import MessageAnalysis
 
 logger = get_logger(__name__)
 
@@ -44,16 +44,16 @@ class IgorWeekly:
         return uid
 
     @classmethod
-    @run_async
+    @in_background(BackgroundExecutor.LOW)
     def parse_message(cls, message):
         msg = message.text
         if msg is None:
             return
         uid = message.from_user.id
         cid = message.chat_id
-        entities = message.parse_entities()
+        analysis = MessageAnalysis.get(message)
 
-        if not cls.__has_igor(msg):
+        if not cls.__has_igor(analysis.lower_ye):
             return
         cls.__add(uid, cid)
 
@@ -61,23 +61,18 @@ class IgorWeekly:
             to_uid = message.reply_to_message.from_user.id
             cls.__add(to_uid, cid, replay=True)
 
-        for entity, entity_text in entities.items():
-            if entity.type == 'mention':
-                username = entity_text.lstrip('@').strip()
-                try:
-                    mentioned_user_uid = UserDB.get_uid_by_username(username)
-                    if mentioned_user_uid:
-                        cls.__add(mentioned_user_uid, cid, replay=True)
-                except Exception:
-                    pass
-                continue
-            if entity.type == 'text_mention':
-                cls.__add(entity.user.id, cid, replay=True)
-                continue
+        for username in analysis.mentions:
+            try:
+                mentioned_user_uid = UserDB.get_uid_by_username(username)
+                if mentioned_user_uid:
+                    cls.__add(mentioned_user_uid, cid, replay=True)
+            except Exception:
+                pass
+        for user in analysis.text_mentions:
+            cls.__add(user.id, cid, replay=True)
 
     @classmethod
-    def __has_igor(cls, msg):
-        msg_lower = msg.lower().replace('ё', 'е')
+    def __has_igor(cls, msg_lower):
         if cls.re_inside.search(msg_lower):
             return True
         return False
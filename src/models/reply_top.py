@@ -1,18 +1,19 @@
 import json
 import os
 from datetime import datetime
-from threading import Lock
-from typing import List, Tuple, Optional
+from typing import Callable, Dict, Iterable, List, Tuple, Optional
 
 import pytils
-from telegram.ext import run_async
 
 from src.config import CONFIG
 from src.models.chat_user import ChatUser
 from src.models.user import UserDB, User
-from src.utils.cache import cache, USER_CACHE_EXPIRE, bot_id
+from src.utils.background import in_background
+from src.utils.cache import cache, pure_cache, PureCache, USER_CACHE_EXPIRE, bot_id
 from src.utils.logger_helpers import get_logger
-from src.utils.misc import sort_dict, get_int
+from src.utils.message_analysis import MessageAnalysis
+from src.utils.misc import get_int
+from src.utils.reply_graph import ReplyGraph, DRAGON_UID
 from src.utils.time_helpers import get_current_monday, get_date_monday, get_yesterday
 
 logger = get_logger(__name__)
@@ -20,102 +21,110 @@ logger = get_logger(__name__)
 
 class ReplyTopDBHelper:
     """
-    Хелпер для работы с данными
+    Хранит в редисе, кто кого реплаит. На каждый чат и период (день или неделю) заводятся
+    сортированные множества:
+
+    * to, from -- сколько реплаев получил и отправил каждый юзер;
+    * pair -- сколько реплаев в паре "uid1,uid2";
+    * outbound:{uid}, inbound:{uid} -- кому писал юзер и кто писал ему.
+
+    Реплай увеличивает их через ZINCRBY одним пайплайном. ZINCRBY атомарный, поэтому блокировки
+    не нужны. Топы берутся прямо из редиса (get_top), а get_db собирает все в словарь
+    {'to', 'from', 'pair', 'outbound', 'inbound'} для ReplyGraph и дампов.
     """
+
     def __init__(self, name: str, delay=USER_CACHE_EXPIRE) -> None:
         self.name = name
         self.delay = delay
-        self.lock = Lock()
 
-    def __get_cache_key(self, date: datetime, cid: int) -> str:
+    def __get_key(self, date: datetime, cid: int, kind: str) -> str:
+        return f'{self.name}:{date.strftime("%Y%m%d")}:{cid}:{kind}'
+
+    def __get_legacy_key(self, date: datetime, cid: int) -> str:
         return f'{self.name}:{date.strftime("%Y%m%d")}:{cid}'
 
     def get_db(self, date: datetime, cid: int) -> dict:
-        cached = cache.get(self.__get_cache_key(date, cid))
-        if cached:
-            return cached
-
-        template = {
-            'to': {},
-            'from': {},
-            'pair': {},
+        self.__migrate_legacy(date, cid)
+        to, from_, pair = pure_cache.get_sorted_sets(
+            [self.__get_key(date, cid, kind) for kind in ('to', 'from', 'pair')])
+        db = {
+            'to': {int(uid): count for uid, count in to},
+            'from': {int(uid): count for uid, count in from_},
+            'pair': dict(pair),
             'outbound': {},
             'inbound': {},
         }
-        return template
-
-    def set_db(self, newdb: dict, date: datetime, cid: int) -> None:
-        cache.set(self.__get_cache_key(date, cid), newdb, time=self.delay)
-
-    def add(self, from_uid: int, to_uid: int, cid: int, date: datetime) -> None:
-        """
-        Добавляет статистику по страсти
-        """
-        logger.debug(f'[{self.name}] lock {cid}:{from_uid}-->{to_uid}')
-        with self.lock:
-            db = self.get_db(date, cid)
-            self.__count_replays(db, from_uid, to_uid)
-            self.__count_pairs(db, from_uid, to_uid)
-            self.__count_outbound(db, from_uid, to_uid)
-            self.__count_inbound(db, from_uid, to_uid)
-            self.set_db(db, date, cid)
-
-    @staticmethod
-    def __count_inbound(db, from_uid, to_uid):
+        outbound_uids = list(db['from'])
+        inbound_uids = list(db['to'])
+        keys = [self.__get_key(date, cid, f'outbound:{uid}') for uid in outbound_uids] + \
+               [self.__get_key(date, cid, f'inbound:{uid}') for uid in inbound_uids]
+        counts = pure_cache.get_sorted_sets(keys)
+        for uid, uid_counts in zip(outbound_uids, counts[:len(outbound_uids)]):
+            db['outbound'][uid] = {int(to_uid): count for to_uid, count in uid_counts}
+        for uid, uid_counts in zip(inbound_uids, counts[len(outbound_uids):]):
+            db['inbound'][uid] = {int(from_uid): count for from_uid, count in uid_counts}
+        return db
+
+    def get_top(self, date: datetime, cid: int, kind: str, limit: Optional[int] = None,
+                keep: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, int]]:
         """
-        Входящая страсть
+        Топ из to, from или pair: [(uid или пара, количество)] по убыванию.
+        keep -- фильтр. Редис отдает топ страницами, пока не наберется limit подходящих.
         """
-        if 'inbound' not in db:
-            db['inbound'] = {}
-        if to_uid not in db['inbound']:
-            db['inbound'][to_uid] = {}
-        if from_uid in db['inbound'][to_uid]:
-            db['inbound'][to_uid][from_uid] += 1
-        else:
-            db['inbound'][to_uid][from_uid] = 1
-
-    @staticmethod
-    def __count_outbound(db, from_uid, to_uid):
+        self.__migrate_legacy(date, cid)
+        key = self.__get_key(date, cid, kind)
+        if limit is None:
+            top = pure_cache.get_sorted_set(key)
+            return top if keep is None else [item for item in top if keep(item[0])]
+        if keep is None:
+            return pure_cache.get_sorted_set(key, 0, limit - 1)
+        top = []
+        start = 0
+        page = limit * 2
+        while len(top) < limit:
+            chunk = pure_cache.get_sorted_set(key, start, start + page - 1)
+            top.extend(item for item in chunk if keep(item[0]))
+            if len(chunk) < page:
+                break
+            start += page
+        return top[:limit]
+
+    def add(self, from_uid: int, to_uid: int, cid: int, date: datetime,
+            batch: PureCache = pure_cache) -> None:
         """
-        Исходящая страсть
-        """
-        if 'outbound' not in db:
-            db['outbound'] = {}
-        if from_uid not in db['outbound']:
-            db['outbound'][from_uid] = {}
-        if to_uid in db['outbound'][from_uid]:
-            db['outbound'][from_uid][to_uid] += 1
-        else:
-            db['outbound'][from_uid][to_uid] = 1
-
-    @staticmethod
-    def __count_pairs(db, from_uid, to_uid):
-        """
-        Парная страсть
+        Добавляет статистику по страсти
         """
-        # сортируем id, чтобы ключ всегда был одинаковый
-        # вариант когда юзер реплает самому себе тоже допустим
-        pair_key = ','.join(sorted([str(from_uid), str(to_uid)]))
-        if pair_key in db['pair']:
-            db['pair'][pair_key] += 1
-        else:
-            db['pair'][pair_key] = 1
-
-    @staticmethod
-    def __count_replays(db, from_uid, to_uid):
+        self.__add_counts(batch, date, cid, {(from_uid, to_uid): 1})
+
+    def __add_counts(self, batch: PureCache, date: datetime, cid: int,
+                     replies: Dict[Tuple[int, int], int]) -> None:
+        with batch.batch() as pipe:
+            for (from_uid, to_uid), count in replies.items():
+                from_str, to_str = str(from_uid), str(to_uid)
+                # сортируем id, чтобы ключ всегда был одинаковый
+                # вариант когда юзер реплает самому себе тоже допустим
+                pair_key = ','.join(sorted([from_str, to_str]))
+                for kind, member in (('to', to_str), ('from', from_str), ('pair', pair_key),
+                                     (f'outbound:{from_uid}', to_str),
+                                     (f'inbound:{to_uid}', from_str)):
+                    pipe.incr_sorted_set(self.__get_key(date, cid, kind), {member: count},
+                                         time=self.delay)
+
+    def __migrate_legacy(self, date: datetime, cid: int) -> None:
         """
-        Подсчет реплаев
+        Раньше вся статистика хранилась одним словарем в cache. Переносим ее в сортированные
+        множества при первом чтении. Перенесет тот, кто удалит старый ключ, поэтому дважды
+        она не посчитается. Можно убрать, когда старые ключи протухнут (через 15 дней).
         """
-        # сколько реплаев отправлено этому юзеру
-        if to_uid in db['to']:
-            db['to'][to_uid] += 1
-        else:
-            db['to'][to_uid] = 1
-        # сколько реплаев отправил этот юзер
-        if from_uid in db['from']:
-            db['from'][from_uid] += 1
-        else:
-            db['from'][from_uid] = 1
+        legacy_key = self.__get_legacy_key(date, cid)
+        legacy = cache.get(legacy_key)
+        if not legacy or not cache.delete(legacy_key):
+            return
+        replies = {(from_uid, to_uid): count
+                   for from_uid, counts in legacy.get('outbound', {}).items()
+                   for to_uid, count in counts.items()}
+        self.__add_counts(pure_cache, date, cid, replies)
+        logger.info(f'[{self.name}] migrated {legacy_key}: {len(replies)} pairs')
 
 
 class ReplyTop:
@@ -128,18 +137,30 @@ class ReplyTop:
     @classmethod
     def add(cls, from_uid, to_uid, cid, date: Optional[datetime] = None):
         monday = get_current_monday() if date is None else get_date_monday(date)
-        cls.db_helper.add(from_uid, to_uid, cid, monday)
-        ReplyTopDaily.add(from_uid, to_uid, cid)
+        with pure_cache.batch() as batch:
+            cls.db_helper.add(from_uid, to_uid, cid, monday, batch=batch)
+            ReplyTopDaily.add(from_uid, to_uid, cid, batch=batch)
 
     @classmethod
     def get_stats(cls, cid, date=None):
         monday = get_current_monday() if date is None else get_date_monday(date)
-        db = cls.db_helper.get_db(monday, cid)
-        ignore = CONFIG.get('replylove__ignore', [])
+        ignore = {str(uid) for uid in CONFIG.get('replylove__ignore', [])}
+        ignore_pairs = {uid_str: {str(uid) for uid in uids} for uid_str, uids
+                        in CONFIG.get('replylove__ignore_pairs', {}).get(str(cid), {}).items()}
+
+        def keep_uid(uid: str) -> bool:
+            return uid not in ignore
+
+        def keep_pair(pair: str) -> bool:
+            a, b = pair.split(',')
+            if a in ignore or b in ignore:
+                return False
+            return b not in ignore_pairs.get(a, ()) and a not in ignore_pairs.get(b, ())
+
         return {
-            'to': sort_dict(cls.__remove_uids(db['to'], ignore))[:3],
-            'from': sort_dict(cls.__remove_uids(db['from'], ignore))[:3],
-            'pair': sort_dict(cls.__ignore_pairs(cid, cls.__remove_uids(db['pair'], ignore)))[:10]
+            'to': cls.__to_uids(cls.db_helper.get_top(monday, cid, 'to', 3, keep_uid)),
+            'from': cls.__to_uids(cls.db_helper.get_top(monday, cid, 'from', 3, keep_uid)),
+            'pair': cls.db_helper.get_top(monday, cid, 'pair', 10, keep_pair),
         }
 
     @classmethod
@@ -148,141 +169,104 @@ class ReplyTop:
         Как get_stats, но с полным показом страсти, без игнорирования
         """
         monday = get_current_monday() if date is None else get_date_monday(date)
-        db = cls.db_helper.get_db(monday, cid)
         return {
-            'to': sort_dict(db['to']),
-            'from': sort_dict(db['from']),
-            'pair': sort_dict(db['pair'])
+            'to': cls.__to_uids(cls.db_helper.get_top(monday, cid, 'to')),
+            'from': cls.__to_uids(cls.db_helper.get_top(monday, cid, 'from')),
+            'pair': cls.db_helper.get_top(monday, cid, 'pair'),
         }
 
     @staticmethod
-    def __ignore_pairs(chat_id, pairs):
-        copy = pairs.copy()
-        replylove__ignore_pairs = CONFIG.get('replylove__ignore_pairs', {}).get(str(chat_id), {})
-        for uid_str, ignore_uids in replylove__ignore_pairs.items():
-            str_uids = [str(uid) for uid in ignore_uids]
-            for pair in pairs.keys():
-                pair_uids = pair.split(',')
-                if uid_str not in pair_uids:
-                    continue
-                pair_uids.remove(uid_str)
-                b = pair_uids[0]
-                if b in str_uids:
-                    copy.pop(pair, None)
-        return copy
-
-    @staticmethod
-    def __remove_uids(d: dict, uids: List[int]) -> dict:
-        if len(d) == 0:
-            return d
-        if len(uids) == 0:
-            return d
-        copy = d.copy()  # иначе он будет удалять из оригинального словаря
-        # разбираем парный список
-        if isinstance(next(iter(d)), str):  # первый элемент словаря - это строка?
-            str_uids = [str(uid) for uid in uids]
-            for uid in str_uids:
-                for pair in d.keys():
-                    pair_uids = pair.split(',')
-                    if uid in pair_uids:
-                        copy.pop(pair, None)
-            return copy
-        # разбираем обычный список
-        for uid in uids:
-            if uid in d:
-                copy.pop(uid, None)
-        return copy
+    def __to_uids(top: List[Tuple[str, int]]) -> List[Tuple[int, int]]:
+        return [(int(uid), count) for uid, count in top]
 
     @classmethod
-    @run_async
+    @in_background()
     def parse_message(cls, message):
         from_uid = message.from_user.id
         cid = message.chat_id
-        entities = message.parse_entities()
+        analysis = MessageAnalysis.get(message)
 
         if message.reply_to_message is not None:
             to_uid = message.reply_to_message.from_user.id
             cls.add(from_uid, to_uid, cid)
 
-        for entity, entity_text in entities.items():
-            if entity.type == 'mention':
-                username = entity_text.lstrip('@').strip()
-                try:
-                    mentioned_user_uid = UserDB.get_uid_by_username(username)
-                    if mentioned_user_uid:
-                        cls.add(from_uid, mentioned_user_uid, cid)
-                except Exception:
-                    pass
-                continue
+        for username in analysis.mentions:
+            try:
+                mentioned_user_uid = UserDB.get_uid_by_username(username)
+                if mentioned_user_uid:
+                    cls.add(from_uid, mentioned_user_uid, cid)
+            except Exception:
+                pass
 
     @classmethod
     def get_user_top_strast(cls, chat_id: int, user_id: int, date=None) -> Tuple[Optional[User], Optional[User], Optional[User]]:
-        def get_top(type: str, uid: int) -> Optional[User]:
-            if type not in db:
-                return None
-            if uid not in db[type]:
-                return None
-            replylove__ignore = CONFIG.get('replylove__ignore', [])
-            if uid in replylove__ignore:
-                return None
-            replylove__dragon_lovers = CONFIG.get('replylove__dragon_lovers', [])
-            if uid in replylove__dragon_lovers:
-                return User(0, 0, 'drakon', '🐉')
-            sorted: List[Tuple[int, int]] = sort_dict(db[type][uid])
-            if len(sorted) == 0:
-                return None
-            replylove__ignore_pairs = CONFIG.get('replylove__ignore_pairs', {}).get(str(chat_id), {}).get(str(uid), [])
-            for result_uid, count in sorted:
-                if count < 5:
-                    continue
-                if uid == result_uid:
-                    continue
-                if result_uid in replylove__dragon_lovers:
-                    continue
-                if result_uid in replylove__ignore:
-                    continue
-                if result_uid in replylove__ignore_pairs:
-                    continue
-                return User.get(result_uid)
-            return None
+        return ReplyTopUsers(chat_id, date).get_top_strast(user_id)
 
-        def get_top_pair(uid: int) -> Optional[User]:
-            replylove__dragon_lovers = CONFIG.get('replylove__dragon_lovers', [])
-            if uid in replylove__dragon_lovers:
-                return User(0, 0, 'drakon', '🐉')
-            replylove__ignore = CONFIG.get('replylove__ignore', [])
-            replylove__ignore_pairs = CONFIG.get('replylove__ignore_pairs', {}).get(str(chat_id), {}).get(str(uid), [])
-            pairs: List[Tuple[str, int]] = sort_dict(db['pair'])
-            for pair, count in pairs:
-                a_uid, b_uid = [get_int(x) for x in pair.split(',')]
-                strast = None
-                if a_uid is None or b_uid is None:
-                    continue
-                if count < 5:
-                    continue
-                if uid == a_uid and a_uid == b_uid:
-                    continue
-                if any(x in replylove__dragon_lovers for x in (a_uid, b_uid)):
-                    continue
-                if any(x in replylove__ignore for x in (uid, a_uid, b_uid)):
-                    continue
-                if any(x in replylove__ignore_pairs for x in (a_uid, b_uid)):
-                    continue
-                if uid == a_uid:
-                    strast = User.get(b_uid)
-                if uid == b_uid:
-                    strast = User.get(a_uid)
-                if strast:
-                    return strast
-            return None
 
+class ReplyTopUsers:
+    """
+    Топы страсти чата за неделю (см. ReplyGraph), но с юзерами вместо айди.
+
+    Статистика грузится из редиса один раз, юзеры запоминаются. Для отчетов по всему чату
+    юзеров лучше загрузить заранее пачкой: get_chat_users и prefetch.
+    """
+
+    def __init__(self, chat_id: int, date=None) -> None:
         monday = get_current_monday() if date is None else get_date_monday(date)
-        db = cls.db_helper.get_db(monday, chat_id)
+        db = ReplyTop.db_helper.get_db(monday, chat_id)
+        ignore_pairs = CONFIG.get('replylove__ignore_pairs', {}).get(str(chat_id), {})
+        self.graph = ReplyGraph(db,
+                                ignore=CONFIG.get('replylove__ignore', []),
+                                dragon_lovers=CONFIG.get('replylove__dragon_lovers', []),
+                                ignore_pairs=ignore_pairs)
+        self.users: Dict[int, Optional[User]] = {}
+
+    def get_chat_users(self, chat_id: int) -> List[User]:
+        """
+        Все юзеры чата, отсортированные по имени.
+        """
+        uids = [chatuser.uid for chatuser in ChatUser.get_all(chat_id)]
+        users = User.get_many(uids)
+        self.users.update(users)
+        return sorted((users[uid] for uid in uids if uid in users), key=lambda x: x.fullname)
 
-        pair = get_top_pair(user_id)
-        inbound = get_top('inbound', user_id)
-        outbound = get_top('outbound', user_id)
-        return pair, inbound, outbound
+    def prefetch(self, uids: Iterable[int]) -> None:
+        """
+        Загружает одной пачкой всех, кто может оказаться в топах этих юзеров.
+        """
+        partners = set()
+        for uid in uids:
+            partners.update(self.graph.get_pair_candidates(uid)[:1])
+            partners.add(self.graph.get_inbound(uid))
+            partners.add(self.graph.get_outbound(uid))
+        missing = [uid for uid in partners if uid and uid not in self.users]
+        users = User.get_many(missing)
+        self.users.update((uid, users.get(uid)) for uid in missing)
+
+    def get_pair(self, uid: int) -> Optional[User]:
+        for partner in self.graph.get_pair_candidates(uid):
+            user = self.__get_user(partner)
+            if user:
+                return user
+        return None
+
+    def get_inbound(self, uid: int) -> Optional[User]:
+        return self.__get_user(self.graph.get_inbound(uid))
+
+    def get_outbound(self, uid: int) -> Optional[User]:
+        return self.__get_user(self.graph.get_outbound(uid))
+
+    def get_top_strast(self, uid: int) -> Tuple[Optional[User], Optional[User], Optional[User]]:
+        return self.get_pair(uid), self.get_inbound(uid), self.get_outbound(uid)
+
+    def __get_user(self, uid: Optional[int]) -> Optional[User]:
+        if uid is None:
+            return None
+        if uid == DRAGON_UID:
+            return User(0, 0, 'drakon', '🐉')
+        if uid not in self.users:
+            self.users[uid] = User.get(uid)
+        return self.users[uid]
 
 
 class ReplyTopDaily:
@@ -293,9 +277,10 @@ class ReplyTopDaily:
     db_helper = ReplyTopDBHelper('replytop_daily')
 
     @classmethod
-    def add(cls, from_uid, to_uid, cid, date: Optional[datetime] = None):
+    def add(cls, from_uid, to_uid, cid, date: Optional[datetime] = None,
+            batch: PureCache = pure_cache):
         day = datetime.today() if date is None else date
-        cls.db_helper.add(from_uid, to_uid, cid, day)
+        cls.db_helper.add(from_uid, to_uid, cid, day, batch=batch)
 
 
 class ReplyLove:
@@ -331,12 +316,13 @@ class ReplyLove:
                 return ''
             return f'\n\nНарциссы:\n' + '\n'.join((cls.__format_pair(a) for a in narcissist_))
 
-        all_chat_users = ChatUser.get_all(chat_id)
-        all_users = (User.get(chatuser.uid) for chatuser in all_chat_users)
-        all_users = sorted(all_users, key=lambda x: x.fullname)
-        all_love = [(user, ReplyTop.get_user_top_strast(chat_id, user.uid, date)[0]) for user in all_users if user]
+        tops = ReplyTopUsers(chat_id, date)
+        all_users = tops.get_chat_users(chat_id)
+        tops.prefetch(user.uid for user in all_users)
+        all_love = [(user, tops.get_pair(user.uid)) for user in all_users]
+        tops.prefetch(b.uid for _, b in all_love if b)
 
-        in_love = [(a, b, ReplyTop.get_user_top_strast(chat_id, b.uid, date)[0]) for a, b in all_love if b]
+        in_love = [(a, b, tops.get_pair(b.uid)) for a, b in all_love if b]
         narcissist = [a for a, _ in all_love if a.uid in CONFIG.get('replylove__narcissist', [])]
         no_love = [a for a, b in all_love if not b and a.uid not in CONFIG.get('replylove__narcissist', [])]
 
@@ -348,12 +334,13 @@ class ReplyLove:
 
     @classmethod
     def get_all_love_outbound(cls, chat_id: int, date=None, header='Вся исходящая страсть', no_love_show_only_count=False) -> str:
-        all_chat_users = ChatUser.get_all(chat_id)
-        all_users = (User.get(chatuser.uid) for chatuser in all_chat_users)
-        all_users = sorted(all_users, key=lambda x: x.fullname)
-        all_love = [(user, ReplyTop.get_user_top_strast(chat_id, user.uid, date)[2]) for user in all_users if user]
+        tops = ReplyTopUsers(chat_id, date)
+        all_users = tops.get_chat_users(chat_id)
+        tops.prefetch(user.uid for user in all_users)
+        all_love = [(user, tops.get_outbound(user.uid)) for user in all_users]
+        tops.prefetch(b.uid for _, b in all_love if b)
 
-        in_love = [(a, b, ReplyTop.get_user_top_strast(chat_id, b.uid, date)[2]) for a, b in all_love if b]
+        in_love = [(a, b, tops.get_outbound(b.uid)) for a, b in all_love if b]
         no_love = [a for a, b in all_love if not b]
 
         in_love_str = '\n'.join(cls.__format_pair(a, b, b_pair) for a, b, b_pair in in_love)
@@ -5,7 +5,8 @@ import telegram
 from sqlalchemy import Column, Integer, Text, Boolean
 
 from src.models.chat_user import ChatUser
-from src.utils.cache import cache, USER_CACHE_EXPIRE
+from src.utils.cache import tiered_cache, USER_CACHE_EXPIRE
+from src.utils.codec import codec
 from src.utils.db import Base, add_to_db, retry, session_scope
 from src.utils.logger_helpers import get_logger
 from src.utils.misc import get_int
@@ -153,8 +154,12 @@ class User:
         new_user = User(uid=uid, username=username, fullname=fullname, female=old_user_female)
 
         # пользователя нужно всегда обновлять в редисе (продлевать кэш, так сказать)
-        # но в базе он меняется редко. поэтому сразу обновляем редис
-        cache.set(cls.__get_cache_key(uid), new_user, time=USER_CACHE_EXPIRE)
+        # но меняется он редко. если ничего не изменилось, то только продлеваем
+        if old_user is not None and old_user.username == username \
+                and old_user.fullname == fullname:
+            tiered_cache.refresh(cls.__get_cache_key(uid), new_user, time=USER_CACHE_EXPIRE)
+            return
+        tiered_cache.set(cls.__get_cache_key(uid), new_user, time=USER_CACHE_EXPIRE)
 
         # и только потом проверяем, нужно ли обновить в базе
         # если нужно, то __add вызовет блокировку потока
@@ -180,7 +185,7 @@ class User:
             if uid is None:
                 return None
 
-        cached = cache.get(cls.__get_cache_key(uid))
+        cached = tiered_cache.get(cls.__get_cache_key(uid))
         if cached:
             return cached
 
@@ -190,12 +195,27 @@ class User:
             try:
                 user = UserDB.get(uid)
                 if user:
-                    cache.set(cls.__get_cache_key(uid), user, time=USER_CACHE_EXPIRE)
+                    tiered_cache.set(cls.__get_cache_key(uid), user, time=USER_CACHE_EXPIRE)
                     return user
             except Exception as e:
                 logger.error(e)
         return None
 
+    @classmethod
+    def get_many(cls, uids: typing.Iterable[int]) -> typing.Dict[int, 'User']:
+        """
+        Как get, но для многих юзеров: все, кто есть в кэше, читаются одним запросом.
+        Возвращает только найденных.
+        """
+        uids = list(dict.fromkeys(uid for uid in uids if uid))
+        cached = tiered_cache.get_many([cls.__get_cache_key(uid) for uid in uids])
+        users = {}
+        for uid, user in zip(uids, cached):
+            user = user if user else cls.get(uid)
+            if user:
+                users[uid] = user
+        return users
+
     def get_username_or_link(self) -> str:
         if self.username is not None:
             return '@{}'.format(self.username)
@@ -203,7 +223,7 @@ class User:
 
     @classmethod
     def clear_cache(cls):
-        cache.delete_by_pattern(cls.__get_cache_key('*'))
+        tiered_cache.delete_by_pattern(cls.__get_cache_key('*'))
 
     @staticmethod
     def get_id_by_name(username: str) -> typing.Optional[int]:
@@ -229,3 +249,9 @@ class User:
     @staticmethod
     def __get_cache_key(uid) -> str:
         return f'user:{uid}'
+
+
+codec.register(User, 'user:1',
+               lambda user: [user._id, user.uid, user.username, user.fullname, user.public,
+                             user.female],
+               lambda state: User(*state))
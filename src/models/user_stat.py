@@ -6,18 +6,22 @@ from threading import Lock
 from urllib.parse import urlparse
 
 import pytils
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime, func, or_
+import redis
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, bindparam, func, text, \
+    UniqueConstraint
 
-import emoji_fixed as emoji
 from src.config import CONFIG
-from src.modules.antimat.antimat import Antimat
 from src.models.chat_user import ChatUser, ChatUserDB
 from src.models.user import UserDB, User
 from src.utils.cache import USER_CACHE_EXPIRE, bot_id
-from src.utils.cache import cache
-from src.utils.db import Base, add_to_db, retry, session_scope
+from src.utils.cache import cache, pure_cache, PureCache
+from src.utils.db import Base, session_scope
+from src.utils.emoji_scanner import emoji_scanner
+from src.utils.locks import StripedLock
 from src.utils.logger_helpers import get_logger
-from src.utils.misc import sort_dict
+from src.utils.message_analysis import MessageAnalysis
+from src.utils.metrics import metrics
+from src.utils.misc import sort_dict, chunks
 from src.utils.time_helpers import get_current_monday, get_date_monday
 
 logger = get_logger(__name__)
@@ -25,6 +29,8 @@ logger = get_logger(__name__)
 
 class UserStatDB(Base):
     __tablename__ = 'user_stats'
+    # нужен для INSERT ... ON DUPLICATE KEY UPDATE в UserStatFlusher
+    __table_args__ = (UniqueConstraint('stats_monday', 'cid', 'uid'),)
 
     id = Column('id', Integer, primary_key=True)
     stats_monday = Column('stats_monday', DateTime)
@@ -103,48 +109,319 @@ class UserStatDB(Base):
             top_domain=obj.top_domain
         )
 
+
+class UserStatCache:
+    """
+    Недельная стата юзера в редисе. Хранится хешем, где каждый счетчик -- отдельное поле.
+
+    Новое сообщение увеличивает только изменившиеся счетчики через HINCRBY, одним запросом.
+    Поэтому не нужно ни лочить, ни загружать и перезаписывать всю стату целиком.
+    """
+    counters: typing.Tuple[str, ...] = tuple(
+        column.name for column in UserStatDB.__table__.columns
+        if column.name.endswith('_count') or column.name.endswith('_duration'))
+    date_format = '%Y-%m-%d %H:%M:%S'
+
+    @classmethod
+    def exists(cls, monday, uid, cid) -> bool:
+        return pure_cache.exists(cls.__get_key(monday, uid, cid))
+
+    @classmethod
+    def get(cls, monday, uid, cid) -> typing.Optional['UserStat']:
+        values = pure_cache.get_hash(cls.__get_key(monday, uid, cid))
+        return cls.__from_values(values, monday, uid, cid)
+
+    @classmethod
+    def get_many(cls, keys: typing.List[typing.Tuple[datetime, int, int]]) \
+            -> typing.List[typing.Optional['UserStat']]:
+        """
+        Загружает сразу несколько стат одним запросом. keys -- список из (monday, uid, cid).
+        """
+        all_values = pure_cache.get_hashes([cls.__get_key(*key) for key in keys])
+        return [cls.__from_values(values, *key) for values, key in zip(all_values, keys)]
+
+    @classmethod
+    def __from_values(cls, values: dict, monday, uid, cid) -> typing.Optional['UserStat']:
+        if not values:
+            return None
+        stat = UserStat(stats_monday=monday, uid=uid, cid=cid)
+        for key in cls.counters:
+            setattr(stat, key, int(values.get(key, 0)))
+        stat.score = int(values.get('score', 0))
+        stat.top_domain = values.get('top_domain') or None
+        last_activity = values.get('last_activity')
+        if last_activity:
+            stat.last_activity = datetime.strptime(last_activity, cls.date_format)
+        return stat
+
+    @classmethod
+    def set(cls, stat: 'UserStat') -> None:
+        values = {key: getattr(stat, key, 0) or 0 for key in cls.counters}
+        values.update(cls.__get_values(stat))
+        pure_cache.set_hash(cls.__get_key(stat.stats_monday, stat.uid, stat.cid), values,
+                            time=USER_CACHE_EXPIRE)
+
+    @classmethod
+    def incr(cls, added_stat: 'UserStat', batch: PureCache = pure_cache) -> None:
+        """
+        Прибавляет added_stat к стате в редисе. batch -- если нужно в одном запросе
+        с другими командами
+        """
+        amounts = {}
+        for key in cls.counters:
+            value = getattr(added_stat, key, 0)
+            if value > 0:
+                amounts[key] = value
+        values = cls.__get_values(added_stat)
+        key = cls.__get_key(added_stat.stats_monday, added_stat.uid, added_stat.cid)
+        batch.incr_hash(key, amounts, values, time=USER_CACHE_EXPIRE)
+
+    @classmethod
+    def __get_values(cls, stat: 'UserStat') -> dict:
+        """
+        Поля, которые не суммируются, а перезаписываются
+        """
+        values = {}
+        if stat.last_activity is not None:
+            values['last_activity'] = stat.last_activity.strftime(cls.date_format)
+        if stat.score > 0:
+            values['score'] = stat.score
+        if stat.top_domain is not None:
+            values['top_domain'] = stat.top_domain
+        return values
+
     @staticmethod
-    @retry(logger=logger)
-    def add(added_stat: 'UserStat') -> None:
-        try:
-            add_to_db(UserStatDB.copy(added_stat))
-        except Exception as e:
-            logger.error(e)
-            raise Exception(f"Can't add userstat {added_stat.uid} to DB")
+    def __get_key(monday, uid, cid) -> str:
+        return f'userstat_hash:{monday.strftime("%Y%m%d")}:{cid}:{uid}'
+
+
+class UserStatFlusher:
+    """
+    Отложенная запись недельной статы в бд.
+
+    UserStat.add меняет стату только в редисе и помечает ее измененной. А раз в несколько секунд
+    джоба вызывает flush, который пачкой записывает в бд все измененные статы. Обработчики
+    сообщений при этом никогда не ждут mysql.
+
+    Запись идет через INSERT ... ON DUPLICATE KEY UPDATE (в sqlite -- ON CONFLICT), поэтому
+    в таблице user_stats должен быть уникальный ключ (stats_monday, cid, uid).
+    """
+    dirty_key = 'userstat:dirty'
+    flushing_key = 'userstat:dirty:flushing'
+    chunk_size = 500
+    lock = Lock()
+    columns: typing.Tuple[str, ...] = ('stats_monday', 'uid', 'cid', 'last_activity') + \
+        UserStatCache.counters + ('score', 'top_domain')
+
+    @classmethod
+    def mark_dirty(cls, monday, uid, cid, batch: PureCache = pure_cache) -> None:
+        batch.add_to_set(cls.dirty_key, f'{monday.strftime("%Y%m%d")}:{cid}:{uid}')
+
+    @classmethod
+    def flush(cls) -> typing.Optional[int]:
+        """
+        Записывает в бд все измененные статы. Возвращает количество записанных строк.
+
+        Если запись не удалась, то статы остаются помеченными и запишутся в следующий раз,
+        а flush возвращает None.
+        """
+        with cls.lock:
+            try:
+                members = pure_cache.move_set(cls.dirty_key, cls.flushing_key)
+                if not members:
+                    return 0
+                count = 0
+                for chunk in chunks(sorted(members), cls.chunk_size):
+                    keys = [cls.__parse_member(member) for member in chunk]
+                    stats = UserStatCache.get_many([key for key in keys if key])
+                    rows = [cls.__get_row(stat) for stat in stats if stat]
+                    cls.__upsert(rows)
+                    count += len(rows)
+                pure_cache.delete(cls.flushing_key)
+                logger.debug(f'[userstat_flush] {count} rows')
+                return count
+            except Exception as e:
+                logger.error(f"[userstat_flush] Can't flush user stats: {e}")
+                return None
+
+    @classmethod
+    def __upsert(cls, rows: typing.List[dict]) -> None:
+        if not rows:
+            return
+        with session_scope() as db:
+            # даты -- через тип колонки, чтобы в sqlite они записались в том же виде, что и из orm
+            sql = text(cls.__get_upsert_sql(db.bind.dialect.name)).bindparams(
+                bindparam('stats_monday', type_=DateTime),
+                bindparam('last_activity', type_=DateTime))
+            db.execute(sql, rows)
+
+    @classmethod
+    def __get_upsert_sql(cls, dialect: str) -> str:
+        columns = ', '.join(f'`{column}`' for column in cls.columns)
+        values = ', '.join(f':{column}' for column in cls.columns)
+        if dialect == 'sqlite':
+            # sqlite -- для прогонов benchmarks/replay, нужен sqlite 3.24+
+            updates = ', '.join(f'`{column}` = excluded.`{column}`' for column in cls.columns[3:])
+            return f'INSERT INTO `user_stats` ({columns}) VALUES ({values}) ' \
+                   f'ON CONFLICT (`stats_monday`, `cid`, `uid`) DO UPDATE SET {updates}'
+        updates = ', '.join(f'`{column}` = VALUES(`{column}`)' for column in cls.columns[3:])
+        return f'INSERT INTO `user_stats` ({columns}) VALUES ({values}) ' \
+               f'ON DUPLICATE KEY UPDATE {updates}'
+
+    @classmethod
+    def __get_row(cls, stat: 'UserStat') -> dict:
+        return {column: getattr(stat, column) for column in cls.columns}
 
     @staticmethod
-    @retry(logger=logger)
-    def update_db(added_stat: 'UserStat', update) -> None:
+    def __parse_member(member: str) -> typing.Optional[typing.Tuple[datetime, int, int]]:
         try:
-            with session_scope() as db:
-                user_stat = db.query(UserStatDB).filter(
-                    UserStatDB.stats_monday == added_stat.stats_monday,
-                    UserStatDB.cid == added_stat.cid,
-                    UserStatDB.uid == added_stat.uid)
-                if user_stat.update(update) > 0:
-                    return
+            monday_str, cid, uid = member.split(':')
+            return datetime.strptime(monday_str, '%Y%m%d'), int(uid), int(cid)
+        except Exception:
+            logger.error(f'[userstat_flush] Wrong key: {member}')
+            return None
+
+
+class UserStatLeaderboard:
+    """
+    Недельные рейтинги чата в редисе: сортированное множество uid -> счетчик на каждую метрику
+    и хеш с суммами по всему чату.
+
+    UserStat.add увеличивает их вместе со статой юзера. Поэтому топ, место юзера, проценты и
+    список активных берутся из редиса за O(log n), без запросов к user_stats.
+
+    Если рейтинга нет (редис почистили, неделя давно прошла или рейтинги только появились),
+    то он собирается из бд при первом чтении.
+    """
+    metrics: typing.Tuple[str, ...] = ('all_messages_count', 'emoji_count', 'obscene_words_count',
+                                       'words_count')
+    built_field = 'built'
+    build_tries = 3
+    lock = StripedLock(16)
+
+    @classmethod
+    def incr(cls, added_stat: 'UserStat', batch: PureCache = pure_cache) -> None:
+        monday = added_stat.stats_monday
+        cid = added_stat.cid
+        totals = {}
+        for metric in cls.metrics:
+            key = cls.__get_key(monday, cid, metric)
+            value = getattr(added_stat, metric, 0)
+            if value > 0:
+                batch.incr_sorted_set(key, {str(added_stat.uid): value})
+                totals[metric] = value
+            # все ключи рейтинга должны протухать одновременно
+            batch.expire(key, USER_CACHE_EXPIRE)
+        batch.incr_hash(cls.__get_totals_key(monday, cid), totals, time=USER_CACHE_EXPIRE)
+
+    @classmethod
+    def get_top(cls, monday, cid, metric: str = 'all_messages_count',
+                limit: typing.Optional[int] = None,
+                desc: bool = True) -> typing.List[typing.Tuple[int, int]]:
+        """
+        Список (uid, значение), отсортированный по значению. Только юзеры со значением > 0.
+        """
+        cls.__get_totals(monday, cid)
+        end = -1 if limit is None else limit - 1
+        top = pure_cache.get_sorted_set(cls.__get_key(monday, cid, metric), 0, end, desc=desc)
+        return [(int(uid), count) for uid, count in top]
+
+    @classmethod
+    def get_position(cls, monday, cid, uid,
+                     metric: str = 'all_messages_count') -> typing.Optional[typing.Tuple[int, int]]:
+        """
+        Место юзера (с единицы) и его значение. None, если юзера нет в рейтинге.
+        """
+        cls.__get_totals(monday, cid)
+        rank = pure_cache.get_sorted_set_rank(cls.__get_key(monday, cid, metric), str(uid))
+        if rank is None:
+            return None
+        position, count = rank
+        return position + 1, count
+
+    @classmethod
+    def get_total(cls, monday, cid, metric: str = 'all_messages_count') -> int:
+        return int(cls.__get_totals(monday, cid).get(metric, 0))
 
-            logger.error(
-                f'[userstat.update] user {added_stat.uid}:{added_stat.cid} not found in DB')
+    @classmethod
+    def get_users_count(cls, monday, cid, metric: str = 'all_messages_count',
+                        max_count: typing.Optional[int] = None) -> int:
+        """
+        Сколько юзеров в рейтинге. Если передан max_count, то только тех, у кого значение
+        не больше него.
+        """
+        cls.__get_totals(monday, cid)
+        key = cls.__get_key(monday, cid, metric)
+        if max_count is None:
+            return pure_cache.get_sorted_set_size(key)
+        return pure_cache.count_sorted_set(key, 1, max_count)
 
-            # update возвращает 0 если объекта нет в бд
-            # тогда мы добавляем его в бд и еще раз пробуем обновить
-            # статистику добавляем даже по тем, кого нет в таблицах User|ChatUser
-            add_to_db(UserStatDB.copy(added_stat))
+    @classmethod
+    def __get_totals(cls, monday, cid) -> typing.Dict[str, str]:
+        totals = pure_cache.get_hash(cls.__get_totals_key(monday, cid))
+        if cls.built_field in totals:
+            return totals
+        return cls.__build(monday, cid)
+
+    @classmethod
+    def __build(cls, monday, cid) -> typing.Dict[str, str]:
+        with cls.lock.get(monday, cid):
+            for _ in range(cls.build_tries):
+                totals = pure_cache.get_hash(cls.__get_totals_key(monday, cid))
+                if cls.built_field in totals:
+                    return totals
+                logger.info(f'[userstat_leaderboard] build {monday.strftime("%Y%m%d")}:{cid}')
+                try:
+                    return cls.__rebuild(monday, cid)
+                except redis.WatchError:
+                    # пока читали бд, UserStat.add увеличил рейтинг: его инкремент мог не попасть
+                    # в выборку, а перезапись его бы стерла. Собираем заново
+                    continue
+                except Exception as e:
+                    logger.error(f"[userstat_leaderboard] Can't build {monday}:{cid}: {e}")
+                    return totals
+            logger.warning(f"[userstat_leaderboard] Can't build {monday}:{cid}: chat is too busy")
+            return totals
+
+    @classmethod
+    def __rebuild(cls, monday, cid) -> typing.Dict[str, str]:
+        """
+        Перезаписывает рейтинг из бд. Каждый UserStat.add увеличивает хеш с суммами, поэтому
+        он под WATCH: если рейтинг изменился с начала сборки, то ничего не пишется и
+        бросается redis.WatchError.
+        """
+        with pure_cache.watch(cls.__get_totals_key(monday, cid)) as transaction:
+            # в бд должно быть все, что уже есть в редисе. Иначе рейтинг без недописанного
+            # считался бы собранным до конца недели
+            if UserStatFlusher.flush() is None:
+                raise Exception("Can't flush user stats")
             with session_scope() as db:
-                user_stat = db.query(UserStatDB).filter(
-                    UserStatDB.stats_monday == added_stat.stats_monday,
-                    UserStatDB.cid == added_stat.cid,
-                    UserStatDB.uid == added_stat.uid)
-                user_stat.update(update)
-        except Exception as e:
-            logger.error(e)
-            raise Exception(f"Can't update userstat {added_stat.uid}:{added_stat.cid} to DB")
+                stats = [UserStat.copy(stat) for stat in db.query(UserStatDB)
+                         .filter(UserStatDB.stats_monday == monday, UserStatDB.cid == cid)
+                         .all()]
+            totals = {cls.built_field: 1}
+            for metric in cls.metrics:
+                scores = {str(stat.uid): getattr(stat, metric) for stat in stats
+                          if getattr(stat, metric) > 0}
+                transaction.set_sorted_set(cls.__get_key(monday, cid, metric), scores,
+                                           time=USER_CACHE_EXPIRE)
+                totals[metric] = sum(scores.values())
+            transaction.set_hash(cls.__get_totals_key(monday, cid), totals,
+                                 time=USER_CACHE_EXPIRE)
+        return {key: str(value) for key, value in totals.items()}
+
+    @staticmethod
+    def __get_key(monday, cid, metric: str) -> str:
+        return f'userstat_top:{monday.strftime("%Y%m%d")}:{cid}:{metric}'
+
+    @staticmethod
+    def __get_totals_key(monday, cid) -> str:
+        return f'userstat_top:{monday.strftime("%Y%m%d")}:{cid}:totals'
 
 
 class UserStat:
-    add_lock = Lock()
-    get_lock = Lock()
+    # локи по паре чат-юзер, чтобы активные чаты не ждали друг друга
+    add_lock = StripedLock()
 
     def __init__(self,
                  id=None,
@@ -263,6 +540,7 @@ class UserStat:
         )
 
     @classmethod
+    @metrics.timer('function')
     def add(cls, added_stat: 'UserStat') -> None:
         if added_stat.uid == bot_id():
             return
@@ -270,43 +548,69 @@ class UserStat:
         added_stat.stats_monday = monday
         uid = added_stat.uid
         cid = added_stat.cid
-        key = cls.__get_cache_key(monday, uid, cid)
-        logger.debug(f'add_lock {cid}:{uid}')
-        # стата обновляется постоянно, поэтому лок сразу
-        with cls.add_lock:
-            old_stat = cls.get(monday, uid, cid)
-            try:
-                if old_stat is not None:
-                    updated_stat = cls.__update(old_stat, added_stat)
-                    cache.set(key, updated_stat, time=USER_CACHE_EXPIRE)
+        try:
+            # лок нужен только когда статы еще нет в редисе. дальше счетчики увеличиваются атомарно
+            if not UserStatCache.exists(monday, uid, cid):
+                if cls.__load(monday, uid, cid, new_stat=added_stat) is None:
                     return
-                UserStatDB.add(added_stat)
-                cache.set(key, added_stat, time=USER_CACHE_EXPIRE)
-            except Exception as e:
-                logger.error(e)
+            with pure_cache.batch() as batch:
+                UserStatCache.incr(added_stat, batch)
+                # в бд стата попадет через UserStatFlusher. Помечаем до рейтинга: если сборка
+                # рейтинга (UserStatLeaderboard.__rebuild) не заметила его инкремента,
+                # то ее flush уже запишет стату в бд
+                UserStatFlusher.mark_dirty(monday, uid, cid, batch)
+                UserStatLeaderboard.incr(added_stat, batch)
+        except Exception as e:
+            logger.error(e)
 
     @classmethod
     def get(cls, monday, uid, cid) -> typing.Optional['UserStat']:
-        cached = cache.get(cls.__get_cache_key(monday, uid, cid))
+        cached = UserStatCache.get(monday, uid, cid)
         if cached:
             return cached
-        logger.debug(f'get_lock {cid}:{uid}')
+        try:
+            return cls.__load(monday, uid, cid)
+        except Exception as e:
+            logger.error(e)
+        return None
+
+    @classmethod
+    def __load(cls, monday, uid, cid,
+               new_stat: typing.Optional['UserStat'] = None) -> typing.Optional['UserStat']:
+        """
+        Переносит стату из бд в редис. Если в бд ее нет, то кладет в редис new_stat.
+
+        Возвращает None, если new_stat был добавлен как есть (т.е. его не нужно дополнительно
+        прибавлять к стате).
+        """
+        logger.debug(f'load_lock {cid}:{uid}')
         # лок, чтобы в редис попали точно такие же данные, как в бд
-        with cls.get_lock:
-            try:
-                with session_scope() as db:
-                    q = db.query(UserStatDB) \
-                        .filter(UserStatDB.stats_monday == monday,
-                                UserStatDB.cid == cid,
-                                UserStatDB.uid == uid) \
-                        .limit(1) \
-                        .all()
-                    if q:
-                        userstat = cls.copy(q[0])
-                        cache.set(cls.__get_cache_key(monday, uid, cid), userstat)
-                        return userstat
-            except Exception as e:
-                logger.error(e)
+        with cls.add_lock.get(cid, uid):
+            cached = UserStatCache.get(monday, uid, cid)
+            if cached:
+                return cached
+            userstat = cls.__get_from_db(monday, uid, cid)
+            if userstat is None:
+                if new_stat is None:
+                    return None
+                UserStatCache.set(new_stat)
+                UserStatLeaderboard.incr(new_stat)
+                UserStatFlusher.mark_dirty(monday, uid, cid)
+                return None
+            UserStatCache.set(userstat)
+            return userstat
+
+    @classmethod
+    def __get_from_db(cls, monday, uid, cid) -> typing.Optional['UserStat']:
+        with session_scope() as db:
+            q = db.query(UserStatDB) \
+                .filter(UserStatDB.stats_monday == monday,
+                        UserStatDB.cid == cid,
+                        UserStatDB.uid == uid) \
+                .limit(1) \
+                .all()
+            if q:
+                return cls.copy(q[0])
         return None
 
     @classmethod
@@ -451,13 +755,34 @@ class UserStat:
         return msg
 
     @classmethod
-    def get_chat_stats(cls, cid, date=None):
+    def get_chat_stats(cls, cid, date=None) -> typing.List[typing.Tuple['UserStat', User]]:
+        """
+        Статы всех, кто писал в чат на неделе, по убыванию количества сообщений.
+        """
         last_monday = get_current_monday() if date is None else get_date_monday(date)
+        try:
+            top = UserStatLeaderboard.get_top(last_monday, cid)
+            stats = UserStatCache.get_many([(last_monday, uid, cid) for uid, _ in top])
+        except Exception as e:
+            logger.error(e)
+            stats = [None]
+        if any(stat is None for stat in stats):
+            # часть стат уже протухла в редисе
+            return cls.__get_chat_stats_from_db(last_monday, cid)
+        result = []
+        for stat in stats:
+            user = User.get(stat.uid)
+            if user is not None:
+                result.append((stat, user))
+        return result
+
+    @staticmethod
+    def __get_chat_stats_from_db(monday, cid) -> typing.List[typing.Tuple['UserStat', User]]:
         try:
             with session_scope() as db:
                 # noinspection PyUnresolvedReferences
                 q = db.query(UserStatDB, UserDB) \
-                    .filter(UserStatDB.stats_monday == last_monday) \
+                    .filter(UserStatDB.stats_monday == monday) \
                     .filter(UserStatDB.uid == UserDB.uid) \
                     .filter(UserStatDB.cid == cid) \
                     .filter(UserStatDB.all_messages_count > 0) \
@@ -538,42 +863,43 @@ ORDER BY `count` DESC
         top_chart = ''
         uids = []
         last_monday = get_current_monday() if date is None else get_date_monday(date)
-        all_msg_count = cls.__get_all_msg_count(last_monday, cid)
 
         q = []
         try:
-            with session_scope() as db:
-                # noinspection PyUnresolvedReferences
-                q = db.query(UserStatDB, UserDB) \
-                    .filter(UserStatDB.stats_monday == last_monday) \
-                    .filter(UserStatDB.uid == UserDB.uid) \
-                    .filter(UserStatDB.cid == cid) \
-                    .filter(UserStatDB.all_messages_count > 0) \
-                    .order_by(UserStatDB.all_messages_count.desc()) \
-                    .all()
-                q = [(UserStat.copy(userstat), User.copy(user)) for userstat, user in q]
+            all_msg_count = UserStatLeaderboard.get_total(last_monday, cid)
+            q_all_length = UserStatLeaderboard.get_users_count(last_monday, cid)
+            if salo:
+                # молчуны: все, у кого до 15 сообщений, и еще один
+                limit = UserStatLeaderboard.get_users_count(last_monday, cid, max_count=15) + 1
+                q = UserStatLeaderboard.get_top(last_monday, cid, limit=limit, desc=False)
+            else:
+                limit = None if fullstat else CONFIG['top_users_num']
+                q = UserStatLeaderboard.get_top(last_monday, cid, limit=limit)
         except Exception as e:
             logger.error(e)
         if len(q) == 0:
             return {'users_count': 0, 'top_chart': '', 'msg_count': 0, 'percent': 0, 'uids': []}
+        user_stats = {}
+        if mat:
+            stats = UserStatCache.get_many([(last_monday, uid, cid) for uid, _ in q])
+            user_stats = {stat.uid: stat for stat in stats if stat is not None}
 
         user_position = 0
         asc_msg_count = 0
-        if salo:
-            q = q[::-1]
 
         magic_percent = 100
-        q_all_length = len(q)  # if type(q) is list else len(q.all())
         if not salo and q_all_length > 25:
             magic_percent = 146
 
-        for user_stat, user in q:
-            count = user_stat.all_messages_count
+        for uid, count in q:
+            user = User.get(uid)
+            if user is None:
+                continue
             user_position += 1
             asc_msg_count += count
             raw_percent = count * magic_percent / all_msg_count
             percent = cls.number_format(raw_percent, 2)
-            user_mat = '' if not mat else cls.__get_user_mat(user_stat)
+            user_mat = '' if uid not in user_stats else cls.__get_user_mat(user_stats[uid])
             top_chart += f"<b>{user_position}. {user.fullname}</b> — <b>{count}</b> ({percent}%){user_mat}\n"
             uids.append(user.uid)
             if not fullstat and user_position >= CONFIG['top_users_num']:
@@ -590,7 +916,7 @@ ORDER BY `count` DESC
                 all_users = ChatUserDB.get_all(cid)
             except Exception as e:
                 logger.error(e)
-            active_user_ids = [x.uid for _, x in q]
+            active_user_ids = {uid for uid, _ in UserStatLeaderboard.get_top(last_monday, cid)}
             silent_lines = []
             for chat_user in all_users:
                 if chat_user.uid not in active_user_ids:
@@ -637,23 +963,12 @@ ORDER BY `count` DESC
         last_monday = get_current_monday() if date is None else get_date_monday(date)
 
         try:
-            with session_scope() as db:
-                # noinspection PyUnresolvedReferences
-                q = db.query(UserStatDB, UserDB) \
-                    .filter(UserStatDB.stats_monday == last_monday) \
-                    .filter(UserStatDB.uid == UserDB.uid) \
-                    .filter(UserStatDB.cid == cid) \
-                    .filter(UserStatDB.all_messages_count > 0) \
-                    .order_by(UserStatDB.all_messages_count.desc()) \
-                    .all()
-                q = [(UserStat.copy(userstat), User.copy(user)) for userstat, user in q]
-            if q:
-                position = 0
-                for userstat, user in q:
-                    position += 1
-                    if userstat.uid == user_id:
-                        msg_count = userstat.all_messages_count
-                        break
+            user_position = UserStatLeaderboard.get_position(last_monday, cid, user_id)
+            if user_position is not None:
+                position, msg_count = user_position
+            else:
+                # как раньше: если юзер не писал, то он после всех
+                position = UserStatLeaderboard.get_users_count(last_monday, cid) or -1
         except Exception as e:
             logger.error(e)
         return {
@@ -666,26 +981,10 @@ ORDER BY `count` DESC
         """
         :rtype: User
         """
-        last_monday = get_current_monday() if date is None else get_date_monday(date)
-        try:
-            with session_scope() as db:
-                # noinspection PyUnresolvedReferences
-                q = db.query(UserStatDB, UserDB) \
-                    .filter(UserStatDB.stats_monday == last_monday) \
-                    .filter(UserStatDB.uid == UserDB.uid) \
-                    .filter(UserStatDB.cid == cid) \
-                    .filter(or_(
-                        UserStatDB.emoji_count > 0,
-                        UserStatDB.stickers_count > 0,
-                        UserStatDB.gifs_count > 0
-                    )) \
-                    .order_by(UserStatDB.emoji_count.desc()) \
-                    .all()
-                q = [(UserStat.copy(userstat), User.copy(user)) for userstat, user in q]
-            if not q:
-                return None
-        except Exception as e:
-            logger.error(e)
+        q = [(user_stat, user) for user_stat, user in cls.get_chat_stats(cid, date)
+             if user_stat.emoji_count > 0 or user_stat.stickers_count > 0
+             or user_stat.gifs_count > 0]
+        if not q:
             return None
 
         # получаем соотношение количества эмодзи к сообщениям
@@ -706,61 +1005,7 @@ ORDER BY `count` DESC
         return user
 
     @staticmethod
-    def __get_all_msg_count(monday, cid):
-        # key = 'all_msg_{}_{}'.format(monday.strftime("%Y%m%d"), cid)
-        # cached = cache.get(key)
-        # if cached is not None:
-        #     return int(cached)
-
-        try:
-            with session_scope() as db:
-                q = db.query(func.sum(UserStatDB.all_messages_count)) \
-                    .filter(UserStatDB.stats_monday == monday) \
-                    .filter(UserStatDB.cid == cid) \
-                    .all()[0][0]
-            if q is None:
-                # cache.set(key, str(0), time=USER_CACHE_EXPIRE)
-                return 0
-        except Exception as e:
-            logger.error(e)
-            return 0
-        count = int(q)
-        # cache.set(key, str(count), time=USER_CACHE_EXPIRE)
-        return count
-
-    @staticmethod
-    def __update(old_stat, added_stat):
-        update = {}
-        if added_stat.last_activity is not None:
-            old_stat.last_activity = added_stat.last_activity
-            update['last_activity'] = added_stat.last_activity
-        if added_stat.score > 0:
-            old_stat.score = added_stat.score
-            update['score'] = added_stat.score
-        if added_stat.top_domain is not None:
-            old_stat.top_domain = added_stat.top_domain
-            update['top_domain'] = added_stat.top_domain
-
-        for key in old_stat.__dict__.keys():
-            if key.startswith('_'):
-                continue
-            if not key.endswith('_count') and not key.endswith('_duration'):
-                continue
-            old_value = getattr(old_stat, key, 0)
-            new_value = getattr(added_stat, key, 0)
-            if new_value > 0:
-                update[key] = old_value + new_value
-                setattr(old_stat, key, update[key])
-
-        try:
-            UserStatDB.update_db(added_stat, update)
-        except Exception as e:
-            logger.error(e)
-            raise
-        return old_stat
-
-    @staticmethod
-    def parse_message_stat(uid, cid, message, entities):
+    def parse_message_stat(uid, cid, message, analysis: MessageAnalysis):
         result = UserStat()
         result.uid = uid
         result.cid = cid
@@ -774,7 +1019,7 @@ ORDER BY `count` DESC
             reply_stat.cid = cid
             UserStat.add(reply_stat)
 
-        for entity, entity_text in entities.items():
+        for entity, entity_text in analysis.entities.items():
             if entity.type == 'mention':
                 result.sent_mentions_count = result.sent_mentions_count + 1
                 username = entity_text.lstrip('@').strip()
@@ -812,15 +1057,15 @@ ORDER BY `count` DESC
 
         if message.text is not None and not foreign_forward:
             result.text_messages_count = 1
-            obscene_words_count = Antimat.bad_words_count(message.text)
+            obscene_words_count = len(analysis.obscene_words)
             if obscene_words_count > 0:
                 result.text_messages_with_obscene_count = 1
             result.obscene_words_count = result.obscene_words_count + obscene_words_count
-            result.words_count = result.words_count + len(message.text.split())
+            result.words_count = result.words_count + len(analysis.words)
             result.chars_count = result.chars_count + len(message.text)
             result.chars_wo_space_count = result.chars_wo_space_count + result.chars_count - message.text.count(
                 ' ')
-            result.emoji_count = len([e for e in message.text if e in emoji.UNICODE_EMOJI])
+            result.emoji_count = emoji_scanner.count(message.text)
 
         if message.audio is not None:
             result.audios_count = 1
@@ -854,9 +1099,8 @@ ORDER BY `count` DESC
             result.video_notes_duration = message.video_note.duration
 
         if message.caption is not None and not foreign_forward:
-            result.obscene_words_count = result.obscene_words_count + Antimat.bad_words_count(
-                message.caption)
-            result.words_count = result.words_count + len(message.caption.split())
+            result.obscene_words_count = result.obscene_words_count + len(analysis.obscene_words)
+            result.words_count = result.words_count + len(analysis.words)
             result.chars_count = result.chars_count + len(message.caption)
             result.chars_wo_space_count = result.chars_wo_space_count + result.chars_count - message.caption.count(
                 ' ')
@@ -886,13 +1130,9 @@ ORDER BY `count` DESC
 
         return '0 секунд'
 
-    @staticmethod
-    def __get_cache_key(monday, uid, cid):
-        return f'userstat:{monday.strftime("%Y%m%d")}:{cid}:{uid}'
-
 
 class UserDomains:
-    lock = Lock()
+    lock = StripedLock()
 
     @staticmethod
     def __parse_domain(url):
@@ -907,7 +1147,7 @@ class UserDomains:
         # в мемкеше хранятся все домены пользователя за текущую неделю с количеством использований
         monday = get_current_monday()
         logger.debug(f'update_user_top_domain_lock {cid}:{uid}')
-        with cls.lock:
+        with cls.lock.get(cid, uid):
             cache_key = cls.__get_user_domain_cache_key(monday, uid, cid)
             user_domains = cache.get(cache_key)
             if user_domains is None:
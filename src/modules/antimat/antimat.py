@@ -1,6 +1,8 @@
 import re
 from functools import partial
-from typing import Iterable, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.utils.trie_regexp import build_trie_regexp
 
 extended_filter_enabled = False  # если True, то проверяем не только мат, но и оскорбления, ругательства, etc
 
@@ -101,17 +103,123 @@ class ObsceneRegexp:
 ObsceneRegexp.ru_variants_of_letter = partial(ObsceneRegexp.variants_of_letter, ObsceneRegexp.alphabet_ru)
 
 
+class ObscenePrefilter:
+    """
+    Быстрая проверка: может ли в тексте вообще найтись мат.
+
+    Огромная регулярка bad_words_re на каждом слове перебирает все варианты, а в большинстве
+    сообщений мата нет. Поэтому сначала текст переводится в "канонические" буквы (латиница
+    и похожие символы -> кириллица, ё -> е и т.д.) и проверяется одной регуляркой-деревом по
+    анкорам -- буквам, без которых ни одна из плохих регулярок не сработает. Повторы букв
+    и разделители между ними (как в build_bad_phrase) учитываются.
+
+    Ни одна плохая регулярка не матчит пробелы, поэтому обычную регулярку достаточно запустить
+    только на тех словах (кусках текста между пробелами), где нашелся анкор. Результат
+    при этом такой же, как у bad_words_re на всем тексте.
+    """
+    # символы, которые re.IGNORECASE считает равными буквам алфавита,
+    # хотя lower/upper их не переводят
+    case_variants = {
+        'i': 'İı',
+        'k': '\u212a',
+        'в': '\u1c80',
+        'д': '\u1c81',
+        'о': '\u1c82',
+        'с': '\u1c83',
+        'т': '\u1c84\u1c85',
+        'ъ': '\u1c86',
+    }
+    separator = r'[^\w\s\\/]*'
+    re_not_spaces = re.compile(r'\S*')
+
+    def __init__(self, anchors: List[str],
+                 alphabet: Dict[str, str] = ObsceneRegexp.alphabet_ru) -> None:
+        self.canonical = self.__get_canonical(alphabet)
+        self.table = self.__get_translate_table(self.canonical)
+        sequences = [[self.__get_token(symbol) for symbol in anchor.split()] for anchor in anchors]
+        self.regexp = re.compile(build_trie_regexp(sequences, separator=self.separator))
+
+    def may_contain(self, text: str) -> bool:
+        # в build_bad_phrase '|' попадает внутрь классов букв. такие тексты проверяем по-честному
+        if '|' in text:
+            return True
+        return self.regexp.search(text.translate(self.table)) is not None
+
+    def find_chunks(self, text: str) -> Iterator[Tuple[int, int]]:
+        """
+        Возвращает (start, end) кусков текста, в которых может быть мат
+        """
+        if '|' in text:
+            yield 0, len(text)
+            return
+        # translate меняет символы один к одному, поэтому позиции совпадают с исходным текстом
+        end = 0
+        for match in self.regexp.finditer(text.translate(self.table)):
+            start = match.start()
+            if start < end:
+                continue
+            while start > end and not text[start - 1].isspace():
+                start -= 1
+            end = self.re_not_spaces.match(text, match.end()).end()
+            yield start, end
+
+    def __get_token(self, symbol: str) -> str:
+        letters = sorted(set(self.canonical.get(letter, letter) for letter in symbol))
+        if len(letters) == 1:
+            letter = re.escape(letters[0])
+            return f'{letter}{letter}*'
+        letters_class = '[{}]'.format(''.join(re.escape(letter) for letter in letters))
+        return f'{letters_class}{letters_class}*'
+
+    @staticmethod
+    def __get_canonical(alphabet: Dict[str, str]) -> Dict[str, str]:
+        """
+        Разбивает буквы и их варианты на группы взаимозаменяемых (например, б, в, 6, b и v)
+        и для каждой возвращает одну букву группы.
+        """
+        canonical: Dict[str, str] = {}
+
+        def find(letter: str) -> str:
+            while canonical.setdefault(letter, letter) != letter:
+                letter = canonical[letter]
+            return letter
+
+        for letter, variants in alphabet.items():
+            for variant in variants:
+                root, variant_root = find(letter), find(variant)
+                if root != variant_root:
+                    canonical[variant_root] = root
+        return {letter: find(letter) for letter in canonical}
+
+    @classmethod
+    def __get_translate_table(cls, canonical: Dict[str, str]) -> Dict[int, str]:
+        table = {}
+        for letter, root in canonical.items():
+            variants = {letter, letter.lower(), letter.upper()}
+            for variant in variants | set(cls.case_variants.get(letter, '')):
+                if len(variant) == 1:
+                    table[ord(variant)] = root
+        return table
+
+
 class ObsceneWordsFilter(object):
     """
     Основа из https://github.com/asyncee/python-obscene-words-filter
     """
 
-    def __init__(self, bad_regexp, good_regexp):
+    def __init__(self, bad_regexp, good_regexp, prefilter: Optional[ObscenePrefilter] = None):
         self.bad_regexp = bad_regexp
         self.good_regexp = good_regexp
+        self.prefilter = prefilter
 
     def find_bad_word_matches(self, text):
-        return self.bad_regexp.finditer(text)
+        if self.prefilter is None:
+            return self.bad_regexp.finditer(text)
+        return self.__find_bad_word_matches_in_chunks(text)
+
+    def __find_bad_word_matches_in_chunks(self, text):
+        for start, end in self.prefilter.find_chunks(text):
+            yield from self.bad_regexp.finditer(text, start, end)
 
     def find_bad_word_matches_without_good_words(self, text):
         for match in self.find_bad_word_matches(text):
@@ -206,6 +314,37 @@ class ObsceneConf:
         ])
     bad_words_re = re.compile('|'.join(bad_words), re.IGNORECASE | re.UNICODE)
 
+    # анкоры для ObscenePrefilter в формате build_bad_phrase: каждая регулярка из bad_words
+    # может сработать только там, где есть хотя бы один из них.
+    # при изменении bad_words проверь анкоры
+    bad_anchors = [
+        'п еиё з д',
+        'х у йёеяию',
+        'её б',
+        'св ъь еёи б',
+        'б л я',
+        'е л д',
+    ]
+    if extended_filter_enabled:
+        bad_anchors.extend([
+            'п иеё д оеа р',
+            'п ие д р',
+            'г оа в н',
+            'м у д а кч',
+            'г ао н д о н',
+            'д е р ь м',
+            'ш л ю х',
+            'з ао л у п',
+            'с у ч а р',
+            'м у д и л',
+            'д р оа ч',
+            'ш а л а в',
+            'ч м',
+            'м ао н д',
+            'з б с',
+            'х з',
+        ])
+
     good_words = [
         ObsceneRegexp.build_good_phrase('х л е б а л оа'),
         ObsceneRegexp.build_good_phrase('с к и п и д а р'),
@@ -336,7 +475,8 @@ class ObsceneConf:
 
 
 def get_default_filter():
-    return ObsceneWordsFilter(ObsceneConf.bad_words_re, ObsceneConf.good_words_re)
+    return ObsceneWordsFilter(ObsceneConf.bad_words_re, ObsceneConf.good_words_re,
+                              ObscenePrefilter(ObsceneConf.bad_anchors))
 
 
 class Antimat:
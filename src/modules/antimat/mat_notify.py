@@ -2,24 +2,24 @@ import random
 from typing import List
 
 import telegram
-from telegram.ext import run_async
 
 from src.config import CONFIG
-from src.modules.antimat.antimat import Antimat
 from src.modules.antimat.matshowtime import matshowtime
+from src.utils.background import in_background
 from src.utils.cache import pure_cache, FEW_DAYS, USER_CACHE_EXPIRE
+from src.utils.message_analysis import MessageAnalysis
 from src.utils.time_helpers import get_current_monday_str
 
 
-@run_async
+@in_background()
 def mat_notify(bot: telegram.Bot, update: telegram.Update):
     message = update.message
-    text = message.text if message.text else message.caption
-    if text is None:
+    analysis = MessageAnalysis.get(message)
+    if analysis.text_or_caption is None:
         return
 
     # получаем матерные слова из текста
-    mat_words = list(word.lower() for word in Antimat.bad_words(text))
+    mat_words = list(word.lower() for word in analysis.obscene_words)
     if len(mat_words) == 0:
         return
 
@@ -73,8 +73,9 @@ def is_foreign_forward(uid: int, message: telegram.Message) -> bool:
 def save_to_redis(cid: int, mat_words: List[str]) -> None:
     monday = get_current_monday_str()
 
-    # сохраняем все уникальные матерные слова в редис, чтобы проверять ложные срабатывания
-    pure_cache.add_to_set(f"mat:daily_uniq:{monday}", mat_words, time=FEW_DAYS)
+    with pure_cache.batch() as batch:
+        # сохраняем все уникальные матерные слова в редис, чтобы проверять ложные срабатывания
+        batch.add_to_set(f"mat:daily_uniq:{monday}", mat_words, time=FEW_DAYS)
 
-    # сохраняем все слова для подсчета статистики по словам
-    pure_cache.append_list(f'mat:words:{monday}:{cid}', mat_words, time=USER_CACHE_EXPIRE)
+        # сохраняем все слова для подсчета статистики по словам
+        batch.append_list(f'mat:words:{monday}:{cid}', mat_words, time=USER_CACHE_EXPIRE)
@@ -8,9 +8,10 @@ import telegram
 from src.config import CONFIG
 from src.modules.antimat.antimat import Antimat
 from src.utils.cache import pure_cache, TWO_YEARS, cache, MONTH
-from src.utils.callback_helpers import get_callback_data
+from src.utils.callback_helpers import get_inline_keyboard
 from src.utils.logger_helpers import get_logger
-from src.utils.telegram_helpers import telegram_retry, dsp
+from src.utils.send_queue import send_queue
+from src.utils.telegram_helpers import telegram_retry
 
 logger = get_logger(__name__)
 CACHE_PREFIX = 'matshowtime'
@@ -62,7 +63,7 @@ class TelegramWrapper:
                      text: str,
                      chat_id: int,
                      buttons=None) -> None:
-        reply_markup = cls.get_reply_markup(buttons)
+        reply_markup = cls.get_reply_markup(buttons, chat_id, message_id)
         try:
             bot.edit_message_text(
                 text,
@@ -78,7 +79,7 @@ class TelegramWrapper:
 
     @classmethod
     def edit_buttons(cls, bot: telegram.Bot, message_id: int, buttons, chat_id: int) -> None:
-        reply_markup = cls.get_reply_markup(buttons)
+        reply_markup = cls.get_reply_markup(buttons, chat_id, message_id)
         try:
             bot.edit_message_reply_markup(chat_id, message_id, reply_markup=reply_markup,
                                           timeout=20)
@@ -87,21 +88,16 @@ class TelegramWrapper:
             logger.error(f"[{CACHE_PREFIX}] Can't edit buttons in {chat_id}. Exception: {e}")
 
     @staticmethod
-    def get_reply_markup(buttons) -> Optional[telegram.InlineKeyboardMarkup]:
+    def get_reply_markup(buttons,
+                         chat_id: Optional[int] = None,
+                         message_id: Optional[int] = None
+                         ) -> Optional[telegram.InlineKeyboardMarkup]:
         """
         Инлайн-кнопки под сообщением
         """
         if not buttons:
             return None
-        keyboard = []
-        for line in buttons:
-            keyboard.append([
-                telegram.InlineKeyboardButton(
-                    button_title,
-                    callback_data=(get_callback_data(button_data)))
-                for button_title, button_data in line
-            ])
-        return telegram.InlineKeyboardMarkup(keyboard)
+        return get_inline_keyboard(buttons, chat_id, message_id)
 
     @classmethod
     def answer_callback_query_with_bot_link(cls, bot: telegram.Bot, query_id, query_data) -> None:
@@ -203,16 +199,18 @@ class ChannelMessage:
         likes, dislikes = poll.get_count()
         msg.likes = likes
         msg.dislikes = dislikes
-        dsp(cls.__update_buttons_and_answer, bot, msg, query, text)
-
-    @classmethod
-    def __update_buttons_and_answer(cls, bot, msg, query, text):
-        start_time = time.time()
-        msg.update_buttons(bot)
         try:
             bot.answer_callback_query(query.id, text)
         except Exception:
             pass
+        # пока обновление кнопок ждет в очереди, новые клики заменяют его более свежими цифрами
+        send_queue.put(query.message.chat_id, cls.__update_buttons, bot, msg,
+                       coalesce_key=f'{CACHE_PREFIX}:buttons:{msg.telegram_message_id}')
+
+    @classmethod
+    def __update_buttons(cls, bot, msg):
+        start_time = time.time()
+        msg.update_buttons(bot)
         elapsed_time = time.time() - start_time
         logger.info(f'update buttons finished in {int(elapsed_time * 1000)} ms')
 
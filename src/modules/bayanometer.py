@@ -1,8 +1,12 @@
 import datetime
 import hashlib
+import itertools
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Optional, List, Tuple
+from threading import BoundedSemaphore
+from typing import Callable, Optional, List, Tuple
 from urllib.parse import urlparse, parse_qsl, ParseResult
 
 import imagehash
@@ -10,20 +14,27 @@ import requests
 import telegram
 from PIL import Image
 from pytils.numeral import get_plural
-from telegram.ext import run_async
+from requests.adapters import HTTPAdapter
 
 from src.config import CONFIG
-from src.utils.cache import cache, TWO_DAYS, YEAR, USER_CACHE_EXPIRE
+from src.utils.background import in_background
+from src.utils.cache import cache, pure_cache, DAY, TWO_DAYS, YEAR, USER_CACHE_EXPIRE
 from src.utils.callback_helpers import get_callback_data
+from src.utils.codec import codec
+from src.utils.hamming_index import HammingIndex
 from src.utils.handlers_helpers import is_command_enabled_for_chat
-from src.utils.telegram_helpers import get_photo_url
+from src.utils.local_cache import LocalCache, MISSING
+from src.utils.telegram_helpers import get_photo_file_key, get_photo_url, wait_sent
 from src.utils.logger_helpers import get_logger
+from src.utils.message_analysis import MessageAnalysis
 
 logger = get_logger(__name__)
 
 KEY_PREFIX = 'bayanometer'
 BAYANOMETER_SHOW_ORIG = 'bayanometer_show_orig'
 
+phash_index = HammingIndex(pure_cache, f'{KEY_PREFIX}:phash_index', ttl=YEAR)
+
 
 def abs_timedelta(delta):
     """Returns an "absolute" value for a timedelta, always representing a
@@ -114,11 +125,74 @@ def relative_date(value):
 
 class Photo:
     data_type = "photo"
+    # на сколько бит могут отличаться phash, чтобы фотки считались одной (0 -- только совпадение)
+    max_distance = CONFIG.get('performance', {}).get('bayanometer_max_distance', 4)
 
     class PhotoHasher:
+        """
+        Скачивает фотки и считает их хеши в своем пуле потоков.
+
+        Раньше все это делалось прямо в обработчике сообщения: альбом из 10 фоток занимал
+        10 потоков диспетчера, пока те качали файлы и разжимали их целиком. Теперь обработчик
+        только ставит фотку в очередь. Потоков и места в очереди ограниченное количество:
+        если очередь заполнена, фотка пропускается (баянометр -- не то, ради чего стоит
+        тормозить остальной бот).
+
+        Хеши кэшируются по файлу телеграма, поэтому кнопка "Показать оригинал" не качает фотку
+        заново. Фотка разжимается целиком: уменьшенное разжатие JPEG (draft) дает другие
+        пиксели, а значит и другой phash, и старые фотки перестают находиться.
+        """
+        size = (256, 256)
+        workers = CONFIG.get('performance', {}).get('bayanometer_workers', 4)
+        queue_size = CONFIG.get('performance', {}).get('bayanometer_queue_size', 100)
+        download_timeout = 30
+        dropped = 0
+        inline = False
+        __hashes = LocalCache(
+            maxsize=CONFIG.get('performance', {}).get('bayanometer_hash_cache_size', 1000), ttl=DAY)
+        __slots = BoundedSemaphore(workers + queue_size)
+        __executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bayanometer')
+        __session = requests.Session()
+        __session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+
+        @classmethod
+        def submit(cls, func: Callable, *args) -> bool:
+            """
+            Ставит func в очередь пула. Возвращает False, если очередь заполнена.
+            """
+            if cls.inline:
+                cls.__run(func, *args)
+                return True
+            if not cls.__slots.acquire(blocking=False):
+                cls.dropped += 1
+                logger.warning(f'[{KEY_PREFIX}] queue is full, skip photo ({cls.dropped} total)')
+                return False
+            future = cls.__executor.submit(cls.__run, func, *args)
+            future.add_done_callback(lambda _: cls.__slots.release())
+            return True
+
+        @classmethod
+        def run_inline(cls, session: requests.Session) -> None:
+            """
+            Для прогонов без сети (benchmarks/replay): фотки обрабатываются сразу в вызывающем
+            потоке и качаются через session.
+            """
+            cls.inline = True
+            cls.__session = session
+
+        @classmethod
+        def get_hashes(cls, url: str, file_key: Optional[str] = None) -> List[Tuple[str, str]]:
+            hashes = cls.__hashes.get(file_key) if file_key else MISSING
+            if hashes is MISSING:
+                hashes = cls.__calc_hashes(url)
+                if file_key:
+                    cls.__hashes.set(file_key, hashes)
+            return hashes
+
         @classmethod
-        def get_hashes(cls, url: str) -> List[Tuple[str, str]]:
-            response = requests.get(url)
+        def __calc_hashes(cls, url: str) -> List[Tuple[str, str]]:
+            response = cls.__session.get(url, timeout=cls.download_timeout)
+            response.raise_for_status()
             img = cls.__prepare_img(Image.open(BytesIO(response.content)))
             return [
                 ('phash', str(imagehash.phash(img))),
@@ -129,8 +203,15 @@ class Photo:
             ]
 
         @staticmethod
-        def __prepare_img(image) -> Image:
-            size = (256, 256)
+        def __run(func: Callable, *args) -> None:
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"[{KEY_PREFIX}] Can't check photo: {e}")
+
+        @classmethod
+        def __prepare_img(cls, image) -> Image:
+            size = cls.size
             resize = Image.ANTIALIAS
             image = image.convert('L')
             # image = ImageOps.autocontrast(image)
@@ -151,11 +232,16 @@ class Photo:
 
     @classmethod
     def message_handler(cls, bot: telegram.Bot, update: telegram.Update) -> None:
+        cls.PhotoHasher.submit(cls.__handle_message, bot, update)
+
+    @classmethod
+    def __handle_message(cls, bot: telegram.Bot, update: telegram.Update) -> None:
         chat_id = update.message.chat_id
         msg_id = update.message.message_id
         user_id = update.message.from_user.id
         img_url = get_photo_url(bot, update.message)
-        photo = cls.__check(img_url, chat_id, msg_id, user_id)
+        file_key = get_photo_file_key(update.message)
+        photo = cls.__check(img_url, file_key, chat_id, msg_id, user_id)
 
         if not photo:
             return
@@ -171,7 +257,7 @@ class Photo:
 
         data = {
             "name": BAYANOMETER_SHOW_ORIG, "type": cls.data_type,
-            "orig_photo": photo, "url": img_url
+            "orig_photo": photo, "url": img_url, "file_key": file_key
         }
         cls.__send(bot, chat_id, msg_id, photo.date, data)
 
@@ -186,64 +272,86 @@ class Photo:
             if cached:
                 msg = cached
             else:
-                compare_hashes = cls.__compare_hashes(url, cid, orig_msg_id)
+                compare_hashes = cls.__compare_hashes(url, data.get('file_key'), cid, orig_msg_id)
                 orig_time = f'Оригинал запощен {orig_photo.date.strftime("%Y-%m-%d %H:%M")}'
                 msg = f'Хеши баянистого изображения:\n\n{compare_hashes}\n\n{orig_time}'
                 cache.set(cache_key, msg, time=USER_CACHE_EXPIRE)
-            bot.send_message(uid, msg, parse_mode=telegram.ParseMode.HTML)
-            bot.forward_message(uid, cid, message_id=orig_msg_id)
+            wait_sent(bot.send_message(uid, msg, parse_mode=telegram.ParseMode.HTML))
+            wait_sent(bot.forward_message(uid, cid, message_id=orig_msg_id))
             bot.answer_callback_query(query.id, url=f"t.me/{bot.username}?start={query.data}")
         except Exception:
             text = f'Не могу отправить сообщение. Нажми Start в личке бота @{bot.username} и попробуй вновь'
             bot.answerCallbackQuery(query.id, text, show_alert=True)
 
     @classmethod
-    def __check(cls, url, chat_id, message_id, user_id: int) -> Optional['Photo']:
-        hashes = cls.PhotoHasher.get_hashes(url)
+    def __check(cls, url, file_key, chat_id, message_id, user_id: int) -> Optional['Photo']:
+        hashes = cls.PhotoHasher.get_hashes(url, file_key)
         photo = None
         for hash_method, hash_value in hashes:
             key = f'{KEY_PREFIX}:photo:{chat_id}:{hash_method}:{hash_value}'
             cached = cache.get(key)
             if cached:
-                if hash_method != 'average_hash':
-                    return cached
                 return cached
-                # if cls.__double_check(hashes, chat_id, cached.message_id):
-                #     return cached
+            if hash_method == 'phash':
+                similar = cls.__find_similar(chat_id, hash_value)
+                if similar:
+                    return similar[0][0]
             if photo is None:
                 photo = Photo(message_id, datetime.datetime.now(), user_id)
             cache.set(key, photo, time=YEAR)
+            if hash_method == 'phash':
+                phash_index.add(chat_id, hash_value, int(time.time()))
         cache.set(f'{KEY_PREFIX}:photo:{chat_id}:message_id:{message_id}', dict(hashes), time=YEAR)
 
     @classmethod
-    def __double_check(cls, hashes: List, chat_id: int, message_id: int) -> bool:
-        orig_hashes_dict = cache.get(f'{KEY_PREFIX}:photo:{chat_id}:message_id:{message_id}', {})
-        hashes_dict = dict(hashes)
-
-        def check_hash(hash_method) -> bool:
-            if hash_method not in hashes_dict:
-                return False
-            if hash_method not in orig_hashes_dict:
-                return False
-            return cls.__hamming_distance(orig_hashes_dict[hash_method], hashes_dict[hash_method]) < 3
-
-        return any(check_hash(method) for method in ('dhash', 'phash'))
+    def backfill_phash_index(cls, chunk_size: int = 500) -> None:
+        """
+        Один раз добавляет в phash_index фотки, запощенные до его появления: без этого похожие
+        хеши старых фоток не находятся еще год. Запускается в фоне при старте бота, после
+        успешного прохода ставит флаг в редисе.
+        """
+        flag_key = f'{KEY_PREFIX}:phash_index_backfilled'
+        if pure_cache.exists(flag_key):
+            return
+        keys = cache.scan_keys(f'{KEY_PREFIX}:photo:*:phash:*')
+        added = 0
+        while True:
+            chunk = list(itertools.islice(keys, chunk_size))
+            if not chunk:
+                break
+            # весь кусок -- одним запросом
+            with pure_cache.batch() as batch:
+                index = HammingIndex(batch, phash_index.prefix, phash_index.ttl)
+                for key, photo in zip(chunk, cache.get_many(chunk)):
+                    if not photo:
+                        continue
+                    _, _, chat_id, _, hash_value = key.split(':')
+                    index.add(chat_id, hash_value, int(photo.date.timestamp()))
+                    added += 1
+        pure_cache.set(flag_key, added, time=YEAR)
+        logger.info(f'[{KEY_PREFIX}] phash index backfilled with {added} photos')
 
-    @staticmethod
-    def __hamming_distance(s1, s2):
+    @classmethod
+    def __find_similar(cls, chat_id: int, phash: str) -> List[Tuple['Photo', int]]:
         """
-        Return the Hamming distance between equal-length sequences
-        https://en.wikipedia.org/wiki/Hamming_distance
+        Фотки чата с похожим phash (пережатые, немного обрезанные) и на сколько бит отличаются
+        их хеши, от самых похожих.
         """
-        if len(s1) != len(s2):
-            raise ValueError("Undefined for sequences of unequal length")
-        return sum(el1 != el2 for el1, el2 in zip(s1, s2))
+        if cls.max_distance <= 0:
+            return []
+        similar = phash_index.find(chat_id, phash, cls.max_distance)
+        if not similar:
+            return []
+        photos = cache.get_many([f'{KEY_PREFIX}:photo:{chat_id}:phash:{similar_hash}'
+                                 for similar_hash, _ in similar])
+        return [(photo, distance) for photo, (_, distance) in zip(photos, similar) if photo]
 
     @classmethod
-    def __compare_hashes(cls, url, chat_id, orig_msg_id) -> str:
-        hashes = cls.PhotoHasher.get_hashes(url)
+    def __compare_hashes(cls, url, file_key, chat_id, orig_msg_id) -> str:
+        hashes = cls.PhotoHasher.get_hashes(url, file_key)
         result = []
         show_footnote = False
+        show_similar_footnote = False
         for hash_method, hash_value in hashes:
             key = f'{KEY_PREFIX}:photo:{chat_id}:{hash_method}:{hash_value}'
             cached: Optional[Photo] = cache.get(key)
@@ -251,9 +359,17 @@ class Photo:
             if cached and cached.message_id == orig_msg_id:
                 match = ' ✅'
                 show_footnote = True
+            elif hash_method == 'phash':
+                for photo, distance in cls.__find_similar(chat_id, hash_value):
+                    if photo.message_id == orig_msg_id:
+                        match = f' ≈ {distance}'
+                        show_similar_footnote = True
+                        break
             result.append(f'• <b>{hash_method}</b> = {hash_value}{match}')
 
         footnote = '\n\n✅ означает, что хеш совпал с оригиналом' if show_footnote else ''
+        if show_similar_footnote:
+            footnote += '\n\n≈ N означает, что хеш отличается от хеша оригинала на N бит'
         result_lines = '\n'.join(result)
         return f'{result_lines}{footnote}'
 
@@ -293,10 +409,7 @@ class URL:
         user_id = update.message.from_user.id
 
         orig = None
-        entities = update.message.parse_entities()
-        for entity, url in entities.items():
-            if entity.type != 'url':
-                continue
+        for url in MessageAnalysis.get(update.message).urls:
             prepared_url = cls.__prepare_url(url)
             if not prepared_url:
                 continue
@@ -320,7 +433,7 @@ class URL:
     def callback_handler(cls, bot: telegram.Bot, uid, cid, _, data, query: telegram.CallbackQuery) -> None:
         orig: URL = data['orig']
         try:
-            bot.forward_message(uid, cid, message_id=orig.message_id)
+            wait_sent(bot.forward_message(uid, cid, message_id=orig.message_id))
             bot.answer_callback_query(query.id, url=f"t.me/{bot.username}?start={query.data}")
         except Exception:
             text = f'Не могу отправить сообщение. Нажми Start в личке бота @{bot.username} и попробуй вновь'
@@ -406,9 +519,17 @@ class URL:
         return f'{rv.scheme}://{rv.netloc}{path}{query}{fragment}'
 
 
+codec.register(Photo, 'bayanometer_photo:1',
+               lambda photo: [photo.message_id, photo.date, photo.user_id],
+               lambda state: Photo(*state))
+codec.register(URL, 'bayanometer_url:1',
+               lambda url: [url.message_id, url.date, url.user_id],
+               lambda state: URL(*state))
+
+
 class Bayanometer:
     @classmethod
-    @run_async
+    @in_background()
     def check(cls, bot: telegram.Bot, update: telegram.Update) -> None:
         chat_id = update.message.chat_id
         if not is_command_enabled_for_chat(chat_id, 'bayanometer'):
@@ -7,11 +7,18 @@ from src.config import get_config_chats
 from src.dayof.day_manager import DayOfManager
 from src.models.leave_collector import LeaveCollector
 from src.models.reply_top import ReplyDumper
+from src.models.user_stat import UserStatFlusher
 from src.commands.weather import send_alert_if_full_moon
+from src.utils.background import background_executor
 from src.utils.cache import pure_cache, FEW_DAYS
+from src.utils.db import get_pool_status
 from src.utils.handlers_helpers import is_command_enabled_for_chat
+from src.utils.logger_helpers import get_logger
+from src.utils.send_queue import send_queue
 from src.utils.time_helpers import today_str
 
+logger = get_logger(__name__)
+
 
 @run_async
 def daily_midnight(bot: telegram.Bot, _):
@@ -51,3 +58,10 @@ def health_log(bot: telegram.Bot, _) -> None:
     messages_metric = pure_cache.get(f"metrics:messages:{today_str()}", '0')
     value = f"{now.strftime('%H:%M')} - {messages_metric} - {answer}"
     pure_cache.append_list(f"health_log:{now.strftime('%Y%m%d')}", value, time=FEW_DAYS)
+    logger.info(f'[db_pool] {get_pool_status()}')
+    logger.info(f'[send_queue] {send_queue.get_status()}')
+    logger.info(f'[background] {background_executor.get_status()}')
+
+
+def flush_user_stats(_bot: telegram.Bot, _) -> None:
+    UserStatFlusher.flush()
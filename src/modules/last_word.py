@@ -1,6 +1,6 @@
 import telegram
-from telegram.ext import run_async
 
+from src.utils.background import in_background
 from src.utils.cache import cache, TWO_YEARS
 from src.utils.logger_helpers import get_logger
 
@@ -17,25 +17,17 @@ def callback_last_word(bot: telegram.Bot, _: telegram.Update, query, data):
     msg_ids = [result[0] for result in
                (cache.get(get_last_word_cache_key(cid, _uid)) for _uid in data['leaves_uid']) if
                result is not None and isinstance(result, tuple)]
+    # ошибки отправки (например, личка с ботом не начата) логирует send_queue
     if len(msg_ids) == 0:
-        try:
-            bot.sendMessage(uid, 'Увы, у меня не сохранились последние слова этих человеков 😢')
-        except Exception:
-            pass
+        bot.sendMessage(uid, 'Увы, у меня не сохранились последние слова этих человеков 😢')
         return
 
-    try:
-        bot.sendMessage(uid, 'Последние слова убывших:')
-    except Exception:
-        pass
+    bot.sendMessage(uid, 'Последние слова убывших:')
     for msg_id in msg_ids:
-        try:
-            bot.forwardMessage(uid, cid, message_id=msg_id)
-        except Exception:
-            pass
+        bot.forwardMessage(uid, cid, message_id=msg_id)
 
 
-@run_async
+@in_background()
 def last_word(_: telegram.Bot, update: telegram.Update):
     message = update.message
     left = message.left_chat_member is not None
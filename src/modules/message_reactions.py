@@ -18,11 +18,13 @@ from src.models.leave_collector import LeaveCollector
 from src.models.pidor_weekly import PidorWeekly
 from src.models.user import User
 from src.commands.khaleesi.random_khaleesi import RandomKhaleesi
+from src.utils.background import BackgroundExecutor, in_background
 from src.utils.cache import cache, TWO_DAYS, USER_CACHE_EXPIRE, pure_cache
 from src.utils.handlers_decorators import chat_guard, collect_stats, command_guard
 from src.utils.handlers_helpers import is_command_enabled_for_chat, \
     check_command_is_off
 from src.utils.logger_helpers import get_logger
+from src.utils.message_analysis import MessageAnalysis
 from src.utils.time_helpers import get_current_monday_str, today_str
 
 logger = get_logger(__name__)
@@ -47,7 +49,7 @@ def message(bot, update):
     pure_cache.incr(f"metrics:messages:{today_str()}")
 
 
-@run_async
+@in_background(BackgroundExecutor.HIGH)
 def send_gdeleha(bot, chat_id, msg_id, user_id):
     if user_id in CONFIG.get('leha_ids', []) or user_id in CONFIG.get('leha_anya', []):
         bot.sendMessage(chat_id, "Леха — это ты!", reply_to_message_id=msg_id)
@@ -72,7 +74,7 @@ def send_gdeleha(bot, chat_id, msg_id, user_id):
     ])
 
 
-@run_async
+@in_background(BackgroundExecutor.HIGH)
 def send_pidor(bot, update):
     chat_id = update.message.chat_id
     msg_id = update.message.message_id
@@ -88,7 +90,7 @@ def send_pidor(bot, update):
     bot.sendSticker(chat_id, sticker_id, reply_to_message_id=msg_id)
 
 
-@run_async
+@in_background(BackgroundExecutor.HIGH)
 def send_random_sticker_from_stickerset(bot: telegram.Bot, chat_id: int, stickerset_name: str) -> None:
     key = f'stickerset:{stickerset_name}'
     stickerset = cache.get(key)
@@ -99,7 +101,7 @@ def send_random_sticker_from_stickerset(bot: telegram.Bot, chat_id: int, sticker
     bot.send_sticker(chat_id, sticker)
 
 
-@run_async
+@in_background(BackgroundExecutor.HIGH)
 def send_random_sticker(bot: telegram.Bot, chat_id, stickers) -> None:
     bot.send_sticker(chat_id, random.choice(stickers))
 
@@ -116,7 +118,8 @@ def message_reactions(bot: telegram.Bot, update: telegram.Update) -> None:
         return
 
     chat_id = update.message.chat_id
-    msg_lower = msg.lower()
+    analysis = MessageAnalysis.get(update.message)
+    msg_lower = analysis.lower
     msg_id = update.message.message_id
     user_id = update.message.from_user.id
     if msg_lower == 'сы':
@@ -148,12 +151,11 @@ def message_reactions(bot: telegram.Bot, update: telegram.Update) -> None:
         send_gdeleha(bot, chat_id, msg_id, user_id)
         return
 
-    words_lower = msg_lower.split()
-    if 'пидор' in words_lower:
+    if 'пидор' in analysis.words:
         send_pidor(bot, update)
 
 
-@run_async
+@in_background(BackgroundExecutor.LOW)
 def update_stickers(_: telegram.Bot, update: telegram.Update) -> None:
     """
     Добавление стикера в использованные
@@ -176,12 +178,10 @@ def check_photos_in_urls(bot: telegram.Bot, update: telegram.Update) -> None:
     """
     Парсит entities сообщения на случай если картинка указана ссылкой.
     """
-    entities = update.message.parse_entities()
-    for entity, entity_text in entities.items():
-        if entity.type == 'url':
-            if re_img.search(entity_text):
-                photo_reactions(bot, update, img_url=entity_text)
-                return
+    for url in MessageAnalysis.get(update.message).urls:
+        if re_img.search(url):
+            photo_reactions(bot, update, img_url=url)
+            return
 
 
 def photo_reactions(bot: telegram.Bot, update: telegram.Update, img_url=None):
@@ -207,7 +207,7 @@ def photo_reactions(bot: telegram.Bot, update: telegram.Update, img_url=None):
 
 
 # noinspection PyPackageRequirements
-@run_async
+@in_background(BackgroundExecutor.LOW)
 def call_cats_vision_api(bot: telegram.Bot, update: telegram.Update, key_media_group: str,
                          img_url=None):
     chat_id = update.message.chat_id
@@ -1,7 +1,8 @@
 import random
+import time
 import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from time import sleep
 
 import pytils
 import telegram
@@ -10,26 +11,33 @@ from telegram.ext import run_async
 
 import emoji_fixed as emoji
 import src.config as config
-from src.config import CMDS
-from src.commands.topmat import send_topmat
+from src.config import CMDS, CONFIG
+from src.commands.topmat import get_topmat_msg
 from src.models.igor_weekly import IgorWeekly
 from src.models.pidor_weekly import PidorWeekly
 from src.models.reply_top import ReplyTop, ReplyLove
 from src.models.user import User
-from src.models.user_stat import UserStat
+from src.models.user_stat import UserStat, UserStatFlusher
 from src.utils.cache import cache, MONTH, bot_id
 from src.utils.handlers_decorators import chat_guard, collect_stats, command_guard
 from src.utils.handlers_helpers import is_command_enabled_for_chat, \
     get_command_name, check_admin
 from src.utils.logger_helpers import get_logger
 from src.utils.misc import get_int, chunks
-from src.utils.telegram_helpers import dsp
+from src.utils.send_queue import send_queue
 
 logger = get_logger(__name__)
 
+
+class WeeklyMessage(typing.NamedTuple):
+    text: str
+    # отправляется, если text не отправился (например, телеграм не дал сослаться на юзера)
+    fallback: typing.Optional[str] = None
+
+
 def send_long(bot: telegram.Bot, chat_id: int, msg: str):
     for chunk in chunks(msg, 4096):
-        dsp(bot.send_message, chat_id, chunk, parse_mode=ParseMode.HTML)
+        send_queue.put(chat_id, bot.send_message, chat_id, chunk, parse_mode=ParseMode.HTML)
 
 
 @run_async
@@ -50,6 +58,10 @@ def stats(bot, update):
 
 
 def send_stats(bot, chat_id, chat_title, command, date, tag_salo=False, mat=False):
+    send_long(bot, chat_id, get_stats_msg(chat_id, chat_title, command, date, tag_salo, mat))
+
+
+def get_stats_msg(chat_id, chat_title, command, date, tag_salo=False, mat=False) -> str:
     users_count_caption = ''
     top_chart_caption = ''
     percent_needed = False
@@ -81,42 +93,38 @@ def send_stats(bot, chat_id, chat_title, command, date, tag_salo=False, mat=Fals
                                info['top_chart'],
                                top_chart_caption,
                                percents)
-    send_long(bot, chat_id, msg)
     logger.info(f'Group {chat_id} requested stats')
     if salo:
         cache.set(f'weekgoal:{chat_id}:salo_uids', info['uids'][0:3], time=MONTH)
     elif fullstat:
         cache.set(f'weekgoal:{chat_id}:top_pidori_uids', info['uids'][0:3], time=MONTH)
+    return msg
 
 
-def send_top_kroshka(bot, chat_id, monday):
+def get_top_kroshka_msg(chat_id, monday) -> typing.Optional[WeeklyMessage]:
     kroshka = UserStat.get_top_kroshka(chat_id, monday)
     if not kroshka:
-        return
+        return None
     cache.set(f'weekgoal:{chat_id}:kroshka_uid', kroshka.uid, time=MONTH)
     emoj = ''.join(random.sample(list(emoji.UNICODE_EMOJI), 5))
     she = 'Она' if kroshka.female else 'Он'
     msg = f'Замечательная крошка-картошка <a href="tg://user?id={kroshka.uid}">🥔</a> недели —\n\n<b>{kroshka.fullname}</b> ❤️❤️❤️\n\n{she} получает эти прекрасные эмодзи: {emoj}'
-    try:
-        send_long(bot, chat_id, msg)
-    except Exception:
-        msg = f'Замечательная крошка-картошка 🥔 недели —\n\n<b>{kroshka.fullname}</b> ❤️❤️❤️\n\n{she} получает эти прекрасные эмодзи: {emoj}'
-        send_long(bot, chat_id, f'{msg}\n\n{kroshka.get_username_or_link()}')
+    fallback = (f'Замечательная крошка-картошка 🥔 недели —\n\n<b>{kroshka.fullname}</b> ❤️❤️❤️\n\n'
+                f'{she} получает эти прекрасные эмодзи: {emoj}')
+    return WeeklyMessage(msg, f'{fallback}\n\n{kroshka.get_username_or_link()}')
 
 
-def send_alllove(bot, chat_id, prev_monday):
-    msg = ReplyLove.get_all_love(chat_id, date=prev_monday, header='Вся страсть за неделю')
-    send_long(bot, chat_id, msg)
+def get_alllove_msg(chat_id, prev_monday) -> str:
+    return ReplyLove.get_all_love(chat_id, date=prev_monday, header='Вся страсть за неделю')
 
 
-def send_alllove_outbound(bot, chat_id, prev_monday):
-    msg = ReplyLove.get_all_love_outbound(chat_id, date=prev_monday,
-                                          header='Вся исходящая страсть за неделю',
-                                          no_love_show_only_count=True)
-    send_long(bot, chat_id, msg)
+def get_alllove_outbound_msg(chat_id, prev_monday) -> str:
+    return ReplyLove.get_all_love_outbound(chat_id, date=prev_monday,
+                                           header='Вся исходящая страсть за неделю',
+                                           no_love_show_only_count=True)
 
 
-def send_replytop(bot, chat_id, prev_monday):
+def get_replytop_msg(chat_id, prev_monday) -> str:
     stats = ReplyTop.get_stats(chat_id, prev_monday)
     msg = "<b>Кто кого реплаит</b>\n\n"
 
@@ -153,18 +161,17 @@ def send_replytop(bot, chat_id, prev_monday):
         names = [__get_user_fullname(uid1), __get_user_fullname(uid2)]
         random.shuffle(names)
         msg += f"{count}. <b>{names[0]}</b> ⟷ <b>{names[1]}</b>\n"
-
-    send_long(bot, chat_id, msg)
+    return msg
 
 
-def send_pidorweekly(bot, chat_id, prev_monday):
+def get_pidorweekly_msg(chat_id, prev_monday) -> typing.Optional[WeeklyMessage]:
     uid = PidorWeekly.get_top_pidor(chat_id, prev_monday)
     if not uid:
-        return
+        return None
     user = User.get(uid)
     if not user:
         logger.error(f'None user {uid}')
-        return
+        return None
     cache.set(f'weekgoal:{chat_id}:pidorweekly_uid', user.uid, time=MONTH)
     pidorom = 'пидоршей' if user.female else 'пидором'
     header = f"И {pidorom} недели становится... <a href='tg://user?id={user.uid}'>👯‍♂</a> \n\n"
@@ -173,30 +180,26 @@ def send_pidorweekly(bot, chat_id, prev_monday):
                     ':volcano:']
     random.shuffle(random_emoji)
     body += "{} Ура!".format(emoji.emojize(''.join(random_emoji)))
-    try:
-        send_long(bot, chat_id, f'{header}{body}')
-    except Exception:
-        header = f"И {pidorom} недели становится... 👯‍♂ \n\n"
-        send_long(bot, chat_id, f'{header}{body}\n\n{user.get_username_or_link()}')
+    fallback_header = f"И {pidorom} недели становится... 👯‍♂ \n\n"
+    return WeeklyMessage(f'{header}{body}',
+                         f'{fallback_header}{body}\n\n{user.get_username_or_link()}')
 
 
-def send_igorweekly(bot: telegram.Bot, chat_id: int, prev_monday: datetime):
+def get_igorweekly_msg(chat_id: int, prev_monday: datetime) -> typing.Optional[WeeklyMessage]:
     uid = IgorWeekly.get_top_igor(chat_id, prev_monday)
     if not uid:
-        return
+        return None
     user = User.get(uid)
     if not user:
         logger.error(f'None user {uid}')
-        return
+        return None
     cache.set(f'weekgoal:{chat_id}:igorweekly_uid', user.uid, time=MONTH)
     igorem = 'игорессой' if user.female else 'игорем'
     header = f"И {igorem} недели становится... <a href='tg://user?id={user.uid}'>👯‍♂</a> \n\n"
     body = "🎉     <b>{}</b>    🎉\n\nУра!".format(user.fullname)
-    try:
-        send_long(bot, chat_id, f'{header}{body}')
-    except Exception:
-        header = f"И {igorem} недели становится... 👯‍♂ \n\n"
-        send_long(bot, chat_id, f'{header}{body}\n\n{user.get_username_or_link()}')
+    fallback_header = f"И {igorem} недели становится... 👯‍♂ \n\n"
+    return WeeklyMessage(f'{header}{body}',
+                         f'{fallback_header}{body}\n\n{user.get_username_or_link()}')
 
 
 @run_async
@@ -205,36 +208,98 @@ def weekly_stats(bot: telegram.Bot, _) -> None:
     # эта штука запускается в понедельник ночью, поэтому мы откладываем неделю назад
     prev_monday = (today - timedelta(days=today.weekday() + 7)).replace(hour=0, minute=0, second=0,
                                                                         microsecond=0)
-    for chat in config.get_config_chats():
-        if not is_command_enabled_for_chat(chat.chat_id, 'weeklystat'):
-            continue
-        send_weekly_for_chat(bot, chat.chat_id, chat.disabled_commands, chat.enabled_commands,
-                             prev_monday)
-
-
-def send_weekly_for_chat(bot: telegram.Bot, chat_id: int, disabled_commands: typing.List[str],
-                         enabled_commands: typing.List[str], prev_monday: datetime) -> None:
-    logger.info(f'weekly_stats for chat {chat_id}')
-    send_stats(bot, chat_id, 'Стата за прошлую неделю',
-               CMDS['admins']['all_stat']['name'], prev_monday)
-    sleep(1)
-    send_stats(bot, chat_id, 'Стата за прошлую неделю',
-               CMDS['admins']['silent_guys']['name'], prev_monday, tag_salo=True)
-    sleep(1)
-    if 'weeklystat:top_kroshka' not in disabled_commands:
-        send_top_kroshka(bot, chat_id, prev_monday)
-        sleep(1)
-    if 'weeklystat:pidorweekly' not in disabled_commands:
-        send_pidorweekly(bot, chat_id, prev_monday)
-        sleep(1)
-    if 'weeklystat:igorweekly' in enabled_commands:
-        send_igorweekly(bot, chat_id, prev_monday)
-        sleep(1)
-    send_replytop(bot, chat_id, prev_monday)
-    sleep(1)
-    send_alllove(bot, chat_id, prev_monday)
-    sleep(1)
-    send_alllove_outbound(bot, chat_id, prev_monday)
-    sleep(1)
-    send_topmat(bot, chat_id, chat_id, prev_monday)
-    sleep(1)
+    # стата пишется в бд с задержкой, а топы строятся по бд
+    UserStatFlusher.flush()
+    WeeklyReport.send_all(bot, prev_monday)
+
+
+class WeeklyReport:
+    """
+    Недельная стата для всех чатов. Работает в две фазы:
+
+    1. build -- все сообщения для чата считаются заранее. Чаты считаются параллельно в пуле потоков.
+    2. send -- готовые сообщения отправляются по порядку через send_queue с низким приоритетом.
+       Очередь соблюдает лимиты телеграма для каждого чата, поэтому разные чаты не ждут друг друга.
+
+    Чат начинает отправляться, как только для него все посчитано. Ошибка в одном разделе
+    или чате не мешает остальным.
+    """
+    workers = CONFIG.get('performance', {}).get('weekly_stats_workers', 4)
+
+    @classmethod
+    def send_all(cls, bot: telegram.Bot, prev_monday: datetime) -> None:
+        start = time.monotonic()
+        chats = [chat for chat in config.get_config_chats()
+                 if is_command_enabled_for_chat(chat.chat_id, 'weeklystat')]
+        builders = ThreadPoolExecutor(max_workers=cls.workers, thread_name_prefix='weekly_build')
+        senders = ThreadPoolExecutor(max_workers=cls.workers, thread_name_prefix='weekly_send')
+        with builders, senders:
+            futures = {builders.submit(cls.build, chat.chat_id, chat.disabled_commands,
+                                       chat.enabled_commands, prev_monday): chat.chat_id
+                       for chat in chats}
+            for future in as_completed(futures):
+                senders.submit(cls.send, bot, futures[future], future.result())
+        logger.info(f'[weekly_stats] {len(chats)} chats in {time.monotonic() - start:.1f}s')
+
+    @classmethod
+    def build(cls, chat_id: int, disabled_commands: typing.List[str],
+              enabled_commands: typing.List[str],
+              prev_monday: datetime) -> typing.List[WeeklyMessage]:
+        start = time.monotonic()
+        sections: typing.List[typing.Tuple[str, typing.Callable[[], typing.Any]]] = [
+            ('all_stat', lambda: get_stats_msg(chat_id, 'Стата за прошлую неделю',
+                                               CMDS['admins']['all_stat']['name'], prev_monday)),
+            ('silent_guys', lambda: get_stats_msg(chat_id, 'Стата за прошлую неделю',
+                                                  CMDS['admins']['silent_guys']['name'],
+                                                  prev_monday, tag_salo=True)),
+        ]
+        if 'weeklystat:top_kroshka' not in disabled_commands:
+            sections.append(('top_kroshka', lambda: get_top_kroshka_msg(chat_id, prev_monday)))
+        if 'weeklystat:pidorweekly' not in disabled_commands:
+            sections.append(('pidorweekly', lambda: get_pidorweekly_msg(chat_id, prev_monday)))
+        if 'weeklystat:igorweekly' in enabled_commands:
+            sections.append(('igorweekly', lambda: get_igorweekly_msg(chat_id, prev_monday)))
+        sections.extend([
+            ('replytop', lambda: get_replytop_msg(chat_id, prev_monday)),
+            ('alllove', lambda: get_alllove_msg(chat_id, prev_monday)),
+            ('alllove_outbound', lambda: get_alllove_outbound_msg(chat_id, prev_monday)),
+            ('topmat', lambda: get_topmat_msg(chat_id, prev_monday)),
+        ])
+
+        messages = []
+        for name, get_msg in sections:
+            try:
+                msg = get_msg()
+            except Exception as e:
+                logger.error(f"[weekly_stats] Can't build {name} for chat {chat_id}: {e}")
+                continue
+            if msg:
+                messages.append(msg if isinstance(msg, WeeklyMessage) else WeeklyMessage(msg))
+        logger.info(f'[weekly_stats] chat {chat_id}: {len(messages)} messages built in '
+                    f'{time.monotonic() - start:.1f}s')
+        return messages
+
+    @classmethod
+    def send(cls, bot: telegram.Bot, chat_id: int, messages: typing.List[WeeklyMessage]) -> None:
+        start = time.monotonic()
+        for message in messages:
+            try:
+                cls.__send_long(bot, chat_id, message.text)
+            except Exception as e:
+                if not message.fallback:
+                    logger.error(f"[weekly_stats] Can't send to chat {chat_id}: {e}")
+                    continue
+                try:
+                    cls.__send_long(bot, chat_id, message.fallback)
+                except Exception as e:
+                    logger.error(f"[weekly_stats] Can't send fallback to chat {chat_id}: {e}")
+        logger.info(f'[weekly_stats] chat {chat_id}: sent in {time.monotonic() - start:.1f}s')
+
+    @staticmethod
+    def __send_long(bot: telegram.Bot, chat_id: int, text: str) -> None:
+        # ответы на команды важнее, поэтому недельная стата уходит с низким приоритетом
+        sent = [send_queue.put(chat_id, bot.send_message, chat_id, chunk,
+                               parse_mode=ParseMode.HTML, priority=send_queue.LOW)
+                for chunk in chunks(text, 4096)]
+        for future in sent:
+            future.result()
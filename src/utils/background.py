@@ -0,0 +1,184 @@
+import heapq
+import itertools
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+from src.config import CONFIG
+from src.utils.logger_helpers import get_logger
+from src.utils.metrics import Histogram, metrics
+
+logger = get_logger(__name__)
+
+# секунды от постановки задачи до ее начала и время выполнения
+WAIT_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 3, 10, 30, 60]
+RUN_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30]
+
+
+class _Task:
+    __slots__ = ('func', 'args', 'kwargs', 'priority', 'seq', 'name', 'enqueued_at')
+
+    def __init__(self, func: Callable, args: tuple, kwargs: dict, priority: int, seq: int,
+                 name: str) -> None:
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.name = name
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other: '_Task') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class BackgroundExecutor:
+    """
+    Отдельный пул потоков для фоновой обработки сообщений: реплай-топ, пидор и игорь недели,
+    последнее слово, стикеры, баянометр, котики и т.д.
+
+    Раньше все это запускалось через @run_async в общем пуле python-telegram-bot: одно сообщение
+    порождало 5-8 задач, и при наплыве сообщений очередь пула росла без ограничений, а ответы
+    на команды ждали в ней же. Теперь у фоновых задач свой пул и своя ограниченная очередь:
+
+    * LOW (аналитика, без которой можно обойтись) отбрасывается, когда очередь заполнена
+      наполовину;
+    * NORMAL -- когда очередь заполнена целиком;
+    * HIGH (ответы людям, например стикеры) принимается всегда.
+
+    Из очереди первыми берутся задачи с меньшим priority, при равном -- в порядке постановки.
+
+        @in_background(BackgroundExecutor.LOW)
+        def update_stickers(bot, update):
+            ...
+
+    До start() (скрипты, тесты) задача просто выполняется сразу.
+    """
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+    def __init__(self, workers: int = 8, maxsize: int = 1000) -> None:
+        self.workers = workers
+        self.maxsize = maxsize
+        self.limits = {self.HIGH: float('inf'), self.NORMAL: maxsize, self.LOW: maxsize // 2}
+        self.running = False
+        self.wait_time = Histogram(WAIT_BUCKETS)
+        self.run_time = Histogram(RUN_BUCKETS)
+        self.done = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.shed: Dict[str, int] = {}
+        self._queue: List[_Task] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        with self._cond:
+            if self.running:
+                return
+            self.running = True
+        self._threads = [threading.Thread(target=self.__work, name=f'background_{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Перестает принимать задачи и ждет, пока выполнятся уже поставленные.
+        """
+        with self._cond:
+            if not self.running:
+                return
+            self.running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def submit(self, func: Callable, *args, priority: int = NORMAL, name: Optional[str] = None,
+               **kwargs) -> bool:
+        """
+        Ставит задачу в очередь. False, если задача отброшена, потому что очередь заполнена.
+        """
+        name = name or getattr(func, '__qualname__', repr(func))
+        with self._cond:
+            if self.running:
+                if len(self._queue) >= self.limits[priority]:
+                    self.shed[name] = self.shed.get(name, 0) + 1
+                    logger.debug(f'[background] Queue is full, {name} is shed')
+                    return False
+                heapq.heappush(self._queue, _Task(func, args, kwargs, priority, next(self._seq),
+                                                  name))
+                self.max_depth = max(self.max_depth, len(self._queue))
+                self._cond.notify()
+                return True
+        func(*args, **kwargs)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'depth': len(self._queue),
+                'max_depth': self.max_depth,
+                'done': self.done,
+                'failed': self.failed,
+                'shed': dict(self.shed),
+            }
+
+    def get_status(self) -> str:
+        stats = self.stats()
+        shed = ','.join(f'{name}:{count}' for name, count in sorted(stats['shed'].items()))
+        return (f"depth={stats['depth']} max_depth={stats['max_depth']} done={stats['done']} "
+                f"failed={stats['failed']} shed={shed or 0} "
+                f"wait_p50={self.wait_time.percentile(0.5)}s "
+                f"wait_p99={self.wait_time.percentile(0.99)}s wait_max={self.wait_time.max:.3f}s "
+                f"run_p99={self.run_time.percentile(0.99)}s run_max={self.run_time.max:.3f}s")
+
+    def __work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and self.running:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                task = heapq.heappop(self._queue)
+            start = time.monotonic()
+            self.wait_time.observe(start - task.enqueued_at)
+            failed = False
+            try:
+                task.func(*task.args, **task.kwargs)
+            except Exception as e:
+                failed = True
+                logger.error(f'[background] {task.name} failed: {e}')
+            run_time = time.monotonic() - start
+            self.run_time.observe(run_time)
+            metrics.observe('background', task.name, run_time, failed)
+            with self._cond:
+                if failed:
+                    self.failed += 1
+                else:
+                    self.done += 1
+
+
+background_executor = BackgroundExecutor(
+    workers=CONFIG.get('performance', {}).get('background_workers', 8),
+    maxsize=CONFIG.get('performance', {}).get('background_queue_size', 1000))
+
+
+def in_background(priority: int = BackgroundExecutor.NORMAL):
+    """
+    Замена @run_async для фоновой обработки сообщений: функция выполняется
+    в background_executor и ничего не возвращает.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs) -> None:
+            background_executor.submit(func, *args, priority=priority, name=func.__qualname__,
+                                       **kwargs)
+
+        return wrapper
+
+    return decorator
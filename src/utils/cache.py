@@ -1,18 +1,54 @@
-import pickle
-from typing import Optional, List, Union, Set
+import time
+from contextlib import contextmanager
+from typing import Optional, List, Union, Set, Dict, Iterator, Tuple
 
 import redis
 
 from src.config import CONFIG
+from src.utils.codec import codec
+from src.utils.local_cache import LocalCache, TieredCache
+from src.utils.logger_helpers import get_logger
+from src.utils.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+class TimedRedis(redis.StrictRedis):
+    """
+    StrictRedis, который пишет в metrics время и ошибки каждой команды (семейство redis,
+    имя -- команда: GET, HGETALL, ...). Пайплайн уходит одним запросом и считается как PIPELINE.
+    """
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        error = False
+        try:
+            return super().execute_command(*args, **options)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe('redis', args[0], time.perf_counter() - start, error)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TimedPipeline(self.connection_pool, self.response_callbacks, transaction,
+                             shard_hint)
+
+
+class TimedPipeline(redis.client.StrictPipeline):
+    def execute(self, raise_on_error=True):
+        with metrics.timed('redis', 'PIPELINE'):
+            return super().execute(raise_on_error)
+
 
 if 'cache' in CONFIG:
-    _redis = redis.StrictRedis(host=CONFIG['cache']['redis']['host'],
-                               port=CONFIG['cache']['redis']['port'],
-                               db=CONFIG['cache']['redis']['db'])
-    _pure_redis = redis.StrictRedis(host=CONFIG['cache']['redis']['host'],
-                                    port=CONFIG['cache']['redis']['port'],
-                                    db=CONFIG['cache']['redis']['db'], charset='utf-8',
-                                    decode_responses=True)
+    _redis = TimedRedis(host=CONFIG['cache']['redis']['host'],
+                        port=CONFIG['cache']['redis']['port'],
+                        db=CONFIG['cache']['redis']['db'])
+    _pure_redis = TimedRedis(host=CONFIG['cache']['redis']['host'],
+                             port=CONFIG['cache']['redis']['port'],
+                             db=CONFIG['cache']['redis']['db'], charset='utf-8',
+                             decode_responses=True)
 else:
     # print("Can't connect to Redis")
     _redis = None
@@ -28,34 +64,130 @@ YEAR = 31556926  # год
 TWO_YEARS = 2 * YEAR
 
 
-class Cache:
-    @staticmethod
-    def get(key, default=None):
-        cached = _redis.get(key)
+class BaseCache:
+    """
+    Общая часть Cache и PureCache: работа через пайплайн редиса.
+    """
+
+    def __init__(self, client=None, batched: bool = False) -> None:
+        self._redis = client
+        self._batched = batched
+
+    @contextmanager
+    def batch(self) -> Iterator['BaseCache']:
+        """
+        Копит команды записи и отправляет их в редис одним запросом при выходе из with.
+
+            with pure_cache.batch() as batch:
+                batch.incr(f'metrics:messages:{today_str()}')
+                batch.append_list(key, words, time=DAY)
+
+        Внутри batch методы ничего не возвращают, поэтому читать нужно до него
+        (например, через get_many).
+        """
+        if self._batched:
+            yield self
+            return
+        pipe = self._redis.pipeline(transaction=False)
+        yield type(self)(pipe, batched=True)
+        pipe.execute()
+
+    def _pipeline(self, transaction: bool = True):
+        # внутри batch команды и так копятся в его пайплайне
+        if self._batched:
+            return self._redis
+        return self._redis.pipeline(transaction=transaction)
+
+    def _execute(self, pipe) -> Optional[list]:
+        if self._batched:
+            return None
+        return pipe.execute()
+
+
+class Cache(BaseCache):
+    """
+    Хранение любых объектов. Сериализация -- через codec (см. src/utils/codec.py).
+    """
+
+    def get(self, key, default=None):
+        cached = self._redis.get(key)
         if cached:
-            return pickle.loads(cached)
+            return self.__loads(key, cached, default)
         return default
 
-    @staticmethod
-    def set(key, val, time=None):
-        return _redis.set(key, pickle.dumps(val), ex=time)
+    def get_many(self, keys: List[str], default=None) -> list:
+        """
+        Получает несколько ключей одним запросом (MGET). Возвращает значения в том же порядке.
+        """
+        if not keys:
+            return []
+        return [self.__loads(key, cached, default) if cached else default
+                for key, cached in zip(keys, self._redis.mget(keys))]
 
-    @staticmethod
-    def delete(key):
-        return _redis.delete(key)
+    def set(self, key, val, time=None):
+        return self._redis.set(key, codec.dumps(val), ex=time)
 
-    @staticmethod
-    def delete_by_pattern(pattern: str):
+    def set_many(self, values: dict, time=None) -> None:
+        pipe = self._pipeline(transaction=False)
+        for key, val in values.items():
+            pipe.set(key, codec.dumps(val), ex=time)
+        self._execute(pipe)
+
+    def delete(self, key):
+        return self._redis.delete(key)
+
+    def expire(self, key: str, time) -> bool:
+        """
+        Возвращает False, если ключа нет (внутри batch -- ничего не возвращает).
+        """
+        return self._redis.expire(key, time)
+
+    def publish(self, channel: str, message: str) -> None:
+        self._redis.publish(channel, message)
+
+    def set_hash(self, key: str, values: dict, time=None) -> None:
+        """
+        Записывает поля хеша (HMSET), значения -- через codec. Все одним запросом.
+        """
+        pipe = self._pipeline(transaction=False)
+        pipe.hmset(key, {field: codec.dumps(val) for field, val in values.items()})
+        if time:
+            pipe.expire(key, time)
+        self._execute(pipe)
+
+    def get_hash_field(self, key: str, field: str, default=None):
+        cached = self._redis.hget(key, field)
+        if cached:
+            return self.__loads(key, cached, default)
+        return default
+
+    def scan_keys(self, pattern: str, count: int = 1000) -> Iterator[str]:
+        """
+        Ключи по паттерну через SCAN: по count за запрос, не блокируя редис, как KEYS.
+        """
+        for key in self._redis.scan_iter(match=pattern, count=count):
+            yield key.decode('utf-8')
+
+    def delete_by_pattern(self, pattern: str):
         """
         Удаляет ключи из кэша по паттерну. Пример паттерна: 'user:*'
 
         See: https://stackoverflow.com/a/27561399/136559
         """
         lua = "for i, name in ipairs(redis.call('KEYS', ARGV[1])) do redis.call('DEL', name); end"
-        _redis.eval(lua, 0, pattern)
+        self._redis.eval(lua, 0, pattern)
+
+    @staticmethod
+    def __loads(key, cached: bytes, default):
+        try:
+            return codec.loads(cached)
+        except Exception as e:
+            # например, сменилась схема объекта. считаем, что в кэше ничего нет
+            logger.warning(f"[cache] Can't decode {key}: {e}")
+            return default
 
 
-class PureCache:
+class PureCache(BaseCache):
     """
     Аналог Cache для хранения простых объектов. Добавляет префикс "__pure__:".
 
@@ -63,28 +195,64 @@ class PureCache:
     """
     prefix = '__pure__'
 
-    @staticmethod
-    def get(key: str, default: Optional[str] = None) -> Optional[str]:
+    @contextmanager
+    def watch(self, *keys: str) -> Iterator['PureCache']:
+        """
+        Оптимистичная транзакция: с входа в with редис следит за keys (WATCH). Команды записи
+        внутри with копятся и при выходе уходят одним MULTI/EXEC -- только если keys за это время
+        никто не изменил. Иначе redis.WatchError и ничего не записано: данные нужно перечитать
+        и повторить. Читать, как и в batch, нужно через pure_cache, а не через транзакцию.
+
+            with pure_cache.watch(key) as transaction:
+                value = load_from_db()
+                transaction.set(key, value)
+        """
+        pipe = self._redis.pipeline(transaction=True)
+        try:
+            pipe.watch(*[f'{self.prefix}:{key}' for key in keys])
+            pipe.multi()
+            yield PureCache(pipe, batched=True)
+            pipe.execute()
+        finally:
+            pipe.reset()
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
         """
         Всегда возвращает или None, или str. Даже если хранится число.
         """
-        cached = _pure_redis.get(f'__pure__:{key}')
+        cached = self._redis.get(f'{self.prefix}:{key}')
         if cached:
             return cached
         return default
 
-    @staticmethod
-    def set(key: str, val, time=None) -> None:
-        _pure_redis.set(f'__pure__:{key}', val, ex=time)
+    def get_many(self, keys: List[str], default: Optional[str] = None) -> List[Optional[str]]:
+        if not keys:
+            return []
+        return [cached if cached else default
+                for cached in self._redis.mget([f'{self.prefix}:{key}' for key in keys])]
 
-    @staticmethod
-    def incr(key: str, amount: int = 1) -> None:
-        _pure_redis.incr(f'__pure__:{key}', amount)
-        _pure_redis.expire(f'__pure__:{key}', USER_CACHE_EXPIRE)
+    def set(self, key: str, val, time=None) -> None:
+        self._redis.set(f'{self.prefix}:{key}', val, ex=time)
+
+    def set_many(self, values: dict, time=None) -> None:
+        pipe = self._pipeline(transaction=False)
+        for key, val in values.items():
+            pipe.set(f'{self.prefix}:{key}', val, ex=time)
+        self._execute(pipe)
 
-    @classmethod
-    def get_int(cls, key: str, default: Optional[int] = None) -> Optional[int]:
-        cached = cls.get(key)
+    def incr(self, key: str, amount: int = 1, time=USER_CACHE_EXPIRE) -> Optional[int]:
+        """
+        Атомарно увеличивает значение и продлевает ключ. Возвращает новое значение.
+        """
+        pipe = self._pipeline()
+        pipe.incr(f'{self.prefix}:{key}', amount)
+        if time:
+            pipe.expire(f'{self.prefix}:{key}', time)
+        results = self._execute(pipe)
+        return results[0] if results else None
+
+    def get_int(self, key: str, default: Optional[int] = None) -> Optional[int]:
+        cached = self.get(key)
         if cached:
             try:
                 return int(cached)
@@ -92,39 +260,178 @@ class PureCache:
                 pass
         return default
 
-    @classmethod
-    def append_list(cls, key: str, value: Union[str, list, tuple, Set], time=None) -> None:
+    def append_list(self, key: str, value: Union[str, list, tuple, Set], time=None) -> None:
+        pipe = self._pipeline()
         if isinstance(value, (list, tuple, set)):
-            _pure_redis.rpush(f'{cls.prefix}:{key}', *value)
+            pipe.rpush(f'{self.prefix}:{key}', *value)
         else:
-            _pure_redis.rpush(f'{cls.prefix}:{key}', value)
+            pipe.rpush(f'{self.prefix}:{key}', value)
         if time:
-            _pure_redis.expire(f'{cls.prefix}:{key}', time)
+            pipe.expire(f'{self.prefix}:{key}', time)
+        self._execute(pipe)
 
-    @classmethod
-    def add_to_list(cls, key: str, value, time=None) -> None:
-        cls.append_list(key, value, time)
+    def add_to_list(self, key: str, value, time=None) -> None:
+        self.append_list(key, value, time)
 
-    @classmethod
-    def add_to_set(cls, key: str, value: Union[str, list, tuple, Set], time=None) -> None:
+    def add_to_set(self, key: str, value: Union[str, list, tuple, Set], time=None) -> None:
+        pipe = self._pipeline()
         if isinstance(value, (list, tuple, set)):
-            _pure_redis.sadd(f'{cls.prefix}:{key}', *value)
+            pipe.sadd(f'{self.prefix}:{key}', *value)
         else:
-            _pure_redis.sadd(f'{cls.prefix}:{key}', value)
+            pipe.sadd(f'{self.prefix}:{key}', value)
         if time:
-            _pure_redis.expire(f'{cls.prefix}:{key}', time)
+            pipe.expire(f'{self.prefix}:{key}', time)
+        self._execute(pipe)
+
+    def get_set(self, key: str) -> Set[str]:
+        return set(self._redis.smembers(f'{self.prefix}:{key}'))
+
+    def get_list(self, key: str) -> List[str]:
+        return self._redis.lrange(f'{self.prefix}:{key}', 0, -1)
+
+    def delete(self, key: str) -> None:
+        self._redis.delete(f'{self.prefix}:{key}')
+
+    def move_set(self, src_key: str, dst_key: str) -> Set[str]:
+        """
+        Атомарно переносит элементы множества src_key в dst_key. Возвращает все элементы dst_key.
+        """
+        src = f'{self.prefix}:{src_key}'
+        dst = f'{self.prefix}:{dst_key}'
+        pipe = self._redis.pipeline()
+        pipe.sunionstore(dst, dst, src)
+        pipe.delete(src)
+        pipe.smembers(dst)
+        return set(pipe.execute()[-1])
+
+    def exists(self, key: str) -> bool:
+        return bool(self._redis.exists(f'{self.prefix}:{key}'))
+
+    def expire(self, key: str, time) -> None:
+        self._redis.expire(f'{self.prefix}:{key}', time)
+
+    def get_hash(self, key: str) -> Dict[str, str]:
+        return self._redis.hgetall(f'{self.prefix}:{key}')
+
+    def get_hashes(self, keys: List[str]) -> List[Dict[str, str]]:
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(f'{self.prefix}:{key}')
+        return pipe.execute()
+
+    def set_hash(self, key: str, values: dict, time=None) -> None:
+        pipe = self._pipeline()
+        pipe.hmset(f'{self.prefix}:{key}', values)
+        if time:
+            pipe.expire(f'{self.prefix}:{key}', time)
+        self._execute(pipe)
+
+    def delete_hash_fields(self, key: str, fields: List[str]) -> None:
+        self._redis.hdel(f'{self.prefix}:{key}', *fields)
+
+    def incr_hash(self, key: str, amounts: Dict[str, int], values: Optional[dict] = None,
+                  time=None) -> Dict[str, int]:
+        """
+        Увеличивает поля хеша через HINCRBY и перезаписывает поля из values. Все одним запросом.
+
+        Возвращает новые значения увеличенных полей.
+        """
+        full_key = f'{self.prefix}:{key}'
+        pipe = self._pipeline()
+        for field, amount in amounts.items():
+            pipe.hincrby(full_key, field, amount)
+        if values:
+            pipe.hmset(full_key, values)
+        if time:
+            pipe.expire(full_key, time)
+        results = self._execute(pipe)
+        return dict(zip(amounts.keys(), results)) if results else {}
+
+    def incr_sorted_set(self, key: str, amounts: Dict[str, int], time=None) -> None:
+        """
+        Увеличивает очки элементов сортированного множества (ZINCRBY). Все одним запросом.
+        """
+        full_key = f'{self.prefix}:{key}'
+        pipe = self._pipeline()
+        for member, amount in amounts.items():
+            pipe.zincrby(full_key, member, amount)
+        if time:
+            pipe.expire(full_key, time)
+        self._execute(pipe)
+
+    def set_sorted_set(self, key: str, scores: Dict[str, int], time=None) -> None:
+        """
+        Перезаписывает сортированное множество целиком.
+        """
+        full_key = f'{self.prefix}:{key}'
+        pipe = self._pipeline()
+        pipe.delete(full_key)
+        if scores:
+            # redis-py 2.x: zadd(name, score1, member1, score2, member2, ...)
+            pipe.zadd(full_key, *[item for member, score in scores.items()
+                                  for item in (score, member)])
+            if time:
+                pipe.expire(full_key, time)
+        self._execute(pipe)
+
+    def add_to_sorted_set(self, key: str, scores: Dict[str, int], time=None,
+                          min_score: Optional[int] = None) -> None:
+        """
+        Добавляет элементы в сортированное множество (ZADD). Если указан min_score,
+        заодно удаляет элементы с меньшими очками. Все одним запросом.
+        """
+        full_key = f'{self.prefix}:{key}'
+        pipe = self._pipeline()
+        pipe.zadd(full_key, *[item for member, score in scores.items() for item in (score, member)])
+        if min_score is not None:
+            pipe.zremrangebyscore(full_key, '-inf', f'({min_score}')
+        if time:
+            pipe.expire(full_key, time)
+        self._execute(pipe)
+
+    def get_sorted_set(self, key: str, start: int = 0, end: int = -1,
+                       desc: bool = True) -> List[Tuple[str, int]]:
+        """
+        Элементы с очками с позиции start по end включительно. По умолчанию -- от больших к меньшим.
+        """
+        return self._redis.zrange(f'{self.prefix}:{key}', start, end, desc=desc, withscores=True,
+                                  score_cast_func=int)
+
+    def get_sorted_sets(self, keys: List[str]) -> List[List[Tuple[str, int]]]:
+        """
+        Несколько сортированных множеств целиком (от больших к меньшим) одним запросом.
+        """
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.zrange(f'{self.prefix}:{key}', 0, -1, desc=True, withscores=True,
+                        score_cast_func=int)
+        return pipe.execute()
+
+    def get_sorted_set_rank(self, key: str, member: str) -> Optional[Tuple[int, int]]:
+        """
+        Место элемента (с нуля) по убыванию очков и его очки, одним запросом.
+        None, если элемента нет.
+        """
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.zrevrank(f'{self.prefix}:{key}', member)
+        pipe.zscore(f'{self.prefix}:{key}', member)
+        rank, score = pipe.execute()
+        return None if rank is None else (rank, int(score))
 
-    @classmethod
-    def get_set(cls, key: str) -> Set[str]:
-        return set(_pure_redis.smembers(f'{cls.prefix}:{key}'))
+    def get_sorted_set_size(self, key: str) -> int:
+        return self._redis.zcard(f'{self.prefix}:{key}')
 
-    @classmethod
-    def get_list(cls, key: str) -> List[str]:
-        return _pure_redis.lrange(f'{cls.prefix}:{key}', 0, -1)
+    def count_sorted_set(self, key: str, min_score, max_score) -> int:
+        return self._redis.zcount(f'{self.prefix}:{key}', min_score, max_score)
 
 
-cache = Cache()
-pure_cache = PureCache()
+cache = Cache(_redis)
+pure_cache = PureCache(_pure_redis)
+tiered_cache = TieredCache(
+    cache,
+    LocalCache(maxsize=CONFIG.get('performance', {}).get('local_cache_size', 10000),
+               ttl=CONFIG.get('performance', {}).get('local_cache_ttl', 30)),
+    _pure_redis)
 _bot_id = None
 
 def bot_id():
@@ -1,16 +1,106 @@
-import uuid
+import secrets
+import string
+from typing import Any, List, Optional, Sequence, Tuple
 
 import telegram
 
 from src.utils.cache import cache, USER_CACHE_EXPIRE
 
+KEY_PREFIX = 'callback'
+
+
+class CallbackRegistry:
+    """
+    Данные инлайн-кнопок в редисе.
+
+    Раньше данные каждой кнопки лежали в своем ключе callback:{uuid4}: клавиатура из 10 кнопок --
+    10 записей при каждой отрисовке, и за месяцы набирались миллионы ключей. Теперь данные всех
+    кнопок клавиатуры лежат в одном хеше callback:{id клавиатуры} и пишутся одним запросом.
+    В callback_data кнопки -- короткое "{id клавиатуры}_{номер кнопки}" (до 64 байт телеграма
+    далеко, и годится для ?start= ссылок).
+
+    Если клавиатура рисуется для уже отправленного сообщения (chat_id и message_id), то
+    предыдущая клавиатура этого сообщения не удаляется, а доживает stale_ttl (час): если
+    редактирование сообщения не удалось или параллельное редактирование оставило на экране
+    старые кнопки, они продолжают работать. Остальные клавиатуры живут ttl.
+
+    Старые callback:{uuid4} по-прежнему читаются, пока не протухнут.
+    """
+    id_alphabet = string.ascii_letters + string.digits
+    id_length = 10
+    separator = '_'
+
+    def __init__(self, ttl: int = USER_CACHE_EXPIRE, stale_ttl: int = 60 * 60) -> None:
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+    def register(self, data_list: Sequence[Any], chat_id: Optional[int] = None,
+                 message_id: Optional[int] = None) -> List[str]:
+        """
+        Сохраняет данные кнопок одной клавиатуры. Возвращает callback_data для каждой кнопки.
+        """
+        keyboard_id = ''.join(secrets.choice(self.id_alphabet) for _ in range(self.id_length))
+        message_key = None if message_id is None else self.__get_message_key(chat_id, message_id)
+        old_keyboard_id = cache.get(message_key) if message_key else None
+        with cache.batch() as batch:
+            if data_list:
+                batch.set_hash(self.__get_key(keyboard_id),
+                               {str(i): data for i, data in enumerate(data_list)}, time=self.ttl)
+            if message_key:
+                batch.set(message_key, keyboard_id, time=self.ttl)
+            if old_keyboard_id:
+                batch.expire(self.__get_key(old_keyboard_id), self.stale_ttl)
+        return [f'{keyboard_id}{self.separator}{i}' for i in range(len(data_list))]
+
+    def get(self, callback_data: str) -> Any:
+        keyboard_id, separator, index = callback_data.partition(self.separator)
+        if not separator:
+            return cache.get(self.__get_key(callback_data))
+        return cache.get_hash_field(self.__get_key(keyboard_id), index)
+
+    def forget(self, chat_id: int, message_id: int) -> None:
+        """
+        Удаляет клавиатуру сообщения, например, когда кнопки под ним убраны.
+        """
+        message_key = self.__get_message_key(chat_id, message_id)
+        keyboard_id = cache.get(message_key)
+        with cache.batch() as batch:
+            batch.delete(message_key)
+            if keyboard_id:
+                batch.delete(self.__get_key(keyboard_id))
+
+    @staticmethod
+    def __get_key(keyboard_id: str) -> str:
+        return f'{KEY_PREFIX}:{keyboard_id}'
+
+    @staticmethod
+    def __get_message_key(chat_id: int, message_id: int) -> str:
+        return f'{KEY_PREFIX}:message:{chat_id}:{message_id}'
+
+
+callback_registry = CallbackRegistry()
+
 
 def get_callback_data(data) -> str:
-    key = str(uuid.uuid4())
-    cache.set(f'callback:{key}', data, time=USER_CACHE_EXPIRE)
-    return key
+    return callback_registry.register([data])[0]
+
+
+def get_inline_keyboard(buttons: Sequence[Sequence[Tuple[str, Any]]],
+                        chat_id: Optional[int] = None,
+                        message_id: Optional[int] = None) -> telegram.InlineKeyboardMarkup:
+    """
+    Инлайн-клавиатура из строк кнопок (текст, данные). Данные всех кнопок пишутся одним запросом.
+    chat_id и message_id -- если клавиатура заменяет кнопки уже отправленного сообщения.
+    """
+    callbacks = iter(callback_registry.register([data for line in buttons for _, data in line],
+                                                chat_id, message_id))
+    return telegram.InlineKeyboardMarkup([
+        [telegram.InlineKeyboardButton(title, callback_data=next(callbacks)) for title, _ in line]
+        for line in buttons
+    ])
 
 
 def remove_inline_keyboard(bot: telegram.Bot, chat_id: int, message_id: int) -> None:
     reply_markup = telegram.InlineKeyboardMarkup([])
     bot.editMessageReplyMarkup(chat_id, message_id, reply_markup=reply_markup)
+    callback_registry.forget(chat_id, message_id)
@@ -0,0 +1,94 @@
+import copyreg
+import pickle
+import zlib
+from typing import Any, Callable, Dict, Type
+
+from src.config import CONFIG
+
+# первый байт значения в новом формате. pickle (протокол 2+) всегда начинается с b'\x80',
+# поэтому старые значения отличаются от новых по первому байту
+MAGIC = 0xfe
+FLAG_ZLIB = 0x01
+
+COMPRESS_MIN_SIZE = 16 * 1024  # сжимаем только большие значения
+COMPRESS_LEVEL = 1  # быстрее всего, а сжимает почти так же
+
+# код для copyreg.add_extension (240-255 -- для частного использования). с ним ссылка на
+# _load_object занимает в pickle 2 байта вместо полного имени модуля и функции
+LOAD_OBJECT_EXTENSION_CODE = 240
+
+
+class CodecError(Exception):
+    pass
+
+
+class CacheCodec:
+    """
+    Сериализация значений для Cache.
+
+    Внутри по-прежнему pickle (на CPython он быстрее msgpack и прочих), но:
+
+    * у значения есть заголовок. Старые значения (обычный pickle без заголовка) читаются как
+      раньше и перезапишутся в новом формате при следующем set;
+    * большие значения сжимаются zlib;
+    * горячие классы пишутся не как объект, а через явную схему: версия + список полей.
+      Так короче, и переименование класса или его полей ничего не ломает.
+
+    Классы регистрируются с версией в имени:
+
+        codec.register(User, 'user:1',
+                       lambda user: [user.uid, user.username],
+                       lambda state: User(uid=state[0], username=state[1]))
+
+    Если схема поменялась, то меняем версию в имени. Значения со старой версией (или
+    неизвестным типом) не читаются: Cache.get вернет default, и объект загрузится заново.
+    """
+
+    def __init__(self, compress_min_size: int = COMPRESS_MIN_SIZE) -> None:
+        self.compress_min_size = compress_min_size
+
+    @staticmethod
+    def register(cls: Type, name: str, encode: Callable[[Any], Any],
+                 decode: Callable[[Any], Any]) -> None:
+        _decoders[name] = decode
+        copyreg.pickle(cls, lambda obj: (_load_object, (name, tuple(encode(obj)))))
+
+    def dumps(self, value: Any) -> bytes:
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        flags = 0
+        if len(payload) >= self.compress_min_size:
+            compressed = zlib.compress(payload, COMPRESS_LEVEL)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= FLAG_ZLIB
+        return bytes((MAGIC, flags)) + payload
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        if data[0] != MAGIC:
+            # старое значение, записанное до появления кодека
+            return pickle.loads(data)
+        flags = data[1]
+        payload = data[2:]
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return pickle.loads(payload)
+
+
+_decoders: Dict[str, Callable[[Any], Any]] = {}
+
+
+def _load_object(name: str, state: Any) -> Any:
+    """
+    Вызывается из pickle.loads для зарегистрированных классов.
+    Имя функции хранится в кэше -- не переименовывать.
+    """
+    if name not in _decoders:
+        raise CodecError(f'Unknown type: {name}')
+    return _decoders[name](state)
+
+
+copyreg.add_extension(__name__, _load_object.__name__, LOAD_OBJECT_EXTENSION_CODE)
+
+
+codec = CacheCodec(CONFIG.get('performance', {}).get('cache_compress_min_size', COMPRESS_MIN_SIZE))
@@ -0,0 +1,89 @@
+from typing import Dict, FrozenSet, Iterable, NamedTuple, Optional, Union
+
+import src.config as config
+from src.utils.misc import get_int
+
+
+class ChatPermissions(NamedTuple):
+    enabled_commands: FrozenSet[str]
+    disabled_commands: FrozenSet[str]
+    all_cmd: bool
+
+
+class CommandIndex:
+    """
+    Все, что нужно для проверок команд, собранное один раз из CONFIG и CMDS:
+
+    * настройки чатов. Лежат и по int, и по str айди чата, чтобы не делать str(chat_id)
+      на каждый вызов;
+    * синоним команды -> команда;
+    * множества допустимых и текстовых команд.
+
+    Используется через CommandIndex.get(). После изменения CONFIG или CMDS нужно вызвать
+    CommandIndex.rebuild(): новый индекс собирается целиком и подменяет старый одним присваиванием,
+    поэтому другие потоки видят либо старый, либо новый индекс, но не половину.
+    """
+    _current: Optional['CommandIndex'] = None
+
+    def __init__(self, chats_config: dict, cmds: dict, valid_cmds: Iterable[str]) -> None:
+        self.chats: Dict[Union[int, str], ChatPermissions] = {}
+        for chat_id_str, chat_options in chats_config.items():
+            permissions = ChatPermissions(frozenset(chat_options.get('enabled_commands', [])),
+                                          frozenset(chat_options.get('disabled_commands', [])),
+                                          bool(chat_options.get('all_cmd', False)))
+            self.chats[chat_id_str] = permissions
+            chat_id = get_int(chat_id_str)
+            if chat_id is not None:
+                self.chats[chat_id] = permissions
+
+        self.synonyms: Dict[str, str] = {}
+        for cmd, values in cmds.get('synonyms', {}).items():
+            for value in values:
+                # раньше синонимы перебирались по порядку, и побеждала первая команда
+                self.synonyms.setdefault(value, cmd)
+
+        self.text_cmds: FrozenSet[str] = frozenset(cmds.get('text_cmds', []))
+        self.text_cmds_max_len = max((len(cmd) for cmd in self.text_cmds), default=0)
+        self.valid_cmds: FrozenSet[str] = frozenset(valid_cmds)
+
+    @classmethod
+    def get(cls) -> 'CommandIndex':
+        index = cls._current
+        if index is None:
+            index = cls.rebuild()
+        return index
+
+    @classmethod
+    def rebuild(cls) -> 'CommandIndex':
+        index = cls(config.CONFIG.get('chats', {}), config.CMDS, config.VALID_CMDS)
+        cls._current = index
+        config.get_config_chats.cache_clear()
+        return index
+
+    def is_command_enabled(self, chat_id: Union[int, str], cmd_name: str,
+                           default: Optional[bool] = None) -> bool:
+        permissions = self.chats.get(chat_id)
+        if permissions is None:
+            return False
+        if cmd_name in permissions.enabled_commands:
+            return True
+        if cmd_name in permissions.disabled_commands:
+            return False
+        if default:
+            return default
+        return permissions.all_cmd
+
+    def get_command_name(self, text: Optional[str]) -> Optional[str]:
+        if text is None:
+            return None
+        if text.startswith('/'):
+            lower_cmd = text[1:].partition(' ')[0].partition('@')[0].lower()
+            return self.synonyms.get(lower_cmd, lower_cmd)
+        # lower() не делает строку короче, поэтому длинные сообщения можно не приводить
+        # к нижнему регистру
+        if len(text) > self.text_cmds_max_len:
+            return None
+        lower = text.lower()
+        if lower in self.text_cmds:
+            return lower
+        return None
@@ -1,20 +1,122 @@
+import re
+import time
 from contextlib import contextmanager
+from functools import lru_cache
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc, select
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
 from src.config import CONFIG
 from src.utils.logger_helpers import get_logger
+from src.utils.metrics import Histogram, metrics
 from src.utils.misc import retry
 
 logger = get_logger(__name__)
 Base = declarative_base()
 
+re_query_table = re.compile(
+    r'^\s*(?:SELECT\b.*?\bFROM|INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)'
+    r'\s+[`"]?(\w+)', re.IGNORECASE | re.DOTALL)
+
+# секунды
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool, который замеряет, сколько поток ждал соединение (включая создание нового).
+
+    Метрики общие для класса, поэтому переживают пересоздание пула после обрыва соединений.
+    """
+    wait_time = Histogram(POOL_WAIT_BUCKETS)
+    timeouts = 0
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            TimedQueuePool.timeouts += 1
+            raise
+        finally:
+            self.wait_time.observe(time.monotonic() - start)
+
+
+def ping_connection(connection, branch) -> None:
+    """
+    Проверяет соединение перед использованием (в sqlalchemy 1.1 еще нет pool_pre_ping).
+    Если мускуль закрыл соединение, то пул выкинет все старые соединения, а запрос уйдет по новому.
+
+    See: https://docs.sqlalchemy.org/en/rel_1_1/core/pooling.html#disconnect-handling-pessimistic
+    """
+    if branch:
+        return
+    save_should_close_with_result = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as err:
+        if not err.connection_invalidated:
+            raise
+        connection.scalar(select([1]))
+    finally:
+        connection.should_close_with_result = save_should_close_with_result
+
+
+@lru_cache(maxsize=1024)
+def get_query_shape(statement: str) -> str:
+    """
+    Вид запроса для метрик: команда и первая таблица ("SELECT users", "INSERT userstat").
+    Параметры в statement -- плейсхолдеры, поэтому разных statement немного и они кешируются.
+    """
+    words = statement.split(None, 1)
+    if not words:
+        return 'EMPTY'
+    command = words[0].upper()
+    match = re_query_table.match(statement)
+    return f'{command} {match.group(1).lower()}' if match else command
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    start = conn.info['query_start'].pop()
+    metrics.observe('sql', get_query_shape(statement), time.perf_counter() - start)
+
+
+def handle_error(exception_context) -> None:
+    # при ошибке after_cursor_execute не вызывается
+    conn = exception_context.connection
+    starts = conn.info.get('query_start') if conn is not None else None
+    if starts:
+        metrics.observe('sql', get_query_shape(exception_context.statement or ''),
+                        time.perf_counter() - starts.pop(), error=True)
+
+
+def get_pool_status() -> str:
+    """
+    Строка для лога: сколько соединений занято и сколько потоки ждут соединение.
+    """
+    if engine is None:
+        return 'no database'
+    pool = engine.pool
+    wait_time = TimedQueuePool.wait_time
+    return (f'size={pool.size()} checked_out={pool.checkedout()} overflow={pool.overflow()} '
+            f'checked_in={pool.checkedin()} waits={wait_time.count} '
+            f'wait_p50<={wait_time.percentile(0.5) * 1000:.0f}ms '
+            f'wait_p99<={wait_time.percentile(0.99) * 1000:.0f}ms '
+            f'wait_max={wait_time.max * 1000:.0f}ms timeouts={TimedQueuePool.timeouts}')
+
 
 @contextmanager
 def session_scope():
     """Provide a transactional scope around a series of operations."""
+    start = time.perf_counter()
+    error = False
     session = Session()
     # session.begin(True)
     try:
@@ -23,6 +125,7 @@ def session_scope():
         session.commit()
         # session.expire_all()
     except Exception as e:
+        error = True
         session.expunge_all()
         session.rollback()
         # session.expire_all()
@@ -30,6 +133,7 @@ def session_scope():
     finally:
         # Session.remove()
         session.close()
+        metrics.observe('session', 'session_scope', time.perf_counter() - start, error)
 
 
 @retry(logger=logger)
@@ -43,8 +147,20 @@ def add_to_db(value):
         raise Exception("Can't add value to DB")
 
 
+engine = None
 if 'database' in CONFIG:
-    engine = create_engine(CONFIG['database'], convert_unicode=True, echo=False)
+    performance_config = CONFIG.get('performance', {})
+    engine = create_engine(CONFIG['database'], convert_unicode=True, echo=False,
+                           poolclass=TimedQueuePool,
+                           pool_size=performance_config.get('db_pool_size', 10),
+                           max_overflow=performance_config.get('db_max_overflow', 30),
+                           pool_timeout=performance_config.get('db_pool_timeout', 10),
+                           pool_recycle=performance_config.get('db_pool_recycle', 3600))
+    if performance_config.get('db_pool_pre_ping', True):
+        event.listen(engine, 'engine_connect', ping_connection)
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
     Base.metadata.create_all(engine)
 
     session_factory = sessionmaker(bind=engine)
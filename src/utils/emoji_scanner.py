@@ -0,0 +1,106 @@
+import re
+from typing import Dict, Iterable, List, Optional, Pattern
+
+import emoji_fixed as emoji
+
+VARIATION_SELECTOR = '️'
+ZWJ = '‍'
+# ключ в узле дерева, которым помечен конец эмодзи
+_END = ''
+
+
+class EmojiScanner:
+    """
+    Ищет эмодзи в тексте за один проход по дереву из всех эмодзи таблицы.
+
+    Эмодзи из нескольких символов (флаги, цвет кожи, семьи через ZWJ) считаются за один:
+    берется самое длинное совпадение. Кроме того:
+
+    * необязательный VS16 (U+FE0F) после эмодзи считается его частью;
+    * эмодзи, склеенные через ZWJ (U+200D), считаются одним, даже если такой склейки нет в таблице.
+
+    Места, с которых может начинаться эмодзи, ищутся регуляркой, поэтому обычный текст
+    пролетает почти бесплатно.
+
+        emoji_scanner.count('👍🏽 🇷🇺 👨‍👩‍👧')  # 3
+    """
+
+    def __init__(self, emojis: Iterable[str]) -> None:
+        self.trie: Dict[str, dict] = {}
+        for sequence in emojis:
+            node = self.trie
+            for char in sequence:
+                node = node.setdefault(char, {})
+            node[_END] = True
+        self.candidates: Pattern = self.__compile_candidates(self.trie)
+
+    def findall(self, text: str) -> List[str]:
+        found = []
+        length = len(text)
+        candidate = self.candidates.search(text)
+        while candidate is not None:
+            i = candidate.start()
+            end = self.__match(text, i)
+            if end is None:
+                candidate = self.candidates.search(text, i + 1)
+                continue
+            # склейки через ZWJ
+            while end < length - 1 and text[end] == ZWJ:
+                next_end = self.__match(text, end + 1)
+                if next_end is None:
+                    break
+                end = next_end
+            found.append(text[i:end])
+            candidate = self.candidates.search(text, end)
+        return found
+
+    def count(self, text: str) -> int:
+        return len(self.findall(text))
+
+    @staticmethod
+    def __compile_candidates(trie: Dict[str, dict], gap: int = 256) -> Pattern:
+        """
+        Регулярка для мест, с которых может начинаться эмодзи.
+
+        Из тысячи отдельных символов re строит медленный линейный поиск, поэтому близкие символы
+        склеиваются в несколько диапазонов (лишнее отсеет дерево). ASCII (цифры, # и * у эмодзи
+        клавиш) берется, только если за ним идет второй символ эмодзи, иначе каждая цифра в тексте
+        была бы кандидатом.
+        """
+        ranges: List[List[int]] = []
+        ascii_chars = []
+        for char in sorted(trie):
+            code = ord(char)
+            if code < 128:
+                ascii_chars.append(char)
+            elif ranges and code - ranges[-1][1] <= gap:
+                ranges[-1][1] = code
+            else:
+                ranges.append([code, code])
+        pattern = '[{}]'.format(''.join(f'{re.escape(chr(a))}-{re.escape(chr(b))}'
+                                        for a, b in ranges))
+        if ascii_chars:
+            next_chars = {char for first in ascii_chars for char in trie[first] if char != _END}
+            pattern += '|[{}](?=[{}])'.format(
+                ''.join(re.escape(char) for char in ascii_chars),
+                ''.join(re.escape(char) for char in sorted(next_chars)))
+        return re.compile(pattern)
+
+    def __match(self, text: str, start: int) -> Optional[int]:
+        """
+        Конец самого длинного эмодзи (вместе с VS16), начинающегося в start, или None.
+        """
+        node = self.trie
+        end = None
+        for i in range(start, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            if _END in node:
+                end = i + 1
+        if end is not None and end < len(text) and text[end] == VARIATION_SELECTOR:
+            end += 1
+        return end
+
+
+emoji_scanner = EmojiScanner(emoji.UNICODE_EMOJI)
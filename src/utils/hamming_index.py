@@ -0,0 +1,87 @@
+from itertools import combinations
+from typing import Dict, Iterator, List, Tuple
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def split_bands(value: int, bands: int, band_bits: int) -> List[int]:
+    """
+    Делит число на bands кусков по band_bits бит, начиная со старших.
+    """
+    mask = (1 << band_bits) - 1
+    return [(value >> (band_bits * (bands - 1 - i))) & mask for i in range(bands)]
+
+
+def iter_neighbours(value: int, bits: int, radius: int) -> Iterator[int]:
+    """
+    Все числа из bits бит, отличающиеся от value не больше чем в radius битах (и само value).
+    """
+    for distance in range(radius + 1):
+        for positions in combinations(range(bits), distance):
+            neighbour = value
+            for position in positions:
+                neighbour ^= 1 << position
+            yield neighbour
+
+
+class HammingIndex:
+    """
+    Поиск похожих 64-битных хешей (перцептивных хешей картинок) по расстоянию Хэмминга в редисе.
+
+    Multi-index hashing: хеш делится на 4 куска по 16 бит, и для каждого куска в отдельном
+    сортированном множестве лежат все хеши с таким куском. Если хеши отличаются не больше чем
+    в k битах, то хотя бы один кусок у них отличается не больше чем в k // 4 битах. Поэтому
+    для поиска достаточно прочитать множества кусков искомого хеша и их соседей (для k < 4 --
+    только 4 множества, для k < 8 -- 68), одним запросом, и проверить найденное.
+
+    Очки в множествах -- время добавления: хеши старше ttl удаляются при следующем добавлении
+    в то же множество.
+
+        index = HammingIndex(pure_cache, 'bayanometer:phash_index', ttl=YEAR)
+        index.add(chat_id, 'c3a1f0e0d8b8f0f0', int(time.time()))
+        index.find(chat_id, 'c3a1f0e0d8b8f0f1', max_distance=4)  # [('c3a1f0e0d8b8f0f1', 0), ...]
+    """
+    bits = 64
+    bands = 4
+
+    def __init__(self, cache, prefix: str, ttl: int) -> None:
+        """
+        :param cache: PureCache
+        """
+        self.cache = cache
+        self.prefix = prefix
+        self.ttl = ttl
+        self.band_bits = self.bits // self.bands
+
+    def add(self, group, value: str, timestamp: int) -> None:
+        """
+        :param group: пространство поиска, например айди чата
+        :param value: хеш в hex
+        """
+        with self.cache.batch() as batch:
+            for i, band in enumerate(split_bands(int(value, 16), self.bands, self.band_bits)):
+                batch.add_to_sorted_set(self.__get_key(group, i, band), {value: timestamp},
+                                        time=self.ttl, min_score=timestamp - self.ttl)
+
+    def find(self, group, value: str, max_distance: int) -> List[Tuple[str, int]]:
+        """
+        Хеши группы на расстоянии не больше max_distance и расстояния до них,
+        от ближайших к дальним.
+        """
+        number = int(value, 16)
+        radius = max_distance // self.bands
+        keys = [self.__get_key(group, i, neighbour)
+                for i, band in enumerate(split_bands(number, self.bands, self.band_bits))
+                for neighbour in iter_neighbours(band, self.band_bits, radius)]
+        distances: Dict[str, int] = {}
+        for members in self.cache.get_sorted_sets(keys):
+            for member, _ in members:
+                if member not in distances:
+                    distances[member] = hamming_distance(number, int(member, 16))
+        return sorted(((member, distance) for member, distance in distances.items()
+                       if distance <= max_distance), key=lambda item: (item[1], item[0]))
+
+    def __get_key(self, group, band_index: int, band: int) -> str:
+        return f'{self.prefix}:{group}:{band_index}:{band:0{self.band_bits // 4}x}'
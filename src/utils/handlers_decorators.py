@@ -8,8 +8,10 @@ from src.models.reply_top import ReplyTop
 from src.models.user import User
 from src.models.user_stat import UserStat
 from src.commands.i_stat.add_message_handler import IStatAddMessage
-from src.utils.handlers_helpers import check_command_is_off, get_command_name, \
-    send_chat_access_denied, is_command_enabled_for_chat, check_user_is_plohish
+from src.utils.handlers_helpers import get_command_name, send_chat_access_denied, \
+    is_command_enabled_for_chat, check_command_is_off_or_plohish
+from src.utils.message_analysis import MessageAnalysis
+from src.utils.metrics import metrics
 
 
 def only_users_from_main_chat(func):
@@ -55,9 +57,7 @@ def command_guard(func):
         cmd_name = get_command_name(update.message.text)
         if not is_command_enabled_for_chat(chat_id, cmd_name):
             return
-        if check_user_is_plohish(update):
-            return
-        if check_command_is_off(chat_id, cmd_name):
+        if check_command_is_off_or_plohish(update, cmd_name):
             return
         return func(bot, update)
 
@@ -73,13 +73,14 @@ def collect_stats(func):
     def decorator(bot: telegram.Bot, update: telegram.Update):
         if update.message.from_user.is_bot:
             return
-        User.add_user(update.message.from_user)
-        UserStat.add(UserStat.parse_message_stat(update.message.from_user.id,
-                                                 update.message.chat_id,
-                                                 update.message,
-                                                 update.message.parse_entities()))
-        ReplyTop.parse_message(update.message)
-        IStatAddMessage.add_message(update.message)
+        with metrics.timed('function', 'collect_stats'):
+            User.add_user(update.message.from_user)
+            UserStat.add(UserStat.parse_message_stat(update.message.from_user.id,
+                                                     update.message.chat_id,
+                                                     update.message,
+                                                     MessageAnalysis.get(update.message)))
+            ReplyTop.parse_message(update.message)
+            IStatAddMessage.add_message(update.message)
         return func(bot, update)
 
     return decorator
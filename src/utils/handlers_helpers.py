@@ -1,9 +1,10 @@
 import random
 from typing import Union, Optional
 
-from src.config import CMDS, VALID_CMDS, CONFIG
+from src.config import CONFIG
 from src.commands.khaleesi.khaleesi import Khaleesi
-from src.utils.cache import cache, MONTH
+from src.utils.cache import cache, tiered_cache, MONTH
+from src.utils.command_index import CommandIndex
 from src.utils.logger_helpers import get_logger
 from src.utils.telegram_helpers import get_chat_admins
 
@@ -14,20 +15,12 @@ def is_command_enabled_for_chat(chat_id: Union[int, str], cmd_name: Optional[str
                                 default: Optional[bool] = None) -> bool:
     """
     Проверяет, включена ли команда в чате. Включая чаты с all_cmd=True.
+
+    Настройки чатов берутся из CommandIndex, а не из CONFIG напрямую.
     """
     if cmd_name is None:
         return True  # TODO: разобраться почему тут True
-    chat_id_str = str(chat_id)
-    if chat_id_str not in CONFIG['chats']:
-        return False
-    chat_options = CONFIG['chats'][chat_id_str]
-    if cmd_name in chat_options.get('enabled_commands', []):
-        return True
-    if cmd_name in chat_options.get('disabled_commands', []):
-        return False
-    if default:
-        return default
-    return chat_options.get('all_cmd', False)
+    return CommandIndex.get().is_command_enabled(chat_id, cmd_name, default)
 
 
 class CommandConfig:
@@ -46,7 +39,7 @@ class CommandConfig:
 
 def is_valid_command(text):
     cmd = get_command_name(text)
-    if cmd in VALID_CMDS:
+    if cmd in CommandIndex.get().valid_cmds:
         return cmd
     return None
 
@@ -67,35 +60,35 @@ def check_admin(bot, chat_id, user_id):
 
 
 def get_command_name(text):
-    if text is None:
-        return None
-    lower = text.lower()
-    if lower.startswith('/'):
-        lower_cmd = lower[1:].split(' ')[0].split('@')[0]
-        for cmd, values in CMDS['synonyms'].items():
-            if lower_cmd in values:
-                return cmd
-        return lower_cmd
-    else:
-        if lower in CMDS['text_cmds']:
-            return lower
-    return None
+    return CommandIndex.get().get_command_name(text)
 
 
 def check_command_is_off(chat_id, cmd_name):
     """
     Проверяет, отключена ли эта команда в чате.
     """
-    all_disabled = cache.get(f'all_cmd_disabled:{chat_id}')
+    all_disabled, disabled = tiered_cache.get_many([f'all_cmd_disabled:{chat_id}',
+                                                    f'cmd_disabled:{chat_id}:{cmd_name}'])
     if all_disabled:
         return True
-
-    disabled = cache.get(f'cmd_disabled:{chat_id}:{cmd_name}')
     if disabled:
         return disabled
     return False
 
 
+def check_command_is_off_or_plohish(update, cmd_name) -> bool:
+    """
+    То же, что check_user_is_plohish и check_command_is_off вместе, но одним запросом в редис
+    (и то, только если флагов нет в tiered_cache).
+    """
+    chat_id = update.message.chat_id
+    user_id = update.message.from_user.id
+    flags = tiered_cache.get_many([f'plohish_cmd:{chat_id}:{user_id}:{cmd_name}',
+                                   f'all_cmd_disabled:{chat_id}',
+                                   f'cmd_disabled:{chat_id}:{cmd_name}'])
+    return any(flags)
+
+
 def send_chat_access_denied(bot, update) -> None:
     chat_id = update.message.chat_id
 
@@ -111,11 +104,8 @@ def send_chat_access_denied(bot, update) -> None:
         if random.randint(1, 100) > 5:
             return
         khaleesed = Khaleesi.khaleesi(text, last_sentense=True)
-        try:
-            bot.send_message(chat_id, '{} 🐉'.format(khaleesed),
-                             reply_to_message_id=update.message.message_id)
-        except Exception:
-            pass
+        bot.send_message(chat_id, '{} 🐉'.format(khaleesed),
+                         reply_to_message_id=update.message.message_id)
         return
 
     # новый неопознанный чат. пишем приветствие. плюс в логи инфу о чате
@@ -144,7 +134,7 @@ def check_user_is_plohish(update):
     chat_id = update.message.chat_id
     user_id = update.message.from_user.id
     cmd_name = get_command_name(update.message.text)
-    disabled = cache.get(f'plohish_cmd:{chat_id}:{user_id}:{cmd_name}')
+    disabled = tiered_cache.get(f'plohish_cmd:{chat_id}:{user_id}:{cmd_name}')
     if disabled:
         return True
     return False
@@ -0,0 +1,190 @@
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Hashable, List, Optional
+
+from src.utils.logger_helpers import get_logger
+
+logger = get_logger(__name__)
+
+# отличает "нет в кэше" от сохраненного None
+MISSING = object()
+
+
+class LocalCache:
+    """
+    LRU-кэш с TTL в памяти процесса. Потокобезопасный.
+
+    Ограничен по количеству ключей: при переполнении выкидывается ключ, к которому дольше всех
+    не обращались. Протухшие ключи удаляются при обращении к ним (или вытесняются как обычно).
+
+        local = LocalCache(maxsize=1000, ttl=30)
+        local.set('key', value)
+        local.get('key')  # value или MISSING
+
+    Сам по себе ничего не знает о редисе -- см. TieredCache.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None,
+            generation: Optional[int] = None) -> None:
+        """
+        Если передан generation (см. get_generation), то значение сохраняется, только если с тех пор
+        не было инвалидаций. Так в кэш не попадет значение, прочитанное до чужой записи.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_generation(self) -> int:
+        return self._generation
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+        }
+
+
+class TieredCache:
+    """
+    Двухуровневый кэш: LocalCache в памяти процесса перед Cache (редисом).
+
+    Для ключей, которые читаются намного чаще, чем пишутся: юзеры, чатюзеры, выключенные команды.
+    Сохраняется и отсутствие значения (None), чтобы не ходить в редис за тем, чего там нет.
+
+    Записывать такие ключи нужно только через этот класс. Тогда остальные процессы бота узнают
+    об изменении через pub/sub редиса и выкинут ключ из своего LocalCache (см. listen).
+    Если ключ протух в редисе, то в LocalCache он может прожить еще до ttl секунд.
+    """
+    channel = 'tiered_cache:invalidate'
+
+    def __init__(self, cache, local: LocalCache, client=None) -> None:
+        self.cache = cache
+        self.local = local
+        self._redis = client
+        self._origin = uuid.uuid4().hex  # чтобы не обрабатывать свои же сообщения
+        self._pubsub_thread = None
+
+    def get(self, key: str, default=None):
+        value = self.local.get(key)
+        if value is MISSING:
+            generation = self.local.get_generation()
+            value = self.cache.get(key)
+            self.local.set(key, value, generation=generation)
+        return default if value is None else value
+
+    def get_many(self, keys: List[str], default=None) -> list:
+        values = [self.local.get(key) for key in keys]
+        missed = [key for key, value in zip(keys, values) if value is MISSING]
+        if missed:
+            generation = self.local.get_generation()
+            loaded = dict(zip(missed, self.cache.get_many(missed)))
+            for key, value in loaded.items():
+                self.local.set(key, value, generation=generation)
+            values = [loaded[key] if value is MISSING else value
+                      for key, value in zip(keys, values)]
+        return [default if value is None else value for value in values]
+
+    def set(self, key: str, val, time=None) -> None:
+        # запись и инвалидация в других процессах -- одним запросом
+        with self.cache.batch() as batch:
+            batch.set(key, val, time=time)
+            self.__publish(batch, key)
+        self.local.invalidate(key)
+        self.local.set(key, val, ttl=time)
+
+    def refresh(self, key: str, val, time) -> None:
+        """
+        Для значения, которое не изменилось: только продлевает ключ в редисе (EXPIRE), без
+        инвалидации, поэтому другие процессы не выкидывают его из своего LocalCache.
+        Если ключа в редисе уже нет, то записывает val, как set.
+        """
+        if not self.cache.expire(key, time):
+            self.set(key, val, time=time)
+
+    def delete(self, key: str) -> None:
+        with self.cache.batch() as batch:
+            batch.delete(key)
+            self.__publish(batch, key)
+        self.local.invalidate(key)
+
+    def delete_by_pattern(self, pattern: str) -> None:
+        self.cache.delete_by_pattern(pattern)
+        self.local.clear()
+        self.__publish(self.cache, '*')
+
+    def listen(self) -> None:
+        """
+        Запускает поток, который слушает инвалидации от других процессов.
+        """
+        if self._redis is None or self._pubsub_thread is not None:
+            return
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: self.__on_message})
+        self._pubsub_thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def stats(self) -> Dict[str, int]:
+        return self.local.stats()
+
+    def __publish(self, cache, key: str) -> None:
+        if self._redis is None:
+            return
+        cache.publish(self.channel, f'{self._origin}:{key}')
+
+    def __on_message(self, message: dict) -> None:
+        origin, key = message['data'].split(':', 1)
+        if origin == self._origin:
+            return
+        if key == '*':
+            self.local.clear()
+            return
+        self.local.invalidate(key)
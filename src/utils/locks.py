@@ -0,0 +1,24 @@
+from threading import Lock
+from typing import Hashable, List
+
+
+class StripedLock:
+    """
+    Набор локов, между которыми раскидываются ключи.
+
+    Вместо одного глобального лока на весь класс берем лок по ключу (например, по паре chat_id,
+    user_id).
+    Сообщения одного юзера в одном чате все так же обрабатываются последовательно,
+    а разные чаты и юзеры почти никогда не ждут друг друга.
+
+        add_lock = StripedLock()
+        with add_lock.get(cid, uid):
+            ...
+    """
+
+    def __init__(self, stripes: int = 64) -> None:
+        self.stripes = stripes
+        self._locks: List[Lock] = [Lock() for _ in range(stripes)]
+
+    def get(self, *key: Hashable) -> Lock:
+        return self._locks[hash(key) % self.stripes]
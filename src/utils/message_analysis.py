@@ -0,0 +1,130 @@
+import re
+import weakref
+from threading import Lock
+from typing import Dict, List, Optional
+
+import telegram
+
+from src.modules.antimat.antimat import Antimat
+
+re_personal_pronouns = re.compile(r"\b(я|меня|мне|мной|мною)\b", re.IGNORECASE)
+
+
+class MessageAnalysis:
+    """
+    Общий разбор сообщения для всех, кто его обрабатывает.
+
+    Одно сообщение в чате проходит через стату, реплай-топ, я-стату, пидора и игоря недели,
+    антимат, баянометр и т.д. Раньше каждый из них сам вызывал parse_entities, делал lower
+    и гонял регулярки. Теперь все это считается один раз при первом обращении:
+
+        analysis = MessageAnalysis.get(message)
+        for url in analysis.urls:
+            ...
+
+    Разбор живет столько же, сколько сам объект сообщения.
+    """
+    __registry: Dict[int, 'MessageAnalysis'] = {}
+    __registry_lock = Lock()
+
+    def __init__(self, message: telegram.Message) -> None:
+        # слабая ссылка, чтобы реестр не держал сообщение в памяти
+        self.__message = weakref.ref(message)
+        self.text: Optional[str] = message.text
+        self.text_or_caption: Optional[str] = message.text if message.text else message.caption
+        self.__entities: Optional[Dict[telegram.MessageEntity, str]] = None
+        self.__lower: Optional[str] = None
+        self.__words: Optional[List[str]] = None
+        self.__obscene_words: Optional[List[str]] = None
+        self.__pronouns: Optional[List[str]] = None
+
+    @classmethod
+    def get(cls, message: telegram.Message) -> 'MessageAnalysis':
+        key = id(message)
+        with cls.__registry_lock:
+            analysis = cls.__registry.get(key, None)
+            if analysis is None:
+                analysis = MessageAnalysis(message)
+                cls.__registry[key] = analysis
+                weakref.finalize(message, cls.__forget, key)
+            return analysis
+
+    @classmethod
+    def __forget(cls, key: int) -> None:
+        with cls.__registry_lock:
+            cls.__registry.pop(key, None)
+
+    @property
+    def entities(self) -> Dict[telegram.MessageEntity, str]:
+        """
+        Результат message.parse_entities()
+        """
+        if self.__entities is None:
+            message = self.__message()
+            self.__entities = message.parse_entities() if message is not None else {}
+        return self.__entities
+
+    @property
+    def lower(self) -> str:
+        """
+        Текст (или подпись) в нижнем регистре. Пустая строка, если текста нет.
+        """
+        if self.__lower is None:
+            self.__lower = self.text_or_caption.lower() if self.text_or_caption else ''
+        return self.__lower
+
+    @property
+    def lower_ye(self) -> str:
+        """
+        То же, что lower, только ё заменена на е
+        """
+        return self.lower.replace('ё', 'е')
+
+    @property
+    def words(self) -> List[str]:
+        """
+        Слова текста в нижнем регистре (просто split по пробелам)
+        """
+        if self.__words is None:
+            self.__words = self.lower.split()
+        return self.__words
+
+    @property
+    def obscene_words(self) -> List[str]:
+        """
+        Найденные антиматом слова в том виде, в котором они написаны
+        """
+        if self.__obscene_words is None:
+            text = self.text_or_caption
+            self.__obscene_words = list(Antimat.bad_words(text)) if text else []
+        return self.__obscene_words
+
+    @property
+    def pronouns(self) -> List[str]:
+        """
+        Все личные местоимения (я, меня, мне...) в нижнем регистре
+        """
+        if self.__pronouns is None:
+            self.__pronouns = re_personal_pronouns.findall(self.lower)
+        return self.__pronouns
+
+    @property
+    def urls(self) -> List[str]:
+        return self.__get_entities_texts('url')
+
+    @property
+    def mentions(self) -> List[str]:
+        """
+        Юзернеймы из упоминаний, без @
+        """
+        return [text.lstrip('@').strip() for text in self.__get_entities_texts('mention')]
+
+    @property
+    def text_mentions(self) -> List[telegram.User]:
+        """
+        Пользователи, упомянутые без юзернейма
+        """
+        return [entity.user for entity in self.entities if entity.type == 'text_mention']
+
+    def __get_entities_texts(self, entity_type: str) -> List[str]:
+        return [text for entity, text in self.entities.items() if entity.type == entity_type]
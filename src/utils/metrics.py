@@ -0,0 +1,203 @@
+import bisect
+import time
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from src.config import CONFIG
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными границами корзин. Потокобезопасная.
+
+        wait_time = Histogram([0.001, 0.01, 0.1, 1])
+        wait_time.observe(0.005)
+        wait_time.percentile(0.99)  # верхняя граница корзины, куда попал 99-й перцентиль
+    """
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets: List[float] = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # последняя корзина -- все, что больше
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q: float) -> float:
+        """
+        Оценка сверху: граница корзины, в которую попал перцентиль. Для последней корзины -- max.
+        """
+        with self._lock:
+            if self.count == 0:
+                return 0.0
+            rank = q * self.count
+            total = 0
+            for bound, count in zip(self.buckets, self.counts):
+                total += count
+                if total >= rank:
+                    return bound
+            return self.max
+
+    def snapshot(self) -> Dict[str, object]:
+        """
+        Накопительные счетчики по корзинам: сколько значений <= границы.
+        """
+        with self._lock:
+            cumulative = {}
+            total = 0
+            for bound, count in zip(self.buckets, self.counts):
+                total += count
+                cumulative[bound] = total
+            return {'count': self.count, 'sum': self.sum, 'max': self.max, 'buckets': cumulative}
+
+
+# секунды; от долей миллисекунды (команда редиса) до секунд (медленный обработчик)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class MetricsRegistry:
+    """
+    Время, число вызовов и ошибки горячих мест бота. Ряды группируются по семействам:
+
+    * handler -- колбэки обработчиков в потоке диспетчера (у @run_async это только постановка
+      в пул);
+    * run_async -- тела @run_async обработчиков в пуле диспетчера;
+    * background -- задачи background_executor;
+    * function -- отдельные тяжелые функции (collect_stats, UserStat.add);
+    * redis -- команды редиса (пайплайн -- одна команда PIPELINE);
+    * sql -- запросы к базе, сгруппированные по виду ("SELECT users");
+    * session -- session_scope целиком.
+
+        with metrics.timed('function', 'collect_stats'):
+            ...
+
+        @metrics.timer('function')
+        def add(cls, added_stat): ...
+
+    render() отдает все в текстовом формате прометея (/metrics в src/web/server.py).
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS, prefix: str = 'bot',
+                 enabled: bool = True) -> None:
+        self.buckets = buckets
+        self.prefix = prefix
+        self.enabled = enabled
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._errors: Dict[Tuple[str, str], int] = {}
+        self._lock = Lock()
+
+    def observe(self, family: str, name: str, seconds: float, error: bool = False) -> None:
+        if not self.enabled:
+            return
+        key = (family, name)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self.buckets))
+        histogram.observe(seconds)
+        if error:
+            with self._lock:
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    @contextmanager
+    def timed(self, family: str, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.observe(family, name, time.perf_counter() - start, error)
+
+    def timer(self, family: str, name: Optional[str] = None) -> Callable[[Callable], Callable]:
+        """
+        Декоратор: то же, что timed, имя по умолчанию -- __qualname__ функции.
+        """
+
+        def decorator(func: Callable) -> Callable:
+            series_name = name or get_name(func)
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                error = False
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    error = True
+                    raise
+                finally:
+                    self.observe(family, series_name, time.perf_counter() - start, error)
+
+            return wrapper
+
+        return decorator
+
+    def series(self, family: str) -> Dict[str, Histogram]:
+        with self._lock:
+            return {name: histogram for (series_family, name), histogram in self._histograms.items()
+                    if series_family == family}
+
+    def errors(self, family: str) -> Dict[str, int]:
+        with self._lock:
+            return {name: count for (series_family, name), count in self._errors.items()
+                    if series_family == family}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+
+    def render(self) -> str:
+        """
+        Текстовый формат прометея: гистограмма {prefix}_{family}_seconds и счетчик
+        {prefix}_{family}_errors_total на каждое семейство, имя ряда -- в метке name.
+        """
+        with self._lock:
+            series = sorted(self._histograms.items())
+            errors = dict(self._errors)
+        lines: List[str] = []
+        for family in sorted({family for (family, _), _ in series}):
+            metric = f'{self.prefix}_{family}_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            for (series_family, name), histogram in series:
+                if series_family != family:
+                    continue
+                snapshot = histogram.snapshot()
+                label = f'name="{_escape_label(name)}"'
+                for bound, count in snapshot['buckets'].items():
+                    lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {snapshot["count"]}')
+                lines.append(f'{metric}_sum{{{label}}} {snapshot["sum"]}')
+                lines.append(f'{metric}_count{{{label}}} {snapshot["count"]}')
+            errors_metric = f'{self.prefix}_{family}_errors_total'
+            lines.append(f'# TYPE {errors_metric} counter')
+            for (series_family, name), _ in series:
+                if series_family == family:
+                    lines.append(f'{errors_metric}{{name="{_escape_label(name)}"}} '
+                                 f'{errors.get((family, name), 0)}')
+        return '\n'.join(lines) + '\n'
+
+
+def get_name(func: Callable) -> str:
+    return getattr(func, '__qualname__', None) or repr(func)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+metrics = MetricsRegistry(enabled=CONFIG.get('performance', {}).get('metrics_enabled', True))
@@ -1,51 +1,105 @@
-import time
+from functools import wraps
+from threading import Lock
+from typing import Callable, Dict, Hashable, List
 
-# еще можно использовать встроенный в питон lru_cache
-# https://docs.python.org/3/library/functools.html#functools.lru_cache
-#
-# @classmethod
-# @functools.lru_cache(maxsize=100)
+from src.utils.local_cache import LocalCache, MISSING
 
-class MWT(object):
+
+class _Flight:
+    """
+    Вычисление значения для одного ключа. Пока оно идет, остальные потоки с тем же ключом
+    ждут на lock.
+    """
+    __slots__ = ('lock', 'waiters')
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.waiters = 0
+
+
+class MWT:
     """
     Memoize With Timeout
 
         @MWT(timeout=60*60)           # 1 hour
         def method(param):
 
-    Source: http://code.activestate.com/recipes/325905-memoize-decorator-with-timeout/#c1
+    Результаты хранятся в LocalCache отдельно для каждой функции: не больше maxsize штук,
+    старые вытесняются. Если значения нет, то его вычисляет только один поток, а остальные
+    с теми же аргументами ждут и получают готовое (чтобы не было толпы запросов к апи).
+    Исключения не кэшируются.
+
+    У обернутой функции есть:
+
+        method.invalidate(param)  # забыть результат для этих аргументов
+        method.clear()            # забыть все
+        method.stats()            # {'hits': ..., 'misses': ..., 'evictions': ..., 'size': ...}
+
+    Статистика всех обернутых функций -- MWT.get_stats().
     """
-    _caches = {}  # type: ignore
-    _timeouts = {}  # type: ignore
+    _instances: List['MWT'] = []
 
-    def __init__(self,timeout=2):
+    def __init__(self, timeout: float = 2, maxsize: int = 1024) -> None:
         self.timeout = timeout
+        self.maxsize = maxsize
+        self.name = ''
+        self.cache = LocalCache(maxsize=maxsize, ttl=timeout)
+        self.hits = 0
+        self.misses = 0
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = Lock()
 
-    def collect(self):
-        """Clear cache of results which have timed out"""
-        for func in self._caches:
-            cache = {}
-            for key in self._caches[func]:
-                if (time.time() - self._caches[func][key][1]) < self._timeouts[func]:
-                    cache[key] = self._caches[func][key]
-            self._caches[func] = cache
+    @classmethod
+    def get_stats(cls) -> Dict[str, Dict[str, int]]:
+        return {mwt.name: mwt.stats() for mwt in cls._instances}
 
-    def __call__(self, f):
-        self.cache = self._caches[f] = {}
-        self._timeouts[f] = self.timeout
+    @staticmethod
+    def make_key(args: tuple, kwargs: dict) -> Hashable:
+        return args, tuple(sorted(kwargs.items()))
 
+    def __call__(self, f: Callable) -> Callable:
+        self.name = f'{f.__module__}.{f.__qualname__}'
+        self._instances.append(self)
+
+        @wraps(f)
         def func(*args, **kwargs):
-            kw = sorted(kwargs.items())
-            key = (args, tuple(kw))
-            try:
-                v = self.cache[key]
-                # print("cache")
-                if (time.time() - v[1]) > self.timeout:
-                    raise KeyError
-            except KeyError:
-                # print("new")
-                v = self.cache[key] = f(*args,**kwargs),time.time()
-            return v[0]
-        func.func_name = f.__name__
+            key = self.make_key(args, kwargs)
+            value = self.cache.get(key)
+            if value is not MISSING:
+                self.hits += 1
+                return value
+            return self.__compute(key, f, args, kwargs)
 
+        func.invalidate = lambda *args, **kwargs: self.cache.invalidate(self.make_key(args, kwargs))
+        func.clear = self.cache.clear
+        func.stats = self.stats
         return func
+
+    def stats(self) -> Dict[str, int]:
+        stats = self.cache.stats()
+        stats.update(hits=self.hits, misses=self.misses)
+        return stats
+
+    def __compute(self, key: Hashable, f: Callable, args: tuple, kwargs: dict):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+            flight.waiters += 1
+        try:
+            with flight.lock:
+                # пока ждали, значение мог вычислить другой поток
+                value = self.cache.get(key)
+                if value is not MISSING:
+                    self.hits += 1
+                    return value
+                self.misses += 1
+                generation = self.cache.get_generation()
+                value = f(*args, **kwargs)
+                self.cache.set(key, value, generation=generation)
+                return value
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                if flight.waiters == 0:
+                    del self._flights[key]
@@ -0,0 +1,189 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from types import CodeType
+from typing import Dict, Optional
+
+from src.config import CONFIG
+from src.utils.logger_helpers import get_logger
+
+logger = get_logger(__name__)
+
+# uuid в именах потоков пула диспетчера и номера потоков: все воркеры сливаются в один стек
+re_thread_number = re.compile(r'[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12}_?|\d+')
+
+# кадры, в которых поток ждет: Condition/Event.wait, Queue.get, select
+WAIT_FRAMES = {
+    'threading:wait',
+    'queue:get',
+    'selectors:select',
+}
+
+# рабочие циклы пулов: если поток ждет прямо в таком цикле, то он просто ждет работу, и сэмпл
+# только считается. Ожидание в любом другом месте (Future.result, соединение из пула бд,
+# очередь отправки) -- это и есть затык, он пишется в файл с пометкой idle
+IDLE_LOOPS = {
+    'thread:_worker',  # concurrent.futures.ThreadPoolExecutor (send_queue, баянометр)
+    'telegram.ext.dispatcher:_pooled',  # пул run_async
+    'telegram.ext.dispatcher:start',  # ожидание апдейтов
+    'telegram.ext.jobqueue:_main_loop',
+    'telegram.ext.updater:idle',
+    'src.utils.background:__work',
+    'src.utils.send_queue:__next_item',
+    'socketserver:serve_forever',  # flask
+}
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер: каждые interval секунд снимает стеки всех потоков (воркеры
+    диспетчера, пул run_async, фоновые потоки, очередь отправки, джобы, flask) и копит их
+    в формате collapsed stacks -- по строке "поток;модуль:функция;...;модуль:функция N".
+    Файл раз в flush_interval секунд перезаписывается в directory, из него рисуется flamegraph:
+
+        flamegraph.pl profiles/20181018_120000.collapsed > profile.svg
+
+    Сам код бота не трогается, поэтому накладные расходы -- только на проход по стекам
+    (при interval 0.05 это доли процента одного ядра) и профайлер можно держать включенным часами.
+    Потоки пулов, которые ждут работу (IDLE_LOOPS), в файл не пишутся, а только считаются.
+    Остальные ожидания пишутся с последним кадром idle -- на flamegraph это время простоя.
+    """
+
+    def __init__(self, directory: str, interval: float = 0.05, flush_interval: float = 60,
+                 max_depth: int = 100) -> None:
+        self.directory = directory
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.max_depth = max_depth
+        self.path: Optional[str] = None
+        self.samples = 0
+        self.idle = 0
+        self.stacks: Counter = Counter()
+        self._labels: Dict[CodeType, str] = {}
+        self._root = os.getcwd() + os.sep
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._deadline: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: Optional[float] = None) -> bool:
+        """
+        Запускает сэмплирование на duration секунд (None -- до stop). False, если уже запущено.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            os.makedirs(self.directory, exist_ok=True)
+            self.path = os.path.join(self.directory,
+                                     f'{datetime.now():%Y%m%d_%H%M%S}.collapsed')
+            self.samples = 0
+            self.idle = 0
+            self.stacks = Counter()
+            self._deadline = None if duration is None else time.monotonic() + duration
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.__run, name='profiler', daemon=True)
+            self._thread.start()
+        logger.info(f'[profiler] Started, writing to {self.path}')
+        return True
+
+    def stop(self) -> Optional[str]:
+        """
+        Останавливает сэмплирование и дописывает файл. Возвращает путь к файлу.
+        """
+        thread = self._thread
+        if thread is None:
+            return None
+        self._stop.set()
+        thread.join()
+        return self.path
+
+    def sample(self) -> None:
+        """
+        Один сэмпл стеков всех потоков, кроме самого профайлера.
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        current = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == current:
+                continue
+            labels = []  # от верхнего кадра к корню
+            while frame is not None and len(labels) < self.max_depth:
+                labels.append(self.__get_label(frame.f_code))
+                frame = frame.f_back
+            waits = 0
+            while waits < len(labels) - 1 and labels[waits] in WAIT_FRAMES:
+                waits += 1
+            if labels[waits] in IDLE_LOOPS:
+                self.idle += 1
+                continue
+            thread_name = re_thread_number.sub('N', names.get(ident, 'unknown'))
+            labels.append(thread_name.replace(' ', '_').replace(';', ':'))
+            stack = ';'.join(reversed(labels))
+            self.stacks[f'{stack};idle' if waits else stack] += 1
+        self.samples += 1
+
+    def write(self) -> None:
+        """
+        Перезаписывает файл накопленными стеками (через временный файл, чтобы не читать половину).
+        """
+        if self.path is None:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+        os.replace(tmp_path, self.path)
+
+    def get_status(self) -> str:
+        state = 'running' if self.running else 'stopped'
+        return (f'{state} samples={self.samples} idle={self.idle} stacks={len(self.stacks)} '
+                f'file={self.path}')
+
+    def __run(self) -> None:
+        next_flush = time.monotonic() + self.flush_interval
+        try:
+            while not self._stop.wait(self.interval):
+                self.sample()
+                now = time.monotonic()
+                if self._deadline is not None and now >= self._deadline:
+                    break
+                if now >= next_flush:
+                    self.write()
+                    next_flush = now + self.flush_interval
+        except Exception as e:
+            logger.error(f'[profiler] Sampling failed: {e}')
+        finally:
+            self.write()
+            logger.info(f'[profiler] Stopped: {self.get_status()}')
+
+    def __get_label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            _, separator, tail = filename.rpartition(f'site-packages{os.sep}')
+            if separator:
+                filename = tail
+            elif filename.startswith(self._root):
+                filename = filename[len(self._root):]
+            else:
+                # стандартная библиотека
+                filename = os.path.basename(filename)
+            if filename.endswith('.py'):
+                filename = filename[:-3]
+            module = filename.replace(os.sep, '.').replace(' ', '_').replace(';', ':')
+            label = f'{module}:{code.co_name}'
+            self._labels[code] = label
+        return label
+
+
+profiler = SamplingProfiler(
+    directory=CONFIG.get('performance', {}).get('profiler_directory', 'profiles'),
+    interval=CONFIG.get('performance', {}).get('profiler_interval', 0.05))
@@ -0,0 +1,90 @@
+import time
+from threading import Lock
+from typing import Union
+
+from src.config import CONFIG
+from src.utils.local_cache import LocalCache, MISSING
+
+
+class TokenBucket:
+    """
+    Ограничение частоты: rate токенов в секунду, не больше capacity про запас. Потокобезопасный.
+
+    reserve берет токен сразу, даже если его еще нет (в долг), и возвращает, сколько секунд
+    нужно подождать. Поэтому потоки выстраиваются в очередь в порядке обращения.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = Lock()
+
+    def reserve(self, tokens: float = 1) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Ждет, пока можно будет действовать. Возвращает, сколько секунд ждали.
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class SendRateLimiter:
+    """
+    Лимиты телеграма на отправку сообщений: общий на бота и отдельный на каждый чат.
+
+    В группу -- не больше ~20 сообщений в минуту, в личку -- не чаще ~1 в секунду,
+    всего -- не больше ~30 в секунду.
+    See: https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+
+        limiter.acquire(chat_id)
+        bot.send_message(chat_id, text)
+    """
+
+    def __init__(self, per_second: float = 25, group_per_minute: float = 20,
+                 private_per_second: float = 1, group_burst: float = 3) -> None:
+        self.global_bucket = TokenBucket(per_second, capacity=per_second)
+        self.group_per_minute = group_per_minute
+        self.private_per_second = private_per_second
+        self.group_burst = group_burst
+        # корзина, которая долго не использовалась, все равно полная:
+        # ее можно забыть и создать заново
+        self._chat_buckets = LocalCache(maxsize=10000, ttl=10 * 60)
+        self._lock = Lock()
+
+    def acquire(self, chat_id: Union[int, str]) -> float:
+        """
+        Ждет, пока можно отправить сообщение в чат. Возвращает, сколько секунд ждали.
+        """
+        wait = self.get_chat_bucket(chat_id).acquire()
+        return wait + self.global_bucket.acquire()
+
+    def get_chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is MISSING:
+                # @username -- это канал, у него лимиты как у группы
+                if str(chat_id).startswith('@') or int(chat_id) < 0:
+                    bucket = TokenBucket(self.group_per_minute / 60, capacity=self.group_burst)
+                else:
+                    bucket = TokenBucket(self.private_per_second, capacity=1)
+            # обновляем время жизни при каждом обращении
+            self._chat_buckets.set(chat_id, bucket)
+            return bucket
+
+
+send_rate_limiter = SendRateLimiter(
+    per_second=CONFIG.get('performance', {}).get('send_rate_per_second', 25),
+    group_per_minute=CONFIG.get('performance', {}).get('send_rate_group_per_minute', 20))
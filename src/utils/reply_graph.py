@@ -0,0 +1,90 @@
+from typing import Dict, Iterable, List, Mapping, Optional
+
+from src.utils.misc import get_int, sort_dict
+
+# так выглядит дракон вместо партнера у replylove__dragon_lovers (User(0, 0, 'drakon', '🐉'))
+DRAGON_UID = 0
+
+
+class ReplyGraph:
+    """
+    Топы страсти всех юзеров чата, посчитанные за один проход по недельной статистике реплаев
+    (словарь из ReplyTopDBHelper.get_db).
+
+    Раньше топ каждого юзера искался отдельно: заново грузилась и сортировалась вся статистика чата.
+    Здесь каждый список сортируется один раз, а дальше топы берутся из словарей.
+
+    Работает только с айди: юзеры (и их отсутствие в бд) -- забота вызывающего. Поэтому для парной
+    страсти возвращаются все подходящие партнеры по убыванию: если первого нет в бд,
+    берется следующий.
+    """
+    min_count = 5
+
+    def __init__(self, db: Mapping[str, dict], ignore: Iterable[int] = (),
+                 dragon_lovers: Iterable[int] = (),
+                 ignore_pairs: Optional[Mapping[str, Iterable[int]]] = None) -> None:
+        """
+        :param ignore: replylove__ignore
+        :param dragon_lovers: replylove__dragon_lovers
+        :param ignore_pairs: replylove__ignore_pairs этого чата: str(uid) -> с кем не сводить
+        """
+        self.ignore = frozenset(ignore)
+        self.dragon_lovers = frozenset(dragon_lovers)
+        self.ignore_pairs = {str(uid): frozenset(uids)
+                             for uid, uids in (ignore_pairs or {}).items()}
+        self.pairs: Dict[int, List[int]] = self.__build_pairs(db.get('pair', {}))
+        self.inbound: Dict[int, Optional[int]] = self.__build_tops(db.get('inbound', {}))
+        self.outbound: Dict[int, Optional[int]] = self.__build_tops(db.get('outbound', {}))
+
+    def get_pair_candidates(self, uid: int) -> List[int]:
+        if uid in self.dragon_lovers:
+            return [DRAGON_UID]
+        return self.pairs.get(uid, [])
+
+    def get_inbound(self, uid: int) -> Optional[int]:
+        return self.inbound.get(uid)
+
+    def get_outbound(self, uid: int) -> Optional[int]:
+        return self.outbound.get(uid)
+
+    def __get_ignore_pairs(self, uid: int) -> frozenset:
+        return self.ignore_pairs.get(str(uid), frozenset())
+
+    def __build_pairs(self, pairs: Dict[str, int]) -> Dict[int, List[int]]:
+        candidates: Dict[int, List[int]] = {}
+        for pair, count in sort_dict(pairs):
+            if count < self.min_count:
+                break
+            a_uid, b_uid = [get_int(x) for x in pair.split(',')]
+            if a_uid is None or b_uid is None or a_uid == b_uid:
+                continue
+            if a_uid in self.dragon_lovers or b_uid in self.dragon_lovers:
+                continue
+            if a_uid in self.ignore or b_uid in self.ignore:
+                continue
+            for uid, partner in ((a_uid, b_uid), (b_uid, a_uid)):
+                ignore_pairs = self.__get_ignore_pairs(uid)
+                if a_uid in ignore_pairs or b_uid in ignore_pairs:
+                    continue
+                candidates.setdefault(uid, []).append(partner)
+        return candidates
+
+    def __build_tops(self, adjacency: Dict[int, Dict[int, int]]) -> Dict[int, Optional[int]]:
+        tops: Dict[int, Optional[int]] = {}
+        for uid, counts in adjacency.items():
+            if uid in self.ignore:
+                continue
+            if uid in self.dragon_lovers:
+                tops[uid] = DRAGON_UID
+                continue
+            ignore_pairs = self.__get_ignore_pairs(uid)
+            tops[uid] = None
+            for partner, count in sort_dict(counts):
+                if count < self.min_count:
+                    break
+                if partner == uid or partner in self.dragon_lovers or partner in self.ignore \
+                        or partner in ignore_pairs:
+                    continue
+                tops[uid] = partner
+                break
+        return tops
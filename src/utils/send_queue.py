@@ -0,0 +1,313 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple, Union
+
+from src.config import CONFIG
+from src.utils.logger_helpers import get_logger
+from src.utils.metrics import Histogram
+from src.utils.rate_limit import SendRateLimiter, send_rate_limiter
+
+logger = get_logger(__name__)
+
+# секунды от постановки в очередь до начала отправки
+SEND_WAIT_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 3, 10, 30, 60, 300]
+
+ChatId = Union[int, str]
+
+
+class SendQueueFull(Exception):
+    pass
+
+
+class _Item:
+    __slots__ = ('chat_id', 'callback', 'args', 'kwargs', 'priority', 'seq', 'coalesce_key',
+                 'future', 'enqueued_at', 'reserved', 'tries')
+
+    def __init__(self, chat_id: ChatId, callback: Callable, args: tuple, kwargs: dict,
+                 priority: int, seq: int, coalesce_key: Optional[Hashable]) -> None:
+        self.chat_id = chat_id
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.coalesce_key = coalesce_key
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+        self.reserved = False  # сообщению уже выделено место в лимите чата
+        self.tries = 0
+
+    def __lt__(self, other: '_Item') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendQueue:
+    """
+    Общая очередь исходящих сообщений бота.
+
+    Соблюдает лимиты телеграма (см. SendRateLimiter): общий и на каждый чат. Сообщения в чат,
+    который уперся в лимит, ждут, не задерживая остальные чаты. Из готовых к отправке первыми
+    уходят сообщения с меньшим priority: ответы на команды раньше недельной статы.
+    В один чат сообщения уходят по одному и в порядке постановки (при равном priority).
+
+        future = send_queue.put(chat_id, bot.send_message, chat_id, text, priority=SendQueue.LOW)
+        future.result()  # telegram.Message или исключение
+
+    Если передан coalesce_key, а в очереди уже лежит сообщение в этот чат с тем же ключом,
+    то новое заменяет аргументы старого (отправится только последнее), и возвращается тот же future.
+
+    Очередь ограничена maxsize: когда она переполнена, все, кроме HIGH, сразу отклоняется
+    с SendQueueFull. На RetryAfter сообщение откладывается на указанное время и отправляется снова.
+
+    До start() (скрипты, тесты) put просто вызывает callback.
+    """
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+    max_tries = 3
+
+    def __init__(self, limiter: SendRateLimiter, maxsize: int = 10000, workers: int = 8,
+                 timeout: float = 60) -> None:
+        self.limiter = limiter
+        self.maxsize = maxsize
+        self.workers = workers
+        self.timeout = timeout
+        self.running = False
+        self.wait_time = Histogram(SEND_WAIT_BUCKETS)
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.retry_after = 0
+        self._ready: List[_Item] = []
+        self._delayed: List[Tuple[float, _Item]] = []
+        # чаты, у которых сообщение отправляется или ждет лимита. Остальные сообщения в них ждут тут
+        self._busy: Set[ChatId] = set()
+        self._parked: Dict[ChatId, Deque[_Item]] = {}
+        self._coalesce: Dict[Tuple[ChatId, Hashable], _Item] = {}
+        self._size = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self._cond:
+            if self.running:
+                return
+            self.running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='send_queue')
+        self._thread = threading.Thread(target=self.__run, name='send_queue', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Перестает принимать сообщения и ждет, пока отправятся уже поставленные.
+        """
+        with self._cond:
+            if not self.running:
+                return
+            self.running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def is_sending_thread(self) -> bool:
+        """
+        True в потоке, который сейчас отправляет сообщение из очереди.
+        """
+        return getattr(self._local, 'sending', False)
+
+    def put(self, chat_id: ChatId, callback: Callable, *args, priority: int = NORMAL,
+            coalesce_key: Optional[Hashable] = None, **kwargs) -> Future:
+        if not self.is_valid_chat_id(chat_id):
+            # иначе сообщение навсегда заняло бы чат и место в очереди
+            logger.error(f'[send_queue] Bad chat_id {chat_id!r}, message is dropped')
+            rejected: Future = Future()
+            rejected.set_exception(ValueError(f'Bad chat_id: {chat_id!r}'))
+            return rejected
+        future = self.__enqueue(chat_id, callback, args, kwargs, priority, coalesce_key)
+        if future is None:
+            return self.__call_now(callback, args, kwargs)
+        return future
+
+    @staticmethod
+    def is_valid_chat_id(chat_id: ChatId) -> bool:
+        """
+        Айди чата или @username канала.
+        """
+        if isinstance(chat_id, bool):
+            return False
+        if isinstance(chat_id, int):
+            return True
+        return isinstance(chat_id, str) and (chat_id.startswith('@') or
+                                             chat_id.lstrip('-').isdigit())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'size': self._size,
+                'ready': len(self._ready),
+                'delayed': len(self._delayed),
+                'parked': sum(len(items) for items in self._parked.values()),
+                'sent': self.sent,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'retry_after': self.retry_after,
+            }
+
+    def get_status(self) -> str:
+        stats = self.stats()
+        return (f"size={stats['size']} ready={stats['ready']} delayed={stats['delayed']} "
+                f"parked={stats['parked']} sent={stats['sent']} failed={stats['failed']} "
+                f"dropped={stats['dropped']} coalesced={stats['coalesced']} "
+                f"retry_after={stats['retry_after']} "
+                f"wait_p50={self.wait_time.percentile(0.5)}s "
+                f"wait_p99={self.wait_time.percentile(0.99)}s wait_max={self.wait_time.max:.3f}s")
+
+    def __enqueue(self, chat_id: ChatId, callback: Callable, args: tuple, kwargs: dict,
+                  priority: int, coalesce_key: Optional[Hashable]) -> Optional[Future]:
+        with self._cond:
+            if not self.running:
+                return None
+            if coalesce_key is not None:
+                pending = self._coalesce.get((chat_id, coalesce_key))
+                if pending is not None:
+                    pending.callback, pending.args, pending.kwargs = callback, args, kwargs
+                    self.coalesced += 1
+                    return pending.future
+            if self._size >= self.maxsize and priority != self.HIGH:
+                self.dropped += 1
+                future: Future = Future()
+                future.set_exception(SendQueueFull(f'{self._size} messages in queue'))
+                logger.warning(f'[send_queue] Queue is full, message to {chat_id} is dropped')
+                return future
+            item = _Item(chat_id, callback, args, kwargs, priority, next(self._seq), coalesce_key)
+            if coalesce_key is not None:
+                self._coalesce[(chat_id, coalesce_key)] = item
+            self._size += 1
+            heapq.heappush(self._ready, item)
+            self._cond.notify()
+            return item.future
+
+    @staticmethod
+    def __call_now(callback: Callable, args: tuple, kwargs: dict) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(callback(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __run(self) -> None:
+        while True:
+            try:
+                with self._cond:
+                    item = self.__next_item()
+                if item is None:
+                    return
+                self.limiter.global_bucket.acquire()
+                self._executor.submit(self.__send, item)
+            except Exception as e:
+                logger.error(f'[send_queue] {e}')
+
+    def __next_item(self) -> Optional[_Item]:
+        """
+        Вызывается под self._cond. Ждет сообщение, которое можно отправить прямо сейчас.
+        None -- очередь остановлена и пуста.
+        """
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                heapq.heappush(self._ready, heapq.heappop(self._delayed)[1])
+            while self._ready:
+                item = heapq.heappop(self._ready)
+                if item.reserved:
+                    return item
+                if item.chat_id in self._busy:
+                    self._parked.setdefault(item.chat_id, deque()).append(item)
+                    continue
+                try:
+                    wait = self.limiter.get_chat_bucket(item.chat_id).reserve()
+                except Exception as e:
+                    # сообщение не теряется молча: future падает, место в очереди освобождается
+                    logger.error(f'[send_queue] Bad chat {item.chat_id!r}: {e}')
+                    self._size -= 1
+                    self.failed += 1
+                    if item.coalesce_key is not None:
+                        self._coalesce.pop((item.chat_id, item.coalesce_key), None)
+                    if item.future.set_running_or_notify_cancel():
+                        item.future.set_exception(e)
+                    continue
+                self._busy.add(item.chat_id)
+                item.reserved = True
+                if wait <= 0:
+                    return item
+                heapq.heappush(self._delayed, (now + wait, item))
+            if not self.running and self._size == 0:
+                return None
+            self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+
+    def __send(self, item: _Item) -> None:
+        self._local.sending = True
+        with self._cond:
+            if item.coalesce_key is not None \
+                    and self._coalesce.get((item.chat_id, item.coalesce_key)) is item:
+                del self._coalesce[(item.chat_id, item.coalesce_key)]
+        if item.tries == 0:
+            self.wait_time.observe(time.monotonic() - item.enqueued_at)
+            if not item.future.set_running_or_notify_cancel():
+                self.__done(item, sent=False)
+                return
+        item.tries += 1
+        try:
+            result = item.callback(*item.args, **item.kwargs)
+        except Exception as e:
+            # telegram.error.RetryAfter: телеграм просит подождать перед следующим сообщением в чат
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None and item.tries < self.max_tries:
+                self.__retry(item, retry_after)
+                return
+            name = getattr(item.callback, '__name__', 'send')
+            logger.error(f'[send_queue] Failed to {name} to {item.chat_id}: {e}')
+            self.__done(item, failed=True)
+            item.future.set_exception(e)
+        else:
+            self.__done(item)
+            item.future.set_result(result)
+
+    def __retry(self, item: _Item, retry_after: float) -> None:
+        logger.warning(f'[send_queue] Flood limit in {item.chat_id}, retry after {retry_after}s')
+        with self._cond:
+            self.retry_after += 1
+            # чат остается занятым: следующие сообщения в него ждут этого
+            heapq.heappush(self._delayed, (time.monotonic() + retry_after, item))
+            self._cond.notify()
+
+    def __done(self, item: _Item, sent: bool = True, failed: bool = False) -> None:
+        with self._cond:
+            if failed:
+                self.failed += 1
+            elif sent:
+                self.sent += 1
+            self._size -= 1
+            self._busy.discard(item.chat_id)
+            for parked in self._parked.pop(item.chat_id, ()):
+                heapq.heappush(self._ready, parked)
+            self._cond.notify()
+
+
+send_queue = SendQueue(send_rate_limiter,
+                       maxsize=CONFIG.get('performance', {}).get('send_queue_size', 10000),
+                       workers=CONFIG.get('performance', {}).get('send_queue_workers', 8),
+                       timeout=CONFIG.get('performance', {}).get('send_queue_timeout', 10))
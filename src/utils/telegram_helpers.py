@@ -1,22 +1,106 @@
 import time
-import traceback
+from concurrent import futures
 from functools import wraps
-from typing import List, Optional
+from typing import Callable, List, Optional
 
 import telegram
-from telegram.ext import DelayQueue
 
 from src.utils.logger_helpers import get_logger
 from src.utils.mwt import MWT
+from src.utils.send_queue import send_queue
 
 logger = get_logger(__name__)
 
-def dsp_catch(e: Exception):
-    logger.error('DSP raise exception:')
-    traceback.print_exception(Exception, e, e.__traceback__)
 
+class QueuedMessage:
+    """
+    Результат отправки через QueuedBot: сообщение, которое, возможно, еще стоит в очереди.
+
+    Отправивший поток не ждет лимитов чата -- ответы, результат которых никто не читает, просто
+    уходят в очередь. Ждет только тот, кому нужен сам telegram.Message: при обращении к любому
+    атрибуту (message.message_id) или через result().
+    """
+    __slots__ = ('future',)
+
+    def __init__(self, future: futures.Future) -> None:
+        self.future = future
+
+    def result(self, timeout: Optional[float] = None) -> telegram.Message:
+        """
+        Ждет отправки не дольше timeout (по умолчанию send_queue.timeout) секунд. Если сообщение
+        так и не начало отправляться, оно убирается из очереди и бросается telegram.error.TimedOut.
+        Если уже отправляется -- ждем до конца, иначе ретрай вызывающего отправил бы дубль.
+        """
+        try:
+            return self.future.result(timeout=send_queue.timeout if timeout is None else timeout)
+        except futures.TimeoutError:
+            if self.future.cancel():
+                raise telegram.error.TimedOut()
+            return self.future.result()
+
+    def __getattr__(self, name: str):
+        return getattr(self.result(), name)
+
+
+class QueuedBot(telegram.Bot):
+    """
+    Бот, который отправляет сообщения через send_queue с высоким приоритетом.
+
+    Методы не ждут отправки и возвращают QueuedMessage: обработчики не блокируются на лимитах
+    чата (20 сообщений в минуту в группу). Кому нужен telegram.Message, тот ждет его
+    при обращении к атрибутам, см. QueuedMessage.result. Ошибки отправки логирует очередь,
+    а кому нужен запасной вариант на ошибку или порядок с методами мимо очереди
+    (edit_message_text), тот ждет отправки через wait_sent.
+    """
+
+    def send_message(self, chat_id, *args, **kwargs):
+        return self.__queued(super().send_message, chat_id, args, kwargs)
+
+    def send_sticker(self, chat_id, *args, **kwargs):
+        return self.__queued(super().send_sticker, chat_id, args, kwargs)
+
+    def send_photo(self, chat_id, *args, **kwargs):
+        return self.__queued(super().send_photo, chat_id, args, kwargs)
 
-dsp = DelayQueue(burst_limit=20, time_limit_ms=1017, exc_route=dsp_catch)
+    def send_document(self, chat_id, *args, **kwargs):
+        return self.__queued(super().send_document, chat_id, args, kwargs)
+
+    def send_voice(self, chat_id, *args, **kwargs):
+        return self.__queued(super().send_voice, chat_id, args, kwargs)
+
+    def forward_message(self, chat_id, *args, **kwargs):
+        return self.__queued(super().forward_message, chat_id, args, kwargs)
+
+    # в telegram.Bot это алиасы на методы базового класса
+    sendMessage = send_message
+    sendSticker = send_sticker
+    sendPhoto = send_photo
+    sendDocument = send_document
+    sendVoice = send_voice
+    forwardMessage = forward_message
+
+    @staticmethod
+    def __queued(method: Callable, chat_id, args: tuple, kwargs: dict):
+        # из самой очереди отправляем напрямую, иначе поток будет ждать сам себя
+        if send_queue.is_sending_thread():
+            return method(chat_id, *args, **kwargs)
+        return QueuedMessage(send_queue.put(chat_id, method, chat_id, *args,
+                                            priority=send_queue.HIGH, **kwargs))
+
+
+def wait_sent(message):
+    """
+    Ждет отправки сообщения через QueuedBot и бросает ее ошибку. Для обычного telegram.Bot
+    сообщение уже отправлено.
+
+        try:
+            wait_sent(bot.send_message(uid, text))
+        except Exception:
+            bot.answer_callback_query(query.id, 'Нажми Start в личке бота', show_alert=True)
+    """
+    if isinstance(message, QueuedMessage):
+        return message.result()
+    return message
 
 
 def telegram_retry(tries=4, delay=3, backoff=2, logger=None, silence: bool = False, default=None,
@@ -64,6 +148,9 @@ def telegram_retry(tries=4, delay=3, backoff=2, logger=None, silence: bool = Fal
 def get_chat_admins(bot: telegram.Bot, chat_id: int) -> List[telegram.ChatMember]:
     """
     Возвращает список админов чата. Результаты кэшируются на 5 минут.
+
+    Если админов одного чата запросили сразу несколько потоков, то в апи уйдет один запрос.
+    Сбросить кэш для чата: get_chat_admins.invalidate(bot, chat_id).
     """
 
     @telegram_retry(logger=logger, silence=True, default=[], title='get_chat_admins')
@@ -76,3 +163,12 @@ def get_chat_admins(bot: telegram.Bot, chat_id: int) -> List[telegram.ChatMember
 @telegram_retry(logger=logger, title='get_photo_url')
 def get_photo_url(bot: telegram.Bot, message: telegram.Message) -> str:
     return bot.get_file(message.photo[-1].file_id).file_path
+
+
+def get_photo_file_key(message: telegram.Message) -> str:
+    """
+    Айди самой большой фотки сообщения, по которому можно кэшировать все, что из нее посчитано.
+    file_unique_id одинаковый у всех копий файла, но есть только в новых версиях Bot API.
+    """
+    photo = message.photo[-1]
+    return getattr(photo, 'file_unique_id', None) or photo.file_id
@@ -0,0 +1,35 @@
+from typing import Dict, Iterable, Sequence
+
+
+def build_trie_regexp(sequences: Iterable[Sequence[str]], separator: str = '') -> str:
+    """
+    Собирает регулярку-дерево из последовательностей токенов.
+
+    Общие префиксы записываются один раз, поэтому re на каждой позиции проходит по дереву,
+    а не перебирает все варианты подряд, как в 'вариант1|вариант2|...'. Токены -- это
+    готовые куски регулярки (например, re.escape(char) или '[аб][аб]*'). separator
+    вставляется между соседними токенами.
+
+    Если одна последовательность -- префикс другой, то матчится самая длинная.
+    """
+    trie: Dict = {}
+    for sequence in sequences:
+        if not sequence:
+            continue
+        node = trie
+        for token in sequence:
+            node = node.setdefault(token, {})
+        node[''] = {}
+    return _trie_to_regexp(trie, separator)
+
+
+def _trie_to_regexp(node: Dict, separator: str, prefix: str = '') -> str:
+    is_end = '' in node
+    alternatives = [prefix + token + _trie_to_regexp(node[token], separator, separator)
+                    for token in sorted(key for key in node if key != '')]
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1 and not is_end:
+        return alternatives[0]
+    result = '(?:{})'.format('|'.join(alternatives))
+    return f'{result}?' if is_end else result
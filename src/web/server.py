@@ -1,9 +1,13 @@
+import hmac
+
 import telegram
-from flask import Flask, request, jsonify
+from flask import Flask, Response, abort, request, jsonify
 from flask_cors import CORS
 
+from src.config import CONFIG
 from src.dayof.valentine_day_old import Web
 from src.utils.logger_helpers import get_logger
+from src.utils.metrics import metrics
 
 logger = get_logger(__name__)
 
@@ -49,9 +53,29 @@ def create_app(bot: telegram.Bot):
             cards=[],
         )
 
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        if not is_metrics_request_allowed():
+            abort(403)
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
     return app
 
 
+def is_metrics_request_allowed() -> bool:
+    """
+    /metrics -- внутренности бота, а снаружи к серверу ходят через реверс-прокси, то есть тоже
+    с localhost. Поэтому метрики отдаются только с metrics_token в заголовке X-Metrics-Token,
+    без токена в конфиге -- никому.
+    """
+    token = CONFIG.get('performance', {}).get('metrics_token')
+    if not token:
+        return False
+    # байты, а не строки: на не-ascii в заголовке compare_digest кидает TypeError
+    header = request.headers.get('X-Metrics-Token', '')
+    return hmac.compare_digest(header.encode('utf-8'), token.encode('utf-8'))
+
+
 def start_server(bot, port):
     app = create_app(bot)
     app.run(debug=False, use_reloader=False, threaded=True, port=port)
@@ -3,7 +3,8 @@ import sys
 import unittest
 from unittest.mock import MagicMock
 
-from src.modules.antimat.antimat import Antimat, get_default_filter, ObsceneRegexp, extended_filter_enabled
+from src.modules.antimat.antimat import Antimat, get_default_filter, ObsceneRegexp, \
+    extended_filter_enabled, ObsceneWordsFilter, ObsceneConf
 
 sys.modules['telegram'] = MagicMock()
 sys.modules['telegram.ext'] = MagicMock()
@@ -201,6 +202,36 @@ class ObsceneWordsFilterTest(StopAfterFailTestCase):
             self.assertEqual(v, self.words_filter.mask_bad_words(k))
 
 
+class ObscenePrefilterTest(StopAfterFailTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.words_filter = get_default_filter()
+        cls.regexp_filter = ObsceneWordsFilter(ObsceneConf.bad_words_re, ObsceneConf.good_words_re)
+
+    def assertSameMatches(self, text):
+        expected = [m.span() for m in self.regexp_filter.find_bad_word_matches(text)]
+        actual = [m.span() for m in self.words_filter.find_bad_word_matches(text)]
+        self.assertListEqual(expected, actual, text)
+
+    def test_no_anchors(self):
+        for text in ['', 'привет', 'Hello world', 'пойдем в чат']:
+            self.assertFalse(self.words_filter.prefilter.may_contain(text), text)
+
+    def test_same_as_regexp(self):
+        texts = [
+            'Да охуеть блять, вы заебали, охуели совсем в конец уже!',
+            'п.и.з.д.е.ц', 'х у й', 'XYйня', 'бл*ядь', 'ееееееелда', 'Ёбтеть', 'ЁБАНЫЙ', 'хуİ',
+            'тебе и себе хлеба', 'св|иб', 'с|в|и|б', 'слышала/видела', 'ебать/копать',
+            'учебу/туризм',
+            'нахуй\tпошел\nдолбоёб', 'BASOULHQUNXYYNXCWREHVFHRO2A',
+        ]
+        for text in texts:
+            self.assertSameMatches(text)
+        with open(__file__, 'r', encoding='utf-8') as f:
+            for line in f:
+                self.assertSameMatches(line)
+
+
 class PhpCensureTest(StopAfterFailTestCase):
     """
     Кое-что из https://github.com/rin-nas/php-censure
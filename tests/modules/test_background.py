@@ -0,0 +1,55 @@
+import threading
+import unittest
+
+from src.utils.background import BackgroundExecutor
+
+
+class BackgroundExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = BackgroundExecutor(workers=1, maxsize=4)
+        self.done = []
+
+    def tearDown(self):
+        self.executor.stop(timeout=5)
+
+    def task(self, name):
+        self.done.append(name)
+
+    def test_not_started(self):
+        self.assertTrue(self.executor.submit(self.task, 'now'))
+        self.assertListEqual(['now'], self.done)
+
+    def test_priority_and_shedding(self):
+        # пока единственный поток занят, задачи копятся в очереди
+        started, release = threading.Event(), threading.Event()
+        self.executor.start()
+        self.executor.submit(lambda: started.set() or release.wait(5))
+        started.wait(5)
+        self.assertTrue(self.executor.submit(self.task, 'low0', priority=BackgroundExecutor.LOW,
+                                             name='low'))
+        self.assertTrue(self.executor.submit(self.task, 'normal0', name='normal'))
+        # LOW отбрасывается уже на половине очереди
+        self.assertFalse(self.executor.submit(self.task, 'low1', priority=BackgroundExecutor.LOW,
+                                              name='low'))
+        self.assertTrue(self.executor.submit(self.task, 'normal1', name='normal'))
+        self.assertTrue(self.executor.submit(self.task, 'normal2', name='normal'))
+        self.assertFalse(self.executor.submit(self.task, 'normal3', name='normal'))
+        # HIGH принимается всегда
+        self.assertTrue(self.executor.submit(self.task, 'high', priority=BackgroundExecutor.HIGH))
+        release.set()
+        self.executor.stop(timeout=5)
+
+        self.assertListEqual(['high', 'normal0', 'normal1', 'normal2', 'low0'], self.done)
+        stats = self.executor.stats()
+        self.assertDictEqual({'low': 1, 'normal': 1}, stats['shed'])
+        self.assertEqual(5, stats['max_depth'])
+        self.assertEqual(6, stats['done'])
+        self.assertEqual(0, stats['depth'])
+
+    def test_errors(self):
+        self.executor.start()
+        self.executor.submit(lambda: 1 / 0)
+        self.executor.submit(self.task, 'after')
+        self.executor.stop(timeout=5)
+        self.assertListEqual(['after'], self.done)
+        self.assertEqual(1, self.executor.stats()['failed'])
@@ -0,0 +1,83 @@
+import datetime
+import random
+import unittest
+from io import BytesIO
+from unittest.mock import Mock, patch
+
+import imagehash
+from PIL import Image, ImageDraw
+
+from src.modules.bayanometer import Photo
+from src.utils.hamming_index import HammingIndex
+from tests.modules.test_hamming_index import FakeCache
+
+
+def make_jpeg(width: int = 1280, height: int = 960) -> bytes:
+    rnd = random.Random(1)
+    image = Image.new('RGB', (width, height))
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        draw.ellipse((x, y, x + rnd.randrange(50, 500), y + rnd.randrange(50, 500)),
+                     fill=tuple(rnd.randrange(256) for _ in range(3)))
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+class PhotoHasherTest(unittest.TestCase):
+    def test_same_pixels_as_full_decode(self):
+        # в редисе хранятся phash, посчитанные по целиком разжатым фоткам: хешер должен
+        # получать ту же картинку 256x256 до бита, иначе старые фотки не найдутся
+        hasher = Photo.PhotoHasher
+        content = make_jpeg()
+        expected = hasher._PhotoHasher__prepare_img(Image.open(BytesIO(content)))
+        session = Mock()
+        session.get.return_value.content = content
+        images = []
+        original_phash = imagehash.phash
+
+        def phash(image):
+            images.append(image)
+            return original_phash(image)
+
+        with patch.object(hasher, '_PhotoHasher__session', session), \
+                patch('src.modules.bayanometer.imagehash.phash', side_effect=phash):
+            hashes = hasher.get_hashes('https://example.com/photo.jpg')
+        self.assertEqual(1, len(images))
+        self.assertEqual(expected.tobytes(), images[0].tobytes())
+        self.assertListEqual([('phash', str(imagehash.phash(expected)))], hashes)
+
+
+class FakePureCache(FakeCache):
+    def __init__(self):
+        super().__init__()
+        self.values = {}
+
+    def exists(self, key):
+        return key in self.values
+
+    def set(self, key, val, time=None):
+        self.values[key] = val
+
+
+class BackfillTest(unittest.TestCase):
+    def test_backfill_phash_index(self):
+        photo = Photo(10, datetime.datetime(2018, 10, 1), 1)
+        photos = {
+            'bayanometer:photo:-100:phash:c3a1f0e0d8b8f0f0': photo,
+            'bayanometer:photo:-100:phash:ffffffffffffffff': None,  # протух между SCAN и MGET
+        }
+        cache = Mock()
+        cache.scan_keys.return_value = iter(photos)
+        cache.get_many.side_effect = lambda keys: [photos[key] for key in keys]
+        pure_cache = FakePureCache()
+        index = HammingIndex(pure_cache, 'bayanometer:phash_index', ttl=10 ** 10)
+        with patch('src.modules.bayanometer.cache', cache), \
+                patch('src.modules.bayanometer.pure_cache', pure_cache), \
+                patch('src.modules.bayanometer.phash_index', index):
+            Photo.backfill_phash_index()
+            Photo.backfill_phash_index()
+        cache.scan_keys.assert_called_once_with('bayanometer:photo:*:phash:*')
+        self.assertListEqual([('c3a1f0e0d8b8f0f0', 1)], index.find(-100, 'c3a1f0e0d8b8f0f1', 4))
+        self.assertEqual(1, pure_cache.values['bayanometer:phash_index_backfilled'])
@@ -0,0 +1,47 @@
+import pickle
+import unittest
+
+from src.utils.codec import CacheCodec, CodecError
+
+
+class Point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+CacheCodec.register(Point, 'test_point:1', lambda point: [point.x, point.y],
+                    lambda state: Point(*state))
+
+
+class CacheCodecTest(unittest.TestCase):
+    def setUp(self):
+        self.codec = CacheCodec(compress_min_size=1024)
+
+    def test_legacy_pickle(self):
+        value = {'uid': 1, 'names': ['a', 'b']}
+        self.assertEqual(value, self.codec.loads(pickle.dumps(value, 3)))
+
+    def test_round_trip(self):
+        value = {'count': 1, 'items': [1, 2, 3]}
+        self.assertEqual(value, self.codec.loads(self.codec.dumps(value)))
+
+    def test_registered_class(self):
+        point = self.codec.loads(self.codec.dumps(Point(1, 'y')))
+        self.assertIsInstance(point, Point)
+        self.assertEqual((1, 'y'), (point.x, point.y))
+        self.assertNotIn(b'Point', self.codec.dumps(Point(1, 'y')))
+
+    def test_compression(self):
+        small = self.codec.dumps('a' * 10)
+        big = self.codec.dumps('a' * 10000)
+        self.assertEqual(0, small[1])
+        self.assertEqual(1, big[1])
+        self.assertLess(len(big), 1000)
+        self.assertEqual('a' * 10000, self.codec.loads(big))
+
+    def test_unknown_type(self):
+        data = pickle.dumps(Point(1, 2), pickle.HIGHEST_PROTOCOL)
+        data = data.replace(b'test_point:1', b'test_point:2')
+        with self.assertRaises(CodecError):
+            self.codec.loads(data)
@@ -0,0 +1,34 @@
+import unittest
+
+from src.utils.command_index import CommandIndex
+
+CHATS = {
+    '-100': {'enabled_commands': ['pidor'], 'disabled_commands': ['khaleesi'], 'all_cmd': True},
+    '-200': {'enabled_commands': ['pidor']},
+}
+CMDS = {
+    'synonyms': {'weather': ['p', 'w', 'pogoda'], 'iall': ['iall', 'alli']},
+    'text_cmds': ['сы', 'пидор'],
+}
+
+
+class CommandIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = CommandIndex(CHATS, CMDS, ['pidor', 'weather', 'сы'])
+
+    def test_is_command_enabled(self):
+        self.assertTrue(self.index.is_command_enabled(-100, 'pidor'))
+        self.assertTrue(self.index.is_command_enabled('-100', 'weather'))
+        self.assertFalse(self.index.is_command_enabled(-100, 'khaleesi'))
+        self.assertFalse(self.index.is_command_enabled(-100, 'khaleesi', True))
+        self.assertFalse(self.index.is_command_enabled(-200, 'weather'))
+        self.assertTrue(self.index.is_command_enabled(-200, 'weather', True))
+        self.assertFalse(self.index.is_command_enabled(-300, 'pidor'))
+
+    def test_get_command_name(self):
+        self.assertEqual('weather', self.index.get_command_name('/P@bot Москва'))
+        self.assertEqual('pidor', self.index.get_command_name('/pidor'))
+        self.assertEqual('сы', self.index.get_command_name('СЫ'))
+        self.assertIsNone(self.index.get_command_name('сыр'))
+        self.assertIsNone(self.index.get_command_name(None))
+        self.assertIn('pidor', self.index.valid_cmds)
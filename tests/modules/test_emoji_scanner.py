@@ -0,0 +1,22 @@
+import unittest
+
+from src.utils.emoji_scanner import EmojiScanner, emoji_scanner
+
+
+class EmojiScannerTest(unittest.TestCase):
+    def test_sequences(self):
+        # цвет кожи, флаг, семья через ZWJ, VS16 -- по одному эмодзи
+        text = 'ну 👍🏽 🇷🇺 👨‍👩‍👧 ❤️ ☺️ привет 😂😂'
+        self.assertListEqual(['👍🏽', '🇷🇺', '👨‍👩‍👧', '❤️', '☺️', '😂', '😂'],
+                             emoji_scanner.findall(text))
+        self.assertEqual(7, emoji_scanner.count(text))
+
+    def test_plain_text(self):
+        self.assertEqual(0, emoji_scanner.count(''))
+        self.assertEqual(0, emoji_scanner.count('обычный текст #1 без эмодзи, 100500 * 2'))
+        self.assertListEqual(['#️⃣'], emoji_scanner.findall('#1 #️⃣'))
+
+    def test_unknown_zwj(self):
+        scanner = EmojiScanner(['😂', '🔥', '😂🔥'])
+        # склейка через ZWJ считается одной, даже если ее нет в таблице
+        self.assertListEqual(['😂🔥', '😂‍🔥', '🔥'], scanner.findall('x😂🔥 😂‍🔥 🔥‍'))
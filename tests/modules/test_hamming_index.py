@@ -0,0 +1,55 @@
+import unittest
+from contextlib import contextmanager
+
+from src.utils.hamming_index import HammingIndex, hamming_distance, iter_neighbours, split_bands
+
+
+class FakeCache:
+    def __init__(self):
+        self.sorted_sets = {}
+
+    @contextmanager
+    def batch(self):
+        yield self
+
+    def add_to_sorted_set(self, key, scores, time=None, min_score=None):
+        sorted_set = self.sorted_sets.setdefault(key, {})
+        sorted_set.update(scores)
+        if min_score is not None:
+            for member in [m for m, score in sorted_set.items() if score < min_score]:
+                del sorted_set[member]
+
+    def get_sorted_sets(self, keys):
+        return [list(self.sorted_sets.get(key, {}).items()) for key in keys]
+
+
+class HammingIndexTest(unittest.TestCase):
+    def test_helpers(self):
+        self.assertEqual(3, hamming_distance(0b1011, 0b0110))
+        self.assertListEqual([0x1234, 0x5678, 0x9abc, 0xdef0],
+                             split_bands(0x123456789abcdef0, 4, 16))
+        self.assertListEqual([0b101], list(iter_neighbours(0b101, 3, 0)))
+        self.assertListEqual([0b101, 0b100, 0b111, 0b001], list(iter_neighbours(0b101, 3, 1)))
+
+    def test_find(self):
+        index = HammingIndex(FakeCache(), 'test', ttl=100)
+        index.add(1, 'ffff0000ffff0000', 10)
+        # отличается на 3 бита в разных кусках
+        index.add(1, 'fffe0001ffff0001', 10)
+        # отличается на 6 бит, по 2 бита в трех кусках
+        index.add(1, 'fffc0003fffc0000', 10)
+        index.add(2, 'ffff0000ffff0000', 10)
+
+        self.assertListEqual([('ffff0000ffff0000', 0), ('fffe0001ffff0001', 3)],
+                             index.find(1, 'ffff0000ffff0000', max_distance=3))
+        self.assertListEqual([('ffff0000ffff0000', 0), ('fffe0001ffff0001', 3),
+                              ('fffc0003fffc0000', 6)],
+                             index.find(1, 'ffff0000ffff0000', max_distance=7))
+        self.assertListEqual([], index.find(3, 'ffff0000ffff0000', max_distance=7))
+
+    def test_ttl(self):
+        index = HammingIndex(FakeCache(), 'test', ttl=100)
+        index.add(1, 'ffff0000ffff0000', 10)
+        index.add(1, 'ffff0000ffff0001', 200)
+        self.assertListEqual([('ffff0000ffff0001', 0)],
+                             index.find(1, 'ffff0000ffff0001', max_distance=3))
@@ -0,0 +1,97 @@
+import unittest
+from unittest.mock import MagicMock, Mock, patch
+
+from src.utils.local_cache import LocalCache, MISSING, TieredCache
+
+
+class LocalCacheTest(unittest.TestCase):
+    def test_lru(self):
+        local = LocalCache(maxsize=2, ttl=60)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+        self.assertEqual(1, local.get('a'))
+        self.assertIs(MISSING, local.get('b'))
+        self.assertEqual(1, local.evictions)
+
+    def test_ttl(self):
+        local = LocalCache(ttl=10)
+        with patch('src.utils.local_cache.time.monotonic', return_value=100):
+            local.set('a', 1)
+            local.set('b', 2, ttl=1)
+        with patch('src.utils.local_cache.time.monotonic', return_value=105):
+            self.assertEqual(1, local.get('a'))
+            self.assertIs(MISSING, local.get('b'))
+
+    def test_none_is_cached(self):
+        local = LocalCache()
+        local.set('a', None)
+        self.assertIsNone(local.get('a'))
+        self.assertEqual({'hits': 1, 'misses': 0, 'evictions': 0, 'size': 1}, local.stats())
+
+    def test_generation(self):
+        local = LocalCache()
+        generation = local.get_generation()
+        local.invalidate('other')
+        local.set('a', 1, generation=generation)
+        self.assertIs(MISSING, local.get('a'))
+
+
+class TieredCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = Mock()
+        self.cache = MagicMock()
+        self.cache.batch.return_value.__enter__.return_value = self.cache
+        self.cache.get.return_value = 'value'
+        self.cache.get_many.side_effect = lambda keys: [f'{key}_value' for key in keys]
+        self.tiered = TieredCache(self.cache, LocalCache(), self.redis)
+
+    def test_get(self):
+        self.assertEqual('value', self.tiered.get('a'))
+        self.assertEqual('value', self.tiered.get('a'))
+        self.assertEqual(1, self.cache.get.call_count)
+
+    def test_get_many(self):
+        self.tiered.get('a')
+        self.assertListEqual(['value', 'b_value'], self.tiered.get_many(['a', 'b']))
+        self.cache.get_many.assert_called_once_with(['b'])
+
+    def test_missing_value(self):
+        self.cache.get.return_value = None
+        self.assertEqual('default', self.tiered.get('a', 'default'))
+        self.assertEqual('default', self.tiered.get('a', 'default'))
+        self.assertEqual(1, self.cache.get.call_count)
+
+    def test_set_publishes(self):
+        self.tiered.set('a', 'new', time=60)
+        self.assertEqual('new', self.tiered.get('a'))
+        self.cache.get.assert_not_called()
+        self.cache.batch.assert_called_once()
+        self.cache.set.assert_called_once_with('a', 'new', time=60)
+        self.cache.publish.assert_called_once()
+
+    def test_refresh(self):
+        self.tiered.get('a')
+        self.cache.expire.return_value = True
+        self.tiered.refresh('a', 'new', time=60)
+        self.cache.expire.assert_called_once_with('a', 60)
+        self.cache.set.assert_not_called()
+        self.cache.publish.assert_not_called()
+        self.assertEqual('value', self.tiered.get('a'))
+
+    def test_refresh_expired(self):
+        self.cache.expire.return_value = False
+        self.tiered.refresh('a', 'new', time=60)
+        self.cache.set.assert_called_once_with('a', 'new', time=60)
+        self.cache.publish.assert_called_once()
+        self.assertEqual('new', self.tiered.get('a'))
+
+    def test_invalidation_from_other_process(self):
+        other = TieredCache(self.cache, LocalCache(), self.redis)
+        self.tiered.get('a')
+        other.delete('a')
+        channel, data = self.cache.publish.call_args[0]
+        self.tiered._TieredCache__on_message({'channel': channel, 'data': data})
+        self.tiered.get('a')
+        self.assertEqual(2, self.cache.get.call_count)
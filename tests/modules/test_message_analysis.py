@@ -0,0 +1,60 @@
+import unittest
+from unittest.mock import Mock
+
+import telegram
+
+from src.utils.message_analysis import MessageAnalysis
+
+
+def create_message(text=None, caption=None, entities=None) -> telegram.Message:
+    message: telegram.Message = Mock(text=text, caption=caption)
+    message.parse_entities = Mock(return_value=entities if entities else {})
+    return message
+
+
+def create_entity(entity_type: str, user=None) -> telegram.MessageEntity:
+    return Mock(type=entity_type, user=user)
+
+
+class MessageAnalysisTest(unittest.TestCase):
+    def test_same_analysis_for_message(self):
+        message = create_message('текст')
+        self.assertIs(MessageAnalysis.get(message), MessageAnalysis.get(message))
+        self.assertIsNot(MessageAnalysis.get(message), MessageAnalysis.get(create_message('текст')))
+
+    def test_entities_parsed_once(self):
+        url = create_entity('url')
+        mention = create_entity('mention')
+        user = Mock(id=1)
+        text_mention = create_entity('text_mention', user=user)
+        message = create_message('text', entities={
+            url: 'https://example.com/cat.jpg',
+            mention: '@user1',
+            text_mention: 'Юзер',
+        })
+        analysis = MessageAnalysis.get(message)
+        self.assertListEqual(['https://example.com/cat.jpg'], analysis.urls)
+        self.assertListEqual(['user1'], analysis.mentions)
+        self.assertListEqual([user], analysis.text_mentions)
+        self.assertEqual(1, message.parse_entities.call_count)
+
+    def test_text(self):
+        analysis = MessageAnalysis.get(create_message('Я ещё   не ВСЁ сказал, мне блять можно'))
+        self.assertEqual('я ещё   не всё сказал, мне блять можно', analysis.lower)
+        self.assertEqual('я еще   не все сказал, мне блять можно', analysis.lower_ye)
+        self.assertEqual(8, len(analysis.words))
+        self.assertListEqual(['я', 'мне'], analysis.pronouns)
+        self.assertListEqual(['блять'], analysis.obscene_words)
+
+    def test_caption(self):
+        analysis = MessageAnalysis.get(create_message(caption='Меня'))
+        self.assertIsNone(analysis.text)
+        self.assertEqual('Меня', analysis.text_or_caption)
+        self.assertListEqual(['меня'], analysis.pronouns)
+
+    def test_empty(self):
+        analysis = MessageAnalysis.get(create_message())
+        self.assertEqual('', analysis.lower)
+        self.assertListEqual([], analysis.words)
+        self.assertListEqual([], analysis.obscene_words)
+        self.assertListEqual([], analysis.urls)
@@ -0,0 +1,71 @@
+import unittest
+
+from src.utils.metrics import Histogram, MetricsRegistry
+
+
+class HistogramTest(unittest.TestCase):
+    def test_observe(self):
+        histogram = Histogram([0.1, 1, 0.01])
+        for value in (0.005, 0.05, 0.05, 0.5, 2):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(5, snapshot['count'])
+        self.assertAlmostEqual(2.605, snapshot['sum'])
+        self.assertEqual(2, snapshot['max'])
+        self.assertDictEqual({0.01: 1, 0.1: 3, 1: 4}, snapshot['buckets'])
+
+    def test_percentile(self):
+        histogram = Histogram([0.01, 0.1, 1])
+        self.assertEqual(0, histogram.percentile(0.5))
+        for value in [0.001] * 98 + [0.5, 3]:
+            histogram.observe(value)
+        self.assertEqual(0.01, histogram.percentile(0.5))
+        self.assertEqual(1, histogram.percentile(0.99))
+        self.assertEqual(3, histogram.percentile(1))
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = MetricsRegistry(buckets=[0.1, 1])
+
+    def test_timer(self):
+        @self.metrics.timer('function')
+        def fail():
+            raise ValueError()
+
+        with self.metrics.timed('redis', 'GET'):
+            pass
+        with self.assertRaises(ValueError):
+            fail()
+        text = self.metrics.render()
+        self.assertIn('bot_redis_seconds_bucket{name="GET",le="0.1"} 1\n', text)
+        self.assertIn('bot_redis_seconds_count{name="GET"} 1\n', text)
+        self.assertIn('bot_redis_errors_total{name="GET"} 0\n', text)
+        name = 'MetricsRegistryTest.test_timer.<locals>.fail'
+        self.assertIn(f'bot_function_seconds_bucket{{name="{name}",le="+Inf"}} 1\n', text)
+        self.assertIn(f'bot_function_errors_total{{name="{name}"}} 1\n', text)
+
+    def test_render(self):
+        self.metrics.observe('sql', 'SELECT "users"', 0.5)
+        self.metrics.observe('sql', 'SELECT "users"', 2, error=True)
+        self.assertEqual(
+            '# TYPE bot_sql_seconds histogram\n'
+            'bot_sql_seconds_bucket{name="SELECT \\"users\\"",le="0.1"} 0\n'
+            'bot_sql_seconds_bucket{name="SELECT \\"users\\"",le="1"} 1\n'
+            'bot_sql_seconds_bucket{name="SELECT \\"users\\"",le="+Inf"} 2\n'
+            'bot_sql_seconds_sum{name="SELECT \\"users\\""} 2.5\n'
+            'bot_sql_seconds_count{name="SELECT \\"users\\""} 2\n'
+            '# TYPE bot_sql_errors_total counter\n'
+            'bot_sql_errors_total{name="SELECT \\"users\\""} 1\n',
+            self.metrics.render())
+
+    def test_series(self):
+        self.metrics.observe('redis', 'GET', 0.01)
+        self.metrics.observe('redis', 'GET', 0.01, error=True)
+        self.metrics.observe('sql', 'SELECT users', 0.01)
+        self.assertListEqual(['GET'], list(self.metrics.series('redis')))
+        self.assertEqual(2, self.metrics.series('redis')['GET'].count)
+        self.assertDictEqual({'GET': 1}, self.metrics.errors('redis'))
+        self.metrics.reset()
+        self.assertDictEqual({}, self.metrics.series('redis'))
+        self.assertEqual('\n', self.metrics.render())
@@ -0,0 +1,67 @@
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+
+from src.utils.mwt import MWT
+
+
+def memoize(mock: Mock, **kwargs):
+    def f(*args, **kw):
+        return mock(*args, **kw)
+
+    return MWT(**kwargs)(f)
+
+
+class MWTTest(unittest.TestCase):
+    def test_memoize(self):
+        f = Mock(side_effect=lambda x, y=0: x + y)
+        memoized = memoize(f, timeout=60)
+        self.assertEqual(3, memoized(1, y=2))
+        self.assertEqual(3, memoized(1, y=2))
+        self.assertEqual(1, memoized(1))
+        self.assertEqual(2, f.call_count)
+        self.assertEqual({'hits': 1, 'misses': 2, 'evictions': 0, 'size': 2}, memoized.stats())
+
+    def test_maxsize(self):
+        f = Mock(side_effect=lambda x: x)
+        memoized = memoize(f, timeout=60, maxsize=2)
+        for x in (1, 2, 3, 1):
+            memoized(x)
+        self.assertEqual(4, f.call_count)
+        self.assertEqual(2, memoized.stats()['size'])
+
+    def test_invalidate(self):
+        f = Mock(return_value='value')
+        memoized = memoize(f, timeout=60)
+        memoized(1)
+        memoized.invalidate(1)
+        memoized(1)
+        memoized.clear()
+        memoized(1)
+        self.assertEqual(3, f.call_count)
+
+    def test_exceptions_are_not_cached(self):
+        f = Mock(side_effect=[ValueError, 'value'])
+        memoized = memoize(f, timeout=60)
+        with self.assertRaises(ValueError):
+            memoized(1)
+        self.assertEqual('value', memoized(1))
+
+    def test_single_flight(self):
+        calls = []
+
+        def slow(x):
+            calls.append(x)
+            time.sleep(0.05)
+            return x
+
+        memoized = MWT(timeout=60)(slow)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(memoized(1))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertListEqual([1], calls)
+        self.assertListEqual([1] * 10, results)
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from src.utils.profiler import SamplingProfiler
+
+
+def busy_loop(running: list) -> None:
+    # без вызовов питоновских функций, чтобы верхним кадром всегда был busy_loop
+    while running:
+        sum(range(100))
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.running = [True]
+        self.future = Future()
+        self.threads = [threading.Thread(target=busy_loop, args=(self.running,), name='worker_12'),
+                        threading.Thread(target=self.future.result, args=(5,), name='blocked')]
+        for thread in self.threads:
+            thread.start()
+        # поток пула, который ждет работу
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.executor.submit(int).result()
+        # даем потокам дойти до ожидания
+        time.sleep(0.1)
+
+    def tearDown(self):
+        self.running.clear()
+        self.future.set_result(None)
+        for thread in self.threads:
+            thread.join()
+        self.executor.shutdown()
+        shutil.rmtree(self.directory)
+
+    def test_sample(self):
+        # сэмплы снимаются вручную, поток профайлера только пишет файл при остановке
+        profiler = SamplingProfiler(self.directory, interval=60)
+        profiler.start()
+        for _ in range(5):
+            profiler.sample()
+        path = profiler.stop()
+
+        self.assertTrue(path.startswith(self.directory))
+        with open(path, encoding='utf-8') as file:
+            lines = file.read().splitlines()
+        busy = [line for line in lines if line.startswith('worker_N;')]
+        self.assertEqual(1, len(busy))
+        self.assertTrue(busy[0].endswith(':busy_loop 5'))
+        self.assertIn('threading:run;', busy[0])
+        # ожидание не в пуле пишется с пометкой
+        blocked = [line for line in lines if line.startswith('blocked;')]
+        self.assertEqual(1, len(blocked))
+        self.assertIn(':result;threading:wait;idle 5', blocked[0])
+        # поток пула, который ждет работу, только считается
+        self.assertFalse([line for line in lines if ':_worker' in line])
+        self.assertGreaterEqual(profiler.idle, 5)
+        self.assertFalse(os.path.exists(f'{path}.tmp'))
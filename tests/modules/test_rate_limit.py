@@ -0,0 +1,34 @@
+import unittest
+from unittest.mock import patch
+
+from src.utils.rate_limit import SendRateLimiter, TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+    @patch('src.utils.rate_limit.time.monotonic')
+    def test_reserve(self, monotonic):
+        monotonic.return_value = 100.0
+        bucket = TokenBucket(rate=2, capacity=2)
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(0, bucket.reserve())
+        # токены кончились: встаем в очередь друг за другом
+        self.assertAlmostEqual(0.5, bucket.reserve())
+        self.assertAlmostEqual(1.0, bucket.reserve())
+
+        monotonic.return_value = 110.0
+        # больше capacity не накапливается
+        self.assertEqual(0, bucket.reserve())
+        self.assertEqual(0, bucket.reserve())
+        self.assertAlmostEqual(0.5, bucket.reserve())
+
+
+class SendRateLimiterTest(unittest.TestCase):
+    def test_chat_buckets(self):
+        limiter = SendRateLimiter(per_second=30, group_per_minute=20, group_burst=3)
+        group = limiter.get_chat_bucket(-100500)
+        self.assertIs(group, limiter.get_chat_bucket(-100500))
+        self.assertAlmostEqual(20 / 60, group.rate)
+        self.assertEqual(3, group.capacity)
+        private = limiter.get_chat_bucket(42)
+        self.assertEqual(1, private.rate)
+        self.assertIsNot(group, private)
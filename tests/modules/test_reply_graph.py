@@ -0,0 +1,40 @@
+import unittest
+
+from src.utils.reply_graph import ReplyGraph, DRAGON_UID
+
+
+class ReplyGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.db = {
+            'pair': {'1,2': 10, '1,3': 20, '2,3': 7, '3,3': 100, '1,4': 4, '4,5': 8, '2,6': 6},
+            'inbound': {1: {2: 10, 3: 4}, 2: {2: 50, 1: 6, 3: 9}, 3: {4: 3}},
+            'outbound': {1: {3: 8}, 5: {1: 100}},
+        }
+
+    def test_pairs(self):
+        graph = ReplyGraph(self.db)
+        self.assertListEqual([3, 2], graph.get_pair_candidates(1))
+        # пара с самим собой не считается, меньше 5 реплаев -- тоже
+        self.assertListEqual([1, 2], graph.get_pair_candidates(3))
+        self.assertListEqual([5], graph.get_pair_candidates(4))
+        self.assertListEqual([], graph.get_pair_candidates(100))
+
+    def test_tops(self):
+        graph = ReplyGraph(self.db)
+        self.assertEqual(2, graph.get_inbound(1))
+        # себя пропускаем
+        self.assertEqual(3, graph.get_inbound(2))
+        self.assertIsNone(graph.get_inbound(3))
+        self.assertEqual(3, graph.get_outbound(1))
+        self.assertIsNone(graph.get_outbound(2))
+
+    def test_config(self):
+        graph = ReplyGraph(self.db, ignore=[5], dragon_lovers=[6], ignore_pairs={'1': [3]})
+        self.assertListEqual([2], graph.get_pair_candidates(1))
+        # 1 игнорирует 3, но не наоборот
+        self.assertListEqual([1, 2], graph.get_pair_candidates(3))
+        self.assertListEqual([1, 3], graph.get_pair_candidates(2))
+        self.assertListEqual([], graph.get_pair_candidates(4))
+        self.assertListEqual([DRAGON_UID], graph.get_pair_candidates(6))
+        self.assertIsNone(graph.get_outbound(1))
+        self.assertIsNone(graph.get_outbound(5))
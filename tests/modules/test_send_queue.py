@@ -0,0 +1,103 @@
+import threading
+import unittest
+
+from src.utils.rate_limit import SendRateLimiter
+from src.utils.send_queue import SendQueue, SendQueueFull
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'retry after {retry_after}')
+        self.retry_after = retry_after
+
+
+class SendQueueTest(unittest.TestCase):
+    def setUp(self):
+        limiter = SendRateLimiter(per_second=1000, group_per_minute=60000, private_per_second=1000,
+                                  group_burst=1000)
+        self.queue = SendQueue(limiter, maxsize=3, workers=4)
+        self.sent = []
+
+    def tearDown(self):
+        self.queue.stop(timeout=5)
+
+    def send(self, chat_id, text):
+        self.sent.append((chat_id, text))
+        return text
+
+    def test_not_started(self):
+        self.assertEqual('hi', self.queue.put(1, self.send, 1, 'hi').result())
+        self.assertListEqual([(1, 'hi')], self.sent)
+
+    def test_bad_chat_id(self):
+        self.queue.start()
+        with self.assertRaises(ValueError):
+            self.queue.put(None, self.send, None, 'lost').result(timeout=5)
+        # чат None не занят навсегда, и место в очереди не потеряно
+        self.assertEqual('ok', self.queue.put('@channel', self.send, '@channel', 'ok')
+                         .result(timeout=5))
+        self.assertEqual(0, self.queue.stats()['size'])
+        self.assertListEqual([('@channel', 'ok')], self.sent)
+
+    def test_cancel(self):
+        # отмененное до отправки сообщение не уходит
+        release = threading.Event()
+        self.queue.start()
+        first = self.queue.put(-1, lambda: release.wait(5))
+        cancelled = self.queue.put(-1, self.send, -1, 'cancelled')
+        self.assertTrue(cancelled.cancel())
+        release.set()
+        first.result(timeout=5)
+        self.assertEqual('next', self.queue.put(-1, self.send, -1, 'next').result(timeout=5))
+        self.assertListEqual([(-1, 'next')], self.sent)
+
+    def test_priority_and_order(self):
+        # пока первое сообщение отправляется, остальные копятся в очереди
+        release = threading.Event()
+        self.queue.start()
+        first = self.queue.put(-1, lambda: release.wait(5))
+        low = [self.queue.put(-1, self.send, -1, f'low{i}', priority=SendQueue.LOW)
+               for i in range(2)]
+        high = self.queue.put(-1, self.send, -1, 'high', priority=SendQueue.HIGH)
+        release.set()
+        for future in [first, high] + low:
+            future.result(timeout=5)
+        self.assertListEqual(['high', 'low0', 'low1'], [text for _, text in self.sent])
+
+    def test_coalesce_and_backpressure(self):
+        release = threading.Event()
+        self.queue.start()
+        self.queue.put(-1, lambda: release.wait(5))
+        first = self.queue.put(-1, self.send, -1, '1 like', coalesce_key='buttons')
+        second = self.queue.put(-1, self.send, -1, '2 likes', coalesce_key='buttons')
+        self.assertIs(first, second)
+        self.queue.put(-1, self.send, -1, 'normal')
+        with self.assertRaises(SendQueueFull):
+            self.queue.put(-1, self.send, -1, 'dropped').result()
+        high = self.queue.put(-1, self.send, -1, 'high', priority=SendQueue.HIGH)
+        release.set()
+        self.assertEqual('2 likes', first.result(timeout=5))
+        high.result(timeout=5)
+        self.queue.stop(timeout=5)
+        self.assertListEqual(['high', '2 likes', 'normal'], [text for _, text in self.sent])
+        stats = self.queue.stats()
+        self.assertEqual(1, stats['coalesced'])
+        self.assertEqual(1, stats['dropped'])
+        self.assertEqual(0, stats['size'])
+
+    def test_retry_after(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RetryAfter(0.01)
+            return 'ok'
+
+        self.queue.start()
+        self.assertEqual('ok', self.queue.put(1, flaky).result(timeout=5))
+        self.assertEqual(1, self.queue.stats()['retry_after'])
+
+        with self.assertRaises(ValueError):
+            self.queue.put(1, int, 'not a number').result(timeout=5)
+        self.assertEqual(1, self.queue.stats()['failed'])
@@ -0,0 +1,23 @@
+import unittest
+from concurrent.futures import Future
+
+from src.utils.telegram_helpers import QueuedMessage, wait_sent
+
+
+class WaitSentTest(unittest.TestCase):
+    def test_queued(self):
+        future = Future()
+        future.set_result('message')
+        self.assertEqual('message', wait_sent(QueuedMessage(future)))
+
+    def test_queued_error(self):
+        # ошибка отправки из очереди доходит до запасного варианта вызывающего
+        future = Future()
+        future.set_exception(ValueError('chat not found'))
+        with self.assertRaises(ValueError):
+            wait_sent(QueuedMessage(future))
+
+    def test_not_queued(self):
+        # обычный telegram.Bot и потоки очереди отправляют сразу
+        message = object()
+        self.assertIs(message, wait_sent(message))